@@ -1,5 +1,7 @@
-from app import app, db, generate_tracking_number
+from app import app, db
 from models import Parcel, TrackingUpdate, Customer
+from parcel_summary import backfill_summaries
+from tracking_numbers import tracking_numbers
 from datetime import datetime, timedelta
 
 with app.app_context():
@@ -17,8 +19,8 @@ with app.app_context():
         db.session.commit()
 
     # Add parcels as before
-    for i in range(8):
-        tracking_number = generate_tracking_number()
+    parcel_ids = []
+    for i, tracking_number in enumerate(tracking_numbers.allocate(8)):
         parcel = Parcel(
             tracking_number=tracking_number,
             sender_id=customer1.id,
@@ -38,10 +40,12 @@ with app.app_context():
 
         # Create tracking updates
         tracking_updates = [
-    TrackingUpdate(parcel_id=parcel.tracking_number, status='Dispatched', location='Warehouse A', description='Left the facility'),
-    TrackingUpdate(parcel_id=parcel.tracking_number, status='In Transit', location='Distribution Center', description='On the way')
+    TrackingUpdate(parcel_id=parcel.id, status='Dispatched', location='Warehouse A', description='Left the facility'),
+    TrackingUpdate(parcel_id=parcel.id, status='In Transit', location='Distribution Center', description='On the way')
     ]  
         db.session.bulk_save_objects(tracking_updates)
+        parcel_ids.append(parcel.id)
 
     db.session.commit()
+    backfill_summaries(parcel_ids=parcel_ids)
     print("8 demo parcels with tracking updates added.")
@@ -0,0 +1,236 @@
+# admission.py
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import g, jsonify, request
+
+# Admission control, checked before a view runs and so before any DB work:
+#   * token buckets on the unauthenticated tracking lookup, one per client
+#     (429 when empty) and one shared by all clients (503 when empty);
+#   * in-flight limits per route class in each worker process. Reads may
+#     not take the last ADMISSION_WRITE_RESERVED slots, so writes still get
+#     in while reads pile up (503 when full).
+# Buckets live in process memory, or with ADMISSION_BACKEND set to
+# 'sqlite:///<path>' in a local SQLite file shared by all workers.
+
+WRITE_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
+TRACK_ENDPOINTS = frozenset({'parcels.track_parcel'})
+# Long-lived streams and operational endpoints are not limited.
+EXEMPT_ENDPOINTS = frozenset({
+    'parcels.track_parcel_events', 'get_courier_events', 'index', 'health', 'prometheus_metrics', 'static',
+})
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+class MemoryBuckets:
+    """Token buckets in this process, dropping the least recently used past ``max_keys``."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, buckets):
+        """Take a token from every (key, rate, burst) bucket, or from none.
+
+        Returns (None, 0) when admitted, else the index of the first empty
+        bucket and the seconds until it holds a token.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for index, (key, rate, burst) in enumerate(buckets):
+                tokens, updated = self._buckets.get(key, (burst, now))
+                tokens = refill(tokens, updated, now, rate, burst)
+                if tokens < 1:
+                    return index, (1 - tokens) / rate
+                levels.append(tokens - 1)
+            for (key, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return None, 0
+
+
+class SQLiteBuckets:
+    """Token buckets shared by every worker process through a local SQLite file.
+
+    Each decision is one BEGIN IMMEDIATE transaction; buckets that have
+    been idle for an hour are pruned every PRUNE_EVERY decisions.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._decisions = 0
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS token_bucket ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, buckets):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for index, (key, rate, burst) in enumerate(buckets):
+                row = conn.execute('SELECT tokens, updated FROM token_bucket WHERE key = ?', (key,)).fetchone()
+                tokens = refill(*(row or (burst, now)), now, rate, burst)
+                if tokens < 1:
+                    conn.execute('ROLLBACK')
+                    return index, (1 - tokens) / rate
+                levels.append((key, tokens - 1, now))
+            conn.executemany(
+                'INSERT INTO token_bucket (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                levels,
+            )
+            self._decisions += 1
+            if self._decisions % self.PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM token_bucket WHERE updated < ?', (now - 3600,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return None, 0
+
+
+def route_class(endpoint, method):
+    if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+        return None
+    if method in WRITE_METHODS:
+        return 'write'
+    if endpoint in TRACK_ENDPOINTS:
+        return 'track'
+    return 'read'
+
+
+class Admission:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.buckets = MemoryBuckets()
+        self.client_rate, self.client_burst = 5.0, 20.0
+        self.global_rate, self.global_burst = 200.0, 400.0
+        self.trust_proxy = False
+        self.max_concurrent = 16
+        self.write_reserved = 4
+        self.track_concurrent = 8
+        self.decisions = defaultdict(int)
+        self._in_flight = defaultdict(int)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config.get('ADMISSION_ENABLED', True)
+        self.client_rate = float(config.get('ADMISSION_CLIENT_RATE', self.client_rate))
+        self.client_burst = float(config.get('ADMISSION_CLIENT_BURST', self.client_burst))
+        self.global_rate = float(config.get('ADMISSION_GLOBAL_RATE', self.global_rate))
+        self.global_burst = float(config.get('ADMISSION_GLOBAL_BURST', self.global_burst))
+        self.trust_proxy = config.get('ADMISSION_TRUST_PROXY', False)
+        self.max_concurrent = int(config.get('ADMISSION_MAX_CONCURRENT', self.max_concurrent))
+        self.write_reserved = int(config.get('ADMISSION_WRITE_RESERVED', self.write_reserved))
+        self.track_concurrent = int(config.get('ADMISSION_TRACK_CONCURRENT', self.track_concurrent))
+        backend = config.get('ADMISSION_BACKEND') or 'memory'
+        if backend.startswith('sqlite:///'):
+            path = backend[len('sqlite:///'):]
+            if not os.path.isabs(path):
+                path = os.path.join(app.instance_path, path)
+                os.makedirs(app.instance_path, exist_ok=True)
+            self.buckets = SQLiteBuckets(path)
+        elif backend == 'memory':
+            self.buckets = MemoryBuckets(int(config.get('ADMISSION_MAX_CLIENTS', 100000)))
+        else:
+            raise ValueError(f'Unsupported ADMISSION_BACKEND: {backend}')
+        if self.enabled:
+            app.before_request(self._admit)
+            app.teardown_request(self._release)
+        app.extensions['admission'] = self
+
+    def client_id(self):
+        if self.trust_proxy and request.access_route:
+            return request.access_route[0]
+        return request.remote_addr or 'unknown'
+
+    def _reject(self, decision, status, retry_after, message):
+        with self._lock:
+            self.decisions[(g.admission_class, decision)] += 1
+        response = jsonify({'error': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def _admit(self):
+        g.admission_class = route_class(request.endpoint, request.method)
+        if g.admission_class is None:
+            return None
+
+        if g.admission_class == 'track':
+            failed, retry_after = self.buckets.take([
+                (f'client:{self.client_id()}', self.client_rate, self.client_burst),
+                ('global:track', self.global_rate, self.global_burst),
+            ])
+            if failed == 0:
+                return self._reject('client_rate_limited', 429, retry_after, 'Too many tracking requests')
+            if failed == 1:
+                return self._reject('global_rate_limited', 503, retry_after, 'Tracking is busy, try again shortly')
+
+        with self._lock:
+            total = sum(self._in_flight.values())
+            limit = self.max_concurrent if g.admission_class == 'write' else self.max_concurrent - self.write_reserved
+            full = total >= limit or (g.admission_class == 'track'
+                                      and self._in_flight['track'] >= self.track_concurrent)
+            if not full:
+                self._in_flight[g.admission_class] += 1
+                self.decisions[(g.admission_class, 'admitted')] += 1
+                g.admission_slot = True
+        if full:
+            return self._reject('overloaded', 503, 1, 'Server busy, try again shortly')
+        return None
+
+    def _release(self, exc=None):
+        if g.pop('admission_slot', False):
+            with self._lock:
+                self._in_flight[g.admission_class] -= 1
+
+    def in_flight(self):
+        with self._lock:
+            return dict(self._in_flight)
+
+
+def admission_samples():
+    """Limiter decisions and in-flight requests by route class."""
+    samples = [
+        ('admission_decisions_total', 'counter', 'Admission decisions by route class.',
+         {'route_class': route, 'decision': decision}, count)
+        for (route, decision), count in sorted(admission.decisions.items())
+    ]
+    samples += [
+        ('admission_in_flight', 'gauge', 'Requests being served by route class.', {'route_class': route}, count)
+        for route, count in sorted(admission.in_flight().items())
+    ]
+    return samples
+
+
+admission = Admission()
@@ -0,0 +1,74 @@
+# api_keys.py
+import hashlib
+import hmac
+import json
+import secrets
+from functools import wraps
+
+import click
+from flask import current_app, g, jsonify, request
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from models import db, ApiKey, Customer
+
+# The merchant API (/webhooks) takes `Authorization: Bearer <key>`. A
+# merchant is a customer row standing for the business, with keys from
+# `flask issue-api-key`; parcels created with its key carry its id in
+# parcel.merchant_id. ADMIN_API_KEY is the operators' key and sees every
+# merchant's data.
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def issue_key(customer_id):
+    """A new API key for the customer; only its hash is kept."""
+    key = secrets.token_urlsafe(32)
+    db.session.add(ApiKey(customer_id=customer_id, key_hash=hash_key(key)))
+    db.session.commit()
+    return key
+
+
+def authenticate(key):
+    """(is_admin, merchant_id) for a key, or None when it is not valid."""
+    admin_key = current_app.config.get('ADMIN_API_KEY')
+    if admin_key and hmac.compare_digest(key.encode(), admin_key.encode()):
+        return True, None
+    merchant_id = db.session.scalar(select(ApiKey.customer_id).where(ApiKey.key_hash == hash_key(key)))
+    return (False, merchant_id) if merchant_id is not None else None
+
+
+def _authorize(view, required):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+        credential = authenticate(key.strip()) if scheme.lower() == 'bearer' and key.strip() else None
+        if credential is None and (required or 'Authorization' in request.headers):
+            response = jsonify({'error': 'A merchant or admin API key is required'})
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, 401
+        g.is_admin, g.merchant_id = credential or (False, None)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def merchant_required(view):
+    """Reject requests without a merchant or admin key; sets g.merchant_id, None for the admin."""
+    return _authorize(view, required=True)
+
+
+def merchant_optional(view):
+    """As merchant_required, but a request without any key goes through with no merchant."""
+    return _authorize(view, required=False)
+
+
+@click.command('issue-api-key')
+@click.argument('customer_id', type=int)
+@with_appcontext
+def issue_api_key_command(customer_id):
+    """Issue a merchant API key for a customer; it is shown only once."""
+    if db.session.get(Customer, customer_id) is None:
+        raise click.ClickException(f'No customer {customer_id}')
+    click.echo(json.dumps({'customer_id': customer_id, 'api_key': issue_key(customer_id)}))
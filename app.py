@@ -1,8 +1,6 @@
 import os
-import random
-import string
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, session
+from flask import Flask, g, request, jsonify, session
 from parcels import parcels_bp
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -12,6 +10,9 @@ import logging
 # Load environment variables
 load_dotenv()
 
+# Logging
+logging.basicConfig(level=logging.INFO)
+
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # Optional, avoids HTTPS errors in dev
 
 
@@ -30,7 +31,7 @@ CORS(app, supports_credentials=True, resources={r"/*": {"origins": [
     "http://localhost:5173",
     "https://comforting-syrniki-99725d.netlify.app",
     "https://parcel-delivery-frontend.netlify.app"
-]}}, methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+]}}, methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"], expose_headers=["X-Next-Cursor", "X-Change-Cursor", "ETag"])
 
  
 
@@ -39,29 +40,191 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-unsafe')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///parcel_delivery.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Engine profile: 'web' (WAL SQLite / pooled server DB tuned for gunicorn
+# workers), 'worker' for CLI jobs, or 'default' for the driver defaults.
+# The DB_* / SQLITE_* settings override single values of the profile.
+app.config['DB_PROFILE'] = os.getenv('DB_PROFILE', 'web')
+for key in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_RECYCLE', 'DB_STATEMENT_TIMEOUT_MS', 'SQLITE_BUSY_TIMEOUT_MS'):
+    app.config[key] = os.getenv(key)
+
+# Tracking cache: 'memory' for a per-worker LRU, or 'sqlite:///<path>' for a
+# cache shared across gunicorn workers
+app.config['TRACKING_CACHE_BACKEND'] = os.getenv('TRACKING_CACHE_BACKEND', 'memory')
+app.config['TRACKING_CACHE_TTL'] = float(os.getenv('TRACKING_CACHE_TTL', '30'))
+app.config['TRACKING_CACHE_MAX_ENTRIES'] = int(os.getenv('TRACKING_CACHE_MAX_ENTRIES', '10000'))
+
+# Threads per gunicorn worker; the Procfile passes it as --threads, and the
+# per-worker limits below default to shares of it
+app.config['WEB_THREADS'] = int(os.getenv('WEB_THREADS', '16'))
+
+# Tracking event fan-out: 'local' for a single process, or 'file://<path>'
+# to share events between gunicorn workers through an append-only file.
+# Under gunicorn each open event stream holds a thread, so a worker serves
+# at most EVENTS_MAX_STREAMS of them; asgi.py serves streams without one.
+app.config['EVENTS_BROKER'] = os.getenv('EVENTS_BROKER', 'local')
+app.config['EVENTS_HEARTBEAT'] = float(os.getenv('EVENTS_HEARTBEAT', '15'))
+app.config['EVENTS_MAX_STREAMS'] = int(os.getenv('EVENTS_MAX_STREAMS', max(1, app.config['WEB_THREADS'] // 4)))
+
+# Write-behind ingestion of status updates: requests are journaled and
+# answered with 202, and a background writer group-commits them
+app.config['WRITE_BEHIND_ENABLED'] = os.getenv('WRITE_BEHIND_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['WRITE_BEHIND_DIR'] = os.getenv('WRITE_BEHIND_DIR')
+app.config['WRITE_BEHIND_MAX_BATCH'] = int(os.getenv('WRITE_BEHIND_MAX_BATCH', '500'))
+app.config['WRITE_BEHIND_MAX_LATENCY'] = float(os.getenv('WRITE_BEHIND_MAX_LATENCY', '0.05'))
+app.config['WRITE_BEHIND_MAX_DEPTH'] = int(os.getenv('WRITE_BEHIND_MAX_DEPTH', '10000'))
+
+# Seconds between rebuilds of each worker's courier load index from the DB
+app.config['ASSIGNMENT_REBUILD_INTERVAL'] = float(os.getenv('ASSIGNMENT_REBUILD_INTERVAL', '300'))
+
+# Request metrics: set METRICS_DIR to a directory shared by all gunicorn
+# workers so /metrics covers the whole deployment
+app.config['METRICS_DIR'] = os.getenv('METRICS_DIR')
+app.config['SLOW_REQUEST_SECONDS'] = float(os.getenv('SLOW_REQUEST_SECONDS', '1.0'))
+
+# Responses of at least this many bytes are gzip/brotli encoded when the
+# client accepts it (brotli needs the optional 'brotli' package)
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+
+# Geocoder for customer addresses: 'offline' hashes addresses to points
+# inside GEOCODER_BOUNDS (south,west,north,east); 'module:Class' plugs in
+# a real one. Route plans stop improving after ROUTE_TIME_BUDGET seconds.
+app.config['GEOCODER'] = os.getenv('GEOCODER', 'offline')
+app.config['GEOCODER_BOUNDS'] = os.getenv('GEOCODER_BOUNDS')
+app.config['ROUTE_TIME_BUDGET'] = float(os.getenv('ROUTE_TIME_BUDGET', '0.5'))
+app.config['ROUTE_CACHE_TTL'] = float(os.getenv('ROUTE_CACHE_TTL', '3600'))
+
+# Admission control: token buckets on /parcels/track per client and for
+# all clients ('memory' per worker, or 'sqlite:///<path>' shared), and
+# per-worker in-flight limits that keep ADMISSION_WRITE_RESERVED slots for
+# writes. A worker never runs more than WEB_THREADS requests at once, less
+# the threads held by event streams (which are not limited here), so the
+# total defaults to what is left. Set ADMISSION_TRUST_PROXY behind a proxy
+# that sets X-Forwarded-For.
+app.config['ADMISSION_ENABLED'] = os.getenv('ADMISSION_ENABLED', '1').lower() in ('1', 'true', 'yes')
+app.config['ADMISSION_BACKEND'] = os.getenv('ADMISSION_BACKEND', 'memory')
+app.config['ADMISSION_CLIENT_RATE'] = float(os.getenv('ADMISSION_CLIENT_RATE', '5'))
+app.config['ADMISSION_CLIENT_BURST'] = float(os.getenv('ADMISSION_CLIENT_BURST', '20'))
+app.config['ADMISSION_GLOBAL_RATE'] = float(os.getenv('ADMISSION_GLOBAL_RATE', '200'))
+app.config['ADMISSION_GLOBAL_BURST'] = float(os.getenv('ADMISSION_GLOBAL_BURST', '400'))
+app.config['ADMISSION_TRUST_PROXY'] = os.getenv('ADMISSION_TRUST_PROXY', '').lower() in ('1', 'true', 'yes')
+app.config['ADMISSION_MAX_CONCURRENT'] = int(os.getenv(
+    'ADMISSION_MAX_CONCURRENT', max(2, app.config['WEB_THREADS'] - app.config['EVENTS_MAX_STREAMS'])))
+app.config['ADMISSION_WRITE_RESERVED'] = int(os.getenv('ADMISSION_WRITE_RESERVED',
+                                                       max(1, app.config['ADMISSION_MAX_CONCURRENT'] // 4)))
+app.config['ADMISSION_TRACK_CONCURRENT'] = int(os.getenv('ADMISSION_TRACK_CONCURRENT',
+                                                         max(1, app.config['ADMISSION_MAX_CONCURRENT'] // 2)))
+
+# Tracking numbers: sequence blocks reserved per worker, and a Bloom filter
+# that answers lookups of codes that cannot exist without the database.
+# TRACKING_NUMBER_KEY scrambles the sequence; never change it once set.
+app.config['TRACKING_NUMBER_KEY'] = os.getenv('TRACKING_NUMBER_KEY')
+app.config['TRACKING_NUMBER_BLOCK'] = int(os.getenv('TRACKING_NUMBER_BLOCK', '1000'))
+app.config['TRACKING_BLOOM_ENABLED'] = os.getenv('TRACKING_BLOOM_ENABLED', '1').lower() in ('1', 'true', 'yes')
+app.config['TRACKING_BLOOM_ERROR_RATE'] = float(os.getenv('TRACKING_BLOOM_ERROR_RATE', '0.001'))
+
+# ASGI mode (uvicorn asgi:application): pool of the async engine serving
+# the read endpoints, and threads running every other request
+app.config['ASYNC_DB_POOL_SIZE'] = int(os.getenv('ASYNC_DB_POOL_SIZE', '20'))
+app.config['ASYNC_DB_MAX_OVERFLOW'] = int(os.getenv('ASYNC_DB_MAX_OVERFLOW', '10'))
+app.config['ASGI_WSGI_THREADS'] = int(os.getenv('ASGI_WSGI_THREADS', '16'))
+
+# Webhook delivery worker (flask deliver-webhooks): events per POST, idle
+# polling, parallel POSTs, retry backoff bounds and how long delivered
+# outbox events are kept
+app.config['OUTBOX_BATCH_SIZE'] = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+app.config['OUTBOX_POLL_INTERVAL'] = float(os.getenv('OUTBOX_POLL_INTERVAL', '0.5'))
+app.config['OUTBOX_DELIVERY_THREADS'] = int(os.getenv('OUTBOX_DELIVERY_THREADS', '8'))
+app.config['OUTBOX_TIMEOUT'] = float(os.getenv('OUTBOX_TIMEOUT', '10'))
+app.config['OUTBOX_BACKOFF_BASE'] = float(os.getenv('OUTBOX_BACKOFF_BASE', '1'))
+app.config['OUTBOX_BACKOFF_MAX'] = float(os.getenv('OUTBOX_BACKOFF_MAX', '300'))
+app.config['OUTBOX_RETENTION_HOURS'] = float(os.getenv('OUTBOX_RETENTION_HOURS', '24'))
+
+# Merchant API (/webhooks): the operators' key, and whether subscribers
+# may point at private or loopback addresses (local receivers only)
+app.config['ADMIN_API_KEY'] = os.getenv('ADMIN_API_KEY')
+app.config['WEBHOOK_ALLOW_PRIVATE_URLS'] = os.getenv('WEBHOOK_ALLOW_PRIVATE_URLS', '0').lower() in ('1', 'true', 'yes')
+
 # Optional: Make cookies secure (for HTTPS deployment)
 app.config['SESSION_COOKIE_SECURE'] = os.getenv('FLASK_ENV') == 'production'
 
 # Initialize DB and migration
 from database import db
+from engine_profiles import engine_profile
+engine_profile.init_app(app)
 db.init_app(app)
+engine_profile.install(app)
 migrate = Migrate(app, db)
 
-# Import models
-from models import Customer, Courier, Parcel, TrackingUpdate
+from cache import tracking_cache
+tracking_cache.init_app(app)
 
-# Logging
-logging.basicConfig(level=logging.INFO)
+from tracking_numbers import tracking_numbers, tracking_number_samples
+tracking_numbers.init_app(app)
+
+from bulk_import import import_parcels_command
+app.cli.add_command(import_parcels_command)
+
+from parcel_summary import backfill_summaries, backfill_summaries_command
+app.cli.add_command(backfill_summaries_command)
+
+from archive import archive_parcels_command
+app.cli.add_command(archive_parcels_command)
+
+from rollups import delivery_stats, rebuild_rollups_command, stats_options
+app.cli.add_command(rebuild_rollups_command)
+
+from search import rebuild_search_index_command
+app.cli.add_command(rebuild_search_index_command)
+
+from outbox import (create_subscriber, deliver_webhooks_command, subscriber_dict, subscriber_dicts,
+                    subscriber_options, webhook_delivery, OUTBOX_SEQUENCE)
+webhook_delivery.init_app(app)
+app.cli.add_command(deliver_webhooks_command)
+
+from api_keys import issue_api_key_command, merchant_required
+app.cli.add_command(issue_api_key_command)
+
+from assignment import courier_loads
+courier_loads.init_app(app)
+
+from geocoding import geocoding, geocode_customers_command
+geocoding.init_app(app)
+app.cli.add_command(geocode_customers_command)
+
+from routing import route_planner
+route_planner.init_app(app)
+
+from events import event_hub, sse_response
+event_hub.init_app(app)
+
+from write_behind import write_behind
+write_behind.init_app(app)
+
+from metrics import metrics, component_samples
+metrics.init_app(app)
+metrics.register_collector(component_samples)
+metrics.register_collector(tracking_number_samples)
+
+# After metrics, so rejected requests are still measured.
+from admission import admission, admission_samples
+admission.init_app(app)
+metrics.register_collector(admission_samples)
+
+from compression import compression
+compression.init_app(app)
+
+# Import models
+from models import Customer, Courier, Parcel, TrackingUpdate, WebhookSubscriber
+from read_models import (courier_dicts, couriers_statement, parcels_statement, payload_options, read_courier_changes,
+                         read_courier_version, read_parcel_dicts, run_reader)
+from conditional import make_etag, not_modified, variant, with_etag
+from counters import current_value, read_current_value, PARCEL_VERSION, TOMBSTONE_HORIZON
 
 @app.route("/")
 def index():
     return "Backend is running!", 200
 
 
-def generate_tracking_number():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
-
-
 def setup_demo_data():
     if Courier.query.first():
         logging.info("Demo data already exists. Skipping setup.")
@@ -77,14 +240,16 @@ def setup_demo_data():
     db.session.bulk_save_objects(couriers)
 
     customers = [
-        Customer(name='Alice Johnson', email='alice@example.com', phone='555-1111', address='123 Apple St'),
-        Customer(name='Bob Williams', email='bob@example.com', phone='555-2222', address='456 Banana Ave')
+        Customer(**geocoding.locate({'name': 'Alice Johnson', 'email': 'alice@example.com', 'phone': '555-1111',
+                                     'address': '123 Apple St'})),
+        Customer(**geocoding.locate({'name': 'Bob Williams', 'email': 'bob@example.com', 'phone': '555-2222',
+                                     'address': '456 Banana Ave'})),
     ]
     db.session.add_all(customers)
     db.session.commit()
 
-    for i in range(20):
-        tracking_number = generate_tracking_number()
+    tracking_numbers_used = tracking_numbers.allocate(20)
+    for i, tracking_number in enumerate(tracking_numbers_used):
         sender = customers[i % len(customers)]
         recipient = customers[(i + 1) % len(customers)]
         parcel = Parcel(
@@ -111,6 +276,8 @@ def setup_demo_data():
         db.session.bulk_save_objects(updates)
 
     db.session.commit()
+    tracking_numbers.add_many(tracking_numbers_used)
+    backfill_summaries()
     logging.info("Demo data setup complete.")
 
 
@@ -125,10 +292,31 @@ def run_demo_data_setup():
 
 
 
+@app.route('/stats', methods=['GET'])
+def get_delivery_stats():
+    try:
+        options = stats_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'group_by': options['group_by'], 'groups': delivery_stats(**options)}), 200
+
+
 @app.route('/couriers', methods=['GET'])
 def get_all_couriers():
-    couriers = Courier.query.all()
-    return jsonify([c.to_dict() for c in couriers]), 200
+    return run_reader(couriers_reader())
+
+
+# The courier list views are readers (see read_models.py), so asgi.py
+# serves the same views.
+def couriers_reader():
+    # Couriers carry no version, but the rows are few; hashing them skips
+    # the serialization.
+    rows = yield couriers_statement()
+    etag = make_etag('couriers', *(tuple(row) for row in rows))
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    return with_etag(jsonify(courier_dicts(rows)), etag), 200
 
 
 @app.route('/couriers/login', methods=['POST'])
@@ -150,8 +338,56 @@ def courier_login():
 
 @app.route('/couriers/<courier_id>/parcels', methods=['GET'])
 def get_parcels_by_courier(courier_id):
-    parcels = Parcel.query.filter_by(courier_id=courier_id).all()
-    return jsonify([p.to_dict() for p in parcels]), 200
+    return run_reader(courier_parcels_reader(courier_id))
+
+
+def courier_parcels_reader(courier_id):
+    try:
+        fields, history = payload_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    since = request.args.get('since', type=int)
+    if 'since' in request.args and (since is None or since < 0):
+        return jsonify({'error': 'since must be a cursor from X-Change-Cursor'}), 400
+
+    # Read the cursor and validator first: every change they cover is
+    # already visible to the queries below.
+    cursor = yield from read_current_value(PARCEL_VERSION)
+    if since is None:
+        version = yield from read_courier_version(courier_id)
+        etag = make_etag('courier', courier_id, *version, variant(fields, history))
+        response = not_modified(etag)
+        if response is None:
+            statement = parcels_statement(courier_id=courier_id, fields=fields)
+            response = with_etag(jsonify((yield from read_parcel_dicts(statement, fields, history))), etag)
+    elif since < (yield from read_current_value(TOMBSTONE_HORIZON)):
+        return jsonify({'error': 'Cursor expired, fetch the full list again'}), 410
+    else:
+        changes = yield from read_courier_changes(courier_id, since, fields, history)
+        response = jsonify(dict(changes, cursor=cursor))
+    response.headers['X-Change-Cursor'] = str(cursor)
+    return response
+
+
+@app.route('/couriers/<courier_id>/route', methods=['GET'])
+def get_courier_route(courier_id):
+    if db.session.get(Courier, courier_id) is None:
+        return jsonify({'error': 'Courier not found'}), 404
+    start = request.args.get('start')
+    if start is not None:
+        try:
+            latitude, longitude = (float(value) for value in start.split(','))
+        except ValueError:
+            return jsonify({'error': 'start must be latitude,longitude'}), 400
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return jsonify({'error': 'start must be latitude,longitude'}), 400
+        start = (latitude, longitude)
+    return jsonify(route_planner.plan(courier_id, start)), 200
+
+
+@app.route('/couriers/<courier_id>/events', methods=['GET'])
+def get_courier_events(courier_id):
+    return sse_response(courier_id=courier_id)
 
 
 @app.route('/couriers/me', methods=['GET'])
@@ -169,11 +405,73 @@ def courier_logout():
     return jsonify({'message': 'Logged out'}), 200
 
 
+# Merchants see and receive only their own subscriptions and parcels; the
+# admin key sees all of them, and its subscriptions get every parcel.
+def _own_subscriber(subscriber_id):
+    subscriber = db.session.get(WebhookSubscriber, subscriber_id)
+    if subscriber is None or not (g.is_admin or subscriber.merchant_id == g.merchant_id):
+        return None
+    return subscriber
+
+
+@app.route('/webhooks', methods=['POST'])
+@merchant_required
+def create_webhook_subscriber():
+    try:
+        options = subscriber_options(request.get_json(silent=True), app.config['WEBHOOK_ALLOW_PRIVATE_URLS'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    subscriber = create_subscriber(**options, merchant_id=g.merchant_id)
+    # The secret is only shown here; it signs every delivery.
+    return jsonify(subscriber_dict(subscriber, subscriber.cursor, include_secret=True)), 201
+
+
+@app.route('/webhooks', methods=['GET'])
+@merchant_required
+def get_webhook_subscribers():
+    return jsonify(subscriber_dicts(g.merchant_id)), 200
+
+
+@app.route('/webhooks/<int:subscriber_id>', methods=['GET'])
+@merchant_required
+def get_webhook_subscriber(subscriber_id):
+    subscriber = _own_subscriber(subscriber_id)
+    if subscriber is None:
+        return jsonify({'error': 'Subscriber not found'}), 404
+    return jsonify(subscriber_dict(subscriber, current_value(OUTBOX_SEQUENCE))), 200
+
+
+@app.route('/webhooks/<int:subscriber_id>', methods=['DELETE'])
+@merchant_required
+def delete_webhook_subscriber(subscriber_id):
+    subscriber = _own_subscriber(subscriber_id)
+    if subscriber is None:
+        return jsonify({'error': 'Subscriber not found'}), 404
+    db.session.delete(subscriber)
+    db.session.commit()
+    return jsonify({'message': 'Subscriber removed'}), 200
+
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({'status': 'ok'}), 200
 
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(tracking_cache.stats()), 200
+
+
+@app.route('/write-behind/stats', methods=['GET'])
+def write_behind_stats():
+    return jsonify(write_behind.stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 
 # Run the app for local development only
 if __name__ == '__main__':
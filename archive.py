@@ -0,0 +1,143 @@
+# archive.py
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, literal, select
+
+from models import db, Parcel, ParcelArchive, ParcelTombstone, TrackingUpdate, TrackingUpdateArchive
+from counters import advance_to, next_value, PARCEL_VERSION, TOMBSTONE_HORIZON
+from cache import tracking_cache
+from assignment import DELIVERED_STATUS
+
+# Parcels delivered more than N days ago move, with their tracking
+# updates, from parcel/tracking_update to parcel_archive and
+# tracking_update_archive. Each batch is one short transaction, so the hot
+# tables are never locked for long; run `flask archive-parcels` from cron
+# or any scheduler. Archived parcels are still found by tracking number.
+# Each archived parcel leaves a tombstone for its courier's delta sync;
+# tombstones older than the cutoff are pruned on the same run.
+
+DEFAULT_ARCHIVE_DAYS = 30
+DEFAULT_BATCH_SIZE = 500
+
+
+def _archivable(cutoff):
+    return (Parcel.status == DELIVERED_STATUS) & (Parcel.last_update_at < cutoff)
+
+
+def archive_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    """Move one batch of parcels delivered before ``cutoff``; returns (parcels, updates, versions).
+
+    ``versions`` maps each moved tracking number to its parcel version.
+    """
+    rows = db.session.execute(
+        select(Parcel.id, Parcel.tracking_number, Parcel.courier_id, Parcel.version)
+        .where(_archivable(cutoff))
+        .order_by(Parcel.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not rows:
+        return 0, 0, {}
+    ids = [row.id for row in rows]
+    now = datetime.utcnow()
+
+    # Archived rows get ids of their own: the hot tables' ids come back
+    # once their highest rows are gone, so a later parcel can have the id
+    # of an archived one. Updates follow their parcel by tracking number.
+    parcel_columns = [column.name for column in Parcel.__table__.columns if column.name != 'id']
+    update_columns = [column.name for column in TrackingUpdate.__table__.columns
+                      if column.name not in ('id', 'parcel_id')]
+    db.session.execute(insert(ParcelArchive).from_select(
+        parcel_columns + ['archived_at'],
+        select(*(Parcel.__table__.c[name] for name in parcel_columns), literal(now))
+        .where(Parcel.id.in_(ids))
+        .order_by(Parcel.id),
+    ))
+    db.session.execute(insert(TrackingUpdateArchive).from_select(
+        ['parcel_id'] + update_columns,
+        select(ParcelArchive.id, *(TrackingUpdate.__table__.c[name] for name in update_columns))
+        .join(Parcel, Parcel.id == TrackingUpdate.parcel_id)
+        .join(ParcelArchive, ParcelArchive.tracking_number == Parcel.tracking_number)
+        .where(TrackingUpdate.parcel_id.in_(ids))
+        .order_by(TrackingUpdate.id),
+    ))
+    updates = db.session.execute(delete(TrackingUpdate).where(TrackingUpdate.parcel_id.in_(ids))).rowcount
+    db.session.execute(delete(Parcel).where(Parcel.id.in_(ids)))
+    assigned = [row for row in rows if row.courier_id]
+    if assigned:
+        first_version = next_value(PARCEL_VERSION, len(assigned)) - len(assigned) + 1
+        db.session.execute(insert(ParcelTombstone), [
+            {'parcel_id': row.id, 'tracking_number': row.tracking_number, 'courier_id': row.courier_id,
+             'version': first_version + i, 'reason': 'archived', 'created_at': now}
+            for i, row in enumerate(assigned)
+        ])
+    db.session.commit()
+    return len(ids), updates, {row.tracking_number: row.version for row in rows}
+
+
+def prune_tombstones(cutoff):
+    """Delete tombstones created before ``cutoff``; delta cursors older than them expire."""
+    horizon = db.session.scalar(select(func.max(ParcelTombstone.version)).where(ParcelTombstone.created_at < cutoff))
+    if horizon is None:
+        return 0
+    advance_to(TOMBSTONE_HORIZON, horizon)
+    pruned = db.session.execute(delete(ParcelTombstone).where(ParcelTombstone.version <= horizon)).rowcount
+    db.session.commit()
+    return pruned
+
+
+def hot_table_sizes():
+    return {
+        'parcel': db.session.scalar(select(func.count()).select_from(Parcel)),
+        'tracking_update': db.session.scalar(select(func.count()).select_from(TrackingUpdate)),
+    }
+
+
+def archive_delivered(days=DEFAULT_ARCHIVE_DAYS, batch_size=DEFAULT_BATCH_SIZE, pause=0.0, max_batches=None):
+    """Archive parcels delivered more than ``days`` ago, batch by batch.
+
+    ``pause`` seconds between batches let other writers in on SQLite.
+    Returns a report with the rows moved, rows/second and the hot table
+    row counts afterwards.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    started = time.perf_counter()
+    report = {'parcels': 0, 'tracking_updates': 0, 'batches': 0}
+    while max_batches is None or report['batches'] < max_batches:
+        parcels, updates, versions = archive_batch(cutoff, batch_size)
+        if not parcels:
+            break
+        for tracking_number, version in versions.items():
+            tracking_cache.invalidate(tracking_number, version)
+        report['parcels'] += parcels
+        report['tracking_updates'] += updates
+        report['batches'] += 1
+        if pause:
+            time.sleep(pause)
+
+    report['tombstones_pruned'] = prune_tombstones(cutoff)
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round((report['parcels'] + report['tracking_updates']) / elapsed, 1) if elapsed else None
+    report['hot_rows'] = hot_table_sizes()
+    logging.info("Archived %d parcels and %d tracking updates in %.1fs (%s rows/s); hot tables now %s",
+                 report['parcels'], report['tracking_updates'], elapsed, report['rows_per_second'], report['hot_rows'])
+    return report
+
+
+@click.command('archive-parcels')
+@click.option('--days', default=DEFAULT_ARCHIVE_DAYS, show_default=True, type=click.IntRange(0),
+              help='Archive parcels delivered more than this many days ago.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, type=click.IntRange(1, 10000))
+@click.option('--pause', default=0.0, show_default=True, type=float, help='Seconds to sleep between batches.')
+@click.option('--max-batches', type=click.IntRange(1), help='Stop after this many batches.')
+@with_appcontext
+def archive_parcels_command(days, batch_size, pause, max_batches):
+    """Move delivered parcels and their tracking updates to the archive tables."""
+    report = archive_delivered(days, batch_size, pause, max_batches)
+    click.echo(json.dumps(report, indent=2))
@@ -0,0 +1,326 @@
+# asgi.py
+"""ASGI entry point for high-concurrency deployments.
+
+    uvicorn asgi:application --workers 4 --port $PORT
+
+The tracking lookup, the courier lists and /health run on the event loop:
+their views are the Flask app's own readers, whose queries go to an async
+SQLAlchemy engine with its own pool (ASYNC_DB_POOL_SIZE) and whose
+blocking calls (the Bloom filter, the tracking cache) go to a thread, so a
+worker keeps serving them while thousands of connections are open or
+slow. They go through the Flask app's before/after request hooks, so
+admission control, metrics, CORS, ETags and compression behave as under
+gunicorn; raise ADMISSION_MAX_CONCURRENT to suit, since one worker now
+serves far more requests at once. The tracking event streams wait on the
+event loop too, so an idle one holds no thread. Every other request,
+writes included, is handed to the unchanged Flask app on a pool of
+ASGI_WSGI_THREADS threads and the sync engine, with the same transactions
+as before.
+"""
+import asyncio
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from inspect import isgenerator
+
+from sqlalchemy import event, Executable
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from flask import request
+from werkzeug.exceptions import HTTPException
+
+from app import app, courier_parcels_reader, couriers_reader, health
+from engine_profiles import engine_profile
+from events import (event_hub, format_sse, last_event_id, replay_statement, replayed_event, stream_channels,
+                    RETRY_MS, SSE_HEADERS)
+from metrics import metrics
+from parcels import track_parcel_reader
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+BODY_SPOOL_SIZE = 1024 * 1024
+
+
+def async_url(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver for {backend}; serve it with gunicorn app:app instead')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_read_engine(config):
+    """Async engine on the app's database, sized for many concurrent reads."""
+    url = async_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {'pool_size': int(config.get('ASYNC_DB_POOL_SIZE', 20)),
+               'max_overflow': int(config.get('ASYNC_DB_MAX_OVERFLOW', 10))}
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            options = {}
+    else:
+        settings = engine_profile.settings
+        options.update({key: settings[key] for key in ('pool_timeout', 'pool_pre_ping', 'pool_recycle')
+                        if key in settings})
+        if settings.get('statement_timeout'):
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(settings['statement_timeout'])}}
+    engine = create_async_engine(url, **options)
+    if url.get_backend_name() == 'sqlite' and engine_profile.settings:
+        event.listen(engine.sync_engine, 'connect', engine_profile._apply_pragmas)
+    metrics.instrument_engine(engine.sync_engine)
+    return engine
+
+
+async def run_reader(reader, engine):
+    """Run a reader (see read_models.py) on ``engine``, blocking calls on a thread."""
+    conn = None
+    try:
+        step = next(reader)
+        while True:
+            if isinstance(step, Executable):
+                if conn is None:
+                    conn = await engine.connect()
+                step = reader.send((await conn.execute(step)).all())
+            else:
+                # to_thread copies the context, so the request is still there.
+                step = reader.send(await asyncio.to_thread(step))
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
+# The same views as under gunicorn; readers run on the async engine, plain
+# views are called directly.
+ASYNC_VIEWS = {
+    'parcels.track_parcel': track_parcel_reader,
+    'get_all_couriers': couriers_reader,
+    'get_parcels_by_courier': courier_parcels_reader,
+    'health': health,
+}
+
+# Server-sent event streams, served by Application.serve_stream.
+ASYNC_STREAMS = frozenset({'parcels.track_parcel_events', 'get_courier_events'})
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope, reading the request body from ``body``."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _stream_chunk(text):
+    return {'type': 'http.response.body', 'body': text.encode(), 'more_body': True}
+
+
+def _response_start(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+
+
+class Application:
+    """Serves ASYNC_VIEWS on the event loop and everything else through the WSGI app."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.engine = None
+        self.threads = ThreadPoolExecutor(int(flask_app.config.get('ASGI_WSGI_THREADS', 16)),
+                                          thread_name_prefix='wsgi')
+
+    def read_engine(self):
+        # Created on first use, inside the worker process and its loop.
+        if self.engine is None:
+            self.engine = create_read_engine(self.flask_app.config)
+        return self.engine
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope {scope['type']!r}")
+        with SpooledTemporaryFile(max_size=BODY_SPOOL_SIZE) as body:
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                more_body = message.get('more_body', False)
+            body.seek(0)
+            environ = build_environ(scope, body)
+
+            view = endpoint = None
+            if scope['method'] in ('GET', 'HEAD'):
+                try:
+                    endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+                    view = ASYNC_VIEWS.get(endpoint)
+                except HTTPException:
+                    pass
+            if view is not None:
+                await self.serve_async(view, environ, send)
+            elif endpoint in ASYNC_STREAMS and scope['method'] == 'GET':
+                await self.serve_stream(environ, receive, send)
+            else:
+                await self.serve_wsgi(environ, receive, send)
+
+    async def serve_async(self, view, environ, send):
+        flask_app = self.flask_app
+        ctx = flask_app.request_context(environ)
+        error = None
+        ctx.push()
+        try:
+            try:
+                # The hooks may block (admission, metrics), so they run on a thread.
+                response = await asyncio.to_thread(flask_app.preprocess_request)
+                if response is None:
+                    response = view(**request.view_args)
+                    if isgenerator(response):
+                        response = await run_reader(response, self.read_engine())
+                response = flask_app.make_response(response)
+                response = await asyncio.to_thread(flask_app.process_response, response)
+            except Exception as e:
+                error = e
+                response = flask_app.make_response(flask_app.handle_exception(e))
+            status, headers, data = response.status_code, list(response.headers.items()), response.get_data()
+        finally:
+            ctx.pop(error)
+        await send(_response_start(status, headers))
+        await send({'type': 'http.response.body', 'body': b'' if environ['REQUEST_METHOD'] == 'HEAD' else data})
+
+    async def serve_stream(self, environ, receive, send):
+        flask_app = self.flask_app
+        ctx = flask_app.request_context(environ)
+        error = filters = last_id = None
+        ctx.push()
+        try:
+            try:
+                response = await asyncio.to_thread(flask_app.preprocess_request)
+                if response is None:
+                    filters, last_id = dict(request.view_args), last_event_id()
+                    response = flask_app.response_class(iter(()), mimetype='text/event-stream', headers=SSE_HEADERS)
+                response = await asyncio.to_thread(flask_app.process_response, flask_app.make_response(response))
+            except Exception as e:
+                error, filters = e, None
+                response = flask_app.make_response(flask_app.handle_exception(e))
+            status, headers = response.status_code, list(response.headers.items())
+            data = response.get_data() if filters is None else b''
+        finally:
+            ctx.pop(error)
+        await send(_response_start(status, headers))
+        if filters is None:
+            await send({'type': 'http.response.body', 'body': data})
+            return
+
+        # Subscribe before replaying, as event_stream() does.
+        subscription = event_hub.subscribe(stream_channels(**filters), loop=asyncio.get_running_loop())
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            subscription.close()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await send(_stream_chunk(f'retry: {RETRY_MS}\n\n'))
+            if last_id is not None:
+                async with self.read_engine().connect() as conn:
+                    rows = (await conn.execute(replay_statement(last_id, **filters))).all()
+                for row in rows:
+                    event = replayed_event(row)
+                    last_id = event['sequence']
+                    await send(_stream_chunk(format_sse(event)))
+            while not subscription.closed:
+                event = await subscription.get(event_hub.heartbeat)
+                if subscription.closed:
+                    break
+                if event is None:
+                    await send(_stream_chunk(': keep-alive\n\n'))
+                elif last_id is None or event['sequence'] > last_id:
+                    await send(_stream_chunk(format_sse(event)))
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            event_hub.unsubscribe(subscription)
+
+    async def serve_wsgi(self, environ, receive, send):
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        def begin():
+            result = self.flask_app(environ, start_response)
+            chunks = iter(result)
+            return result, chunks, next(chunks, None)
+
+        result, chunks, chunk = await loop.run_in_executor(self.threads, begin)
+        disconnected = asyncio.Event()
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await send(_response_start(started['status'], started['headers']))
+            # Streamed bodies are pulled a chunk at a time on the pool,
+            # until they end or the client goes away.
+            while chunk is not None and not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self.threads, next, chunks, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.threads, result.close)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                self.threads.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = Application(app)
+logging.info("ASGI application: async reads for %s", ', '.join(sorted([*ASYNC_VIEWS, *ASYNC_STREAMS])))
@@ -0,0 +1,130 @@
+# assignment.py
+import heapq
+import logging
+import threading
+import time
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from models import db, Courier, Parcel
+
+DELIVERED_STATUS = 'Delivered'
+
+
+def parcel_volume(length, width, height):
+    if length is None or width is None or height is None:
+        return 0.0
+    return length * width * height
+
+
+class CourierLoadIndex:
+    """Active parcel count, weight and volume per courier, kept in memory.
+
+    Couriers sit in a heap keyed by (active parcels, total weight, total
+    volume), so the least-loaded one is found in O(log n). Load changes
+    push a fresh heap entry and stale entries are skipped when they reach
+    the top. Each worker keeps its own index, so it is rebuilt from the
+    database every ``rebuild_interval`` seconds to pick up assignments
+    made by other workers.
+    """
+
+    def __init__(self, rebuild_interval=300):
+        self.rebuild_interval = rebuild_interval
+        self._loads = {}
+        self._heap = []
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.rebuild_interval = float(app.config.get('ASSIGNMENT_REBUILD_INTERVAL', self.rebuild_interval))
+        app.extensions['courier_loads'] = self
+        with app.app_context():
+            try:
+                self.rebuild()
+            except (OperationalError, ProgrammingError):
+                # Tables not created yet; the first assignment will build it.
+                db.session.rollback()
+
+    def rebuild(self):
+        active = or_(Parcel.status.is_(None), Parcel.status != DELIVERED_STATUS)
+        rows = db.session.execute(
+            select(
+                Courier.id,
+                func.count(Parcel.id),
+                func.coalesce(func.sum(Parcel.weight), 0.0),
+                func.coalesce(func.sum(Parcel.length * Parcel.width * Parcel.height), 0.0),
+            )
+            .outerjoin(Parcel, (Parcel.courier_id == Courier.id) & active)
+            .group_by(Courier.id)
+        ).all()
+        with self._lock:
+            self._loads = {courier_id: (count, float(weight), float(volume))
+                           for courier_id, count, weight, volume in rows}
+            self._heap = [(*load, courier_id) for courier_id, load in self._loads.items()]
+            heapq.heapify(self._heap)
+            self._built_at = time.monotonic()
+        logging.info("Courier load index built for %d couriers", len(rows))
+
+    def _ensure_fresh(self):
+        if (self._built_at is None or not self._loads
+                or time.monotonic() - self._built_at > self.rebuild_interval):
+            self.rebuild()
+
+    def _adjust(self, courier_id, count, weight, volume):
+        current = self._loads.get(courier_id)
+        if current is None:
+            return
+        load = (current[0] + count, current[1] + weight, current[2] + volume)
+        self._loads[courier_id] = load
+        heapq.heappush(self._heap, (*load, courier_id))
+        if len(self._heap) > 4 * len(self._loads) + 64:
+            self._heap = [(*load, cid) for cid, load in self._loads.items()]
+            heapq.heapify(self._heap)
+
+    def acquire(self, weight=0.0, volume=0.0):
+        """Reserve the least-loaded courier for a new parcel and return its id.
+
+        Returns None when there are no couriers. Call release() with the
+        same figures if the parcel is not committed.
+        """
+        with self._lock:
+            self._ensure_fresh()
+            while self._heap:
+                *load, courier_id = self._heap[0]
+                if self._loads.get(courier_id) == tuple(load):
+                    break
+                heapq.heappop(self._heap)
+            else:
+                return None
+            self._adjust(courier_id, 1, weight or 0.0, volume)
+            return courier_id
+
+    def release(self, courier_id, weight=0.0, volume=0.0):
+        with self._lock:
+            self._adjust(courier_id, -1, -(weight or 0.0), -volume)
+
+    def status_changed(self, courier_id, old_status, new_status, weight=0.0, volume=0.0):
+        was_active = old_status != DELIVERED_STATUS
+        is_active = new_status != DELIVERED_STATUS
+        if was_active and not is_active:
+            self.release(courier_id, weight, volume)
+        elif is_active and not was_active:
+            with self._lock:
+                self._adjust(courier_id, 1, weight or 0.0, volume)
+
+    def reassigned(self, old_courier_id, new_courier_id, status, weight=0.0, volume=0.0):
+        if status == DELIVERED_STATUS:
+            return
+        with self._lock:
+            if old_courier_id:
+                self._adjust(old_courier_id, -1, -(weight or 0.0), -volume)
+            self._adjust(new_courier_id, 1, weight or 0.0, volume)
+
+    def loads(self):
+        with self._lock:
+            return {courier_id: {'active_parcels': count, 'total_weight': weight, 'total_volume': volume}
+                    for courier_id, (count, weight, volume) in self._loads.items()}
+
+
+courier_loads = CourierLoadIndex()
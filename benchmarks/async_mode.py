@@ -0,0 +1,213 @@
+"""Requests/second at high connection counts: gunicorn (sync) vs asgi.py.
+
+Starts each server mode as a real process on a seeded SQLite file, then
+holds --connections keep-alive connections open from an asyncio client
+for --duration seconds per endpoint and reports requests/second, latency
+percentiles and failures as JSON.
+
+    python benchmarks/async_mode.py --connections 1000 --workers 2 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dataset  # noqa: E402
+from endpoints import git_commit, percentile  # noqa: E402
+
+ENDPOINTS = {
+    'track_parcel': lambda rng, sample: f"/parcels/track/{rng.choice(sample['tracking_numbers'])}",
+    'track_parcel_missing': lambda rng, sample: f'/parcels/track/MISSING{rng.randint(10000, 99999)}',
+    'courier_parcels': lambda rng, sample: (f"/couriers/{rng.choice(sample['couriers'])}/parcels"
+                                            '?fields=tracking_number,status&history=none'),
+    'health': lambda rng, sample: '/health',
+}
+
+
+def server_command(mode, port, workers, threads):
+    if mode == 'sync':
+        # As in the Procfile.
+        return ['gunicorn', 'app:app', '--worker-class', 'gthread', '--threads', str(threads),
+                '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    return ['uvicorn', 'asgi:application', '--workers', str(workers), '--host', '127.0.0.1',
+            '--port', str(port), '--no-access-log', '--log-level', 'warning']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with {process.returncode}')
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+async def connection(port, paths, stop_at, timeout, latencies, failures):
+    """One keep-alive client connection sending requests back to back."""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        failures['connect'] += 1
+        return
+    try:
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            writer.write(f'GET {next(paths)} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+            status = int(head.split(b' ', 2)[1])
+            length = 0
+            for line in head.split(b'\r\n')[1:]:
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            if status >= 500 or status == 429:
+                failures['status'] += 1
+            if b'connection: close' in head.lower():
+                break
+    except asyncio.TimeoutError:
+        failures['timeout'] += 1
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        failures['dropped'] += 1
+    finally:
+        writer.close()
+
+
+async def drive(port, endpoint, sample, connections, duration, timeout, seed):
+    rng = random.Random(seed)
+    pick = ENDPOINTS[endpoint]
+
+    def paths():
+        while True:
+            yield pick(rng, sample)
+
+    latencies, failures = [], {'connect': 0, 'timeout': 0, 'dropped': 0, 'status': 0}
+    started = time.perf_counter()
+    stop_at = started + duration
+    generator = paths()
+    await asyncio.gather(*(connection(port, generator, stop_at, timeout, latencies, failures)
+                           for _ in range(connections)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None  # noqa: E731
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / wall, 1) if wall else None,
+        'failures': failures,
+        'latency_ms': {
+            'p50': to_ms(percentile(latencies, 0.50)),
+            'p95': to_ms(percentile(latencies, 0.95)),
+            'p99': to_ms(percentile(latencies, 0.99)),
+            'max': to_ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='sync,async', help='Comma-separated server modes: sync, async.')
+    parser.add_argument('--endpoints', default='track_parcel,courier_parcels,health',
+                        help=f"Comma-separated subset of {', '.join(ENDPOINTS)}.")
+    parser.add_argument('--connections', type=int, default=1000, help='Concurrent client connections.')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per endpoint.')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='Seconds to wait for a connection or response before counting it failed.')
+    parser.add_argument('--workers', type=int, default=2, help='Server worker processes.')
+    parser.add_argument('--threads', type=int, default=16, help='Threads per sync worker.')
+    parser.add_argument('--parcels', type=int, default=20000, help='Parcels in the seeded SQLite file.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+    args = parser.parse_args()
+
+    config = {'parcels': args.parcels, 'customers': max(args.parcels // 10, 1), 'couriers': 20,
+              'tracking_updates': args.parcels * 3, 'seed': args.seed}
+    workdir = tempfile.mkdtemp(prefix='parcel-async-')
+    template = os.path.join(workdir, 'template.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + template
+    os.environ['DB_PROFILE'] = 'default'
+    sys.path.insert(0, ROOT)
+
+    import logging
+    from flask_migrate import upgrade
+    from sqlalchemy import select
+    from app import app, db
+    from models import Courier, Parcel
+
+    logging.disable(logging.INFO)
+    log = lambda message: print(message, file=sys.stderr)  # noqa: E731
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+        dataset.seed(db, config, log=log)
+        sample = {
+            'tracking_numbers': db.session.scalars(select(Parcel.tracking_number).limit(1000)).all(),
+            'couriers': db.session.scalars(select(Courier.id)).all(),
+        }
+        db.engine.dispose()
+
+    results = {}
+    try:
+        for mode in args.modes.split(','):
+            path = os.path.join(workdir, f'{mode}.db')
+            shutil.copyfile(template, path)
+            port = free_port()
+            env = dict(os.environ, DATABASE_URL='sqlite:///' + path, DB_PROFILE='web', WEB_THREADS=str(args.threads),
+                       # One client address would trip the tracking rate limit.
+                       ADMISSION_ENABLED='0', SLOW_REQUEST_SECONDS='3600')
+            process = subprocess.Popen(server_command(mode, port, args.workers, args.threads), cwd=ROOT, env=env,
+                                       stdout=subprocess.DEVNULL)
+            try:
+                wait_until_up(port, process)
+                results[mode] = {}
+                for endpoint in args.endpoints.split(','):
+                    log(f'{mode}: {endpoint} with {args.connections} connections')
+                    results[mode][endpoint] = asyncio.run(
+                        drive(port, endpoint, sample, args.connections, args.duration, args.timeout, args.seed))
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'database': 'sqlite',
+            'connections': args.connections,
+            'duration_seconds': args.duration,
+            'workers': args.workers,
+            'threads_per_sync_worker': args.threads,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
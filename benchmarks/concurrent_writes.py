@@ -0,0 +1,164 @@
+"""Concurrent status updates from several worker processes, per engine profile.
+
+Mimics gunicorn: every process imports the app with its own engine and
+pool, and a few threads per process hit PUT /parcels/<tn>/status. For each
+DB_PROFILE it reports writes/second, latency percentiles and how many
+requests failed (typically "database is locked" on SQLite).
+
+    python benchmarks/concurrent_writes.py --profiles default,web \\
+        --processes 4 --threads 4 --writes 250
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dataset  # noqa: E402
+from endpoints import git_commit, percentile  # noqa: E402
+
+
+def _worker(args):
+    database_url, profile, threads, writes, tracking_numbers, seed = args
+    os.environ.update(DATABASE_URL=database_url, DB_PROFILE=profile)
+    os.environ.pop('WRITE_BEHIND_ENABLED', None)
+    sys.path.insert(0, ROOT)
+    import contextlib
+    import io
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+
+    logging.disable(logging.CRITICAL)
+    from app import app
+
+    def run(index):
+        client = app.test_client()
+        rng = random.Random(seed * 1000 + index)
+        latencies, failed = [], 0
+        for _ in range(writes // threads):
+            started = time.perf_counter()
+            response = client.put(f'/parcels/{rng.choice(tracking_numbers)}/status',
+                                  json={'status': 'In Transit', 'location': 'Bench Hub'})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failed += 1
+        return latencies, failed
+
+    # Views print debugging output.
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(run, range(threads)))
+        finished = time.time()
+    latencies = [value for values, _ in results for value in values]
+    return latencies, sum(failed for _, failed in results), started, finished
+
+
+def run_profile(database_url, profile, args, tracking_numbers):
+    jobs = [(database_url, profile, args.threads, args.writes, tracking_numbers, args.seed + n)
+            for n in range(args.processes)]
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.processes) as pool:
+        results = pool.map(_worker, jobs)
+
+    # Time only the span in which the workers were writing, not start-up.
+    wall = max(result[3] for result in results) - min(result[2] for result in results)
+    latencies = sorted(value for result in results for value in result[0])
+    failed = sum(result[1] for result in results)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None  # noqa: E731
+    return {
+        'writes': len(latencies),
+        'failed': failed,
+        'writes_per_second': round((len(latencies) - failed) / wall, 1) if wall else None,
+        'latency_ms': {
+            'p50': to_ms(percentile(latencies, 0.50)),
+            'p95': to_ms(percentile(latencies, 0.95)),
+            'p99': to_ms(percentile(latencies, 0.99)),
+            'max': to_ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Seeded server database to write to. By default '
+                        'every profile gets its own copy of a small seeded SQLite file.')
+    parser.add_argument('--profiles', default='default,web', help='Comma-separated DB_PROFILE names.')
+    parser.add_argument('--processes', type=int, default=4, help='Worker processes.')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per process.')
+    parser.add_argument('--writes', type=int, default=250, help='Status updates per process.')
+    parser.add_argument('--parcels', type=int, default=2000, help='Parcels in the seeded SQLite file.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+    args = parser.parse_args()
+
+    config = {'parcels': args.parcels, 'customers': max(args.parcels // 10, 1), 'couriers': 20,
+              'tracking_updates': args.parcels * 3, 'seed': args.seed}
+    workdir = None
+    template = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        workdir = tempfile.mkdtemp(prefix='parcel-writes-')
+        template = os.path.join(workdir, 'template.db')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + template
+    # Seed with driver defaults so the template is not left in WAL mode.
+    os.environ['DB_PROFILE'] = 'default'
+    sys.path.insert(0, ROOT)
+
+    import logging
+    from flask_migrate import upgrade
+    from sqlalchemy import select
+    from app import app, db
+    from models import Parcel
+
+    logging.disable(logging.INFO)
+    log = lambda message: print(message, file=sys.stderr)  # noqa: E731
+    with app.app_context():
+        if template:
+            upgrade(directory=os.path.join(ROOT, 'migrations'))
+            dataset.seed(db, config, log=log)
+        tracking_numbers = db.session.scalars(select(Parcel.tracking_number).limit(1000)).all()
+        db.engine.dispose()
+
+    results = {}
+    try:
+        for profile in args.profiles.split(','):
+            database_url = args.database_url
+            if template:
+                path = os.path.join(workdir, f'{profile}.db')
+                shutil.copyfile(template, path)
+                database_url = 'sqlite:///' + path
+            log(f'benchmarking profile {profile}')
+            results[profile] = run_profile(database_url, profile, args, tracking_numbers)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'database': 'sqlite' if template else args.database_url.split(':', 1)[0],
+            'processes': args.processes,
+            'threads_per_process': args.threads,
+            'writes_per_process': args.writes,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
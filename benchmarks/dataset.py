@@ -0,0 +1,150 @@
+"""Deterministic synthetic dataset for the benchmarks.
+
+Seeds couriers, customers, parcels and tracking updates with Faker and a
+fixed random seed, using Core bulk inserts, so two runs with the same
+options produce identical data.
+
+    python benchmarks/dataset.py --database-url sqlite:////tmp/bench.db \\
+        --parcels 1000000 --customers 50000 --couriers 500 --tracking-updates 5000000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATUSES = ['Created', 'Dispatched', 'In Transit', 'Out for Delivery', 'Delivered']
+SERVICE_TYPES = ['Standard', 'Express', 'Overnight']
+VEHICLES = ['Van', 'Bike', 'Car', 'Truck']
+LOCATIONS = ['Warehouse A', 'Warehouse B', 'Distribution Center', 'Local Depot', 'Customer Address']
+BASE_TIME = datetime(2026, 1, 1)
+BATCH = 10000
+
+
+def add_arguments(parser):
+    parser.add_argument('--parcels', type=int, default=1000000)
+    parser.add_argument('--customers', type=int, default=50000)
+    parser.add_argument('--couriers', type=int, default=500)
+    parser.add_argument('--tracking-updates', type=int, default=5000000)
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def config_of(args):
+    return {
+        'parcels': args.parcels,
+        'customers': args.customers,
+        'couriers': args.couriers,
+        'tracking_updates': args.tracking_updates,
+        'seed': args.seed,
+    }
+
+
+def _batches(total):
+    for start in range(0, total, BATCH):
+        yield start, min(start + BATCH, total)
+
+
+def seed(db, config, log=print):
+    """Insert the dataset described by ``config`` into an empty, migrated database."""
+    from faker import Faker
+    from sqlalchemy import insert
+    from models import Courier, Customer, Parcel, TrackingUpdate
+    from parcel_summary import fold_tracking_updates
+    from geocoding import Geocoding
+    from rollups import rebuild_rollups
+
+    geocoder = Geocoding()  # offline: coordinates follow from the addresses
+
+    rng = random.Random(config['seed'])
+    fake = Faker()
+    Faker.seed(config['seed'])
+    started = time.perf_counter()
+
+    db.session.execute(insert(Courier), [
+        {'id': f'CR{i:03d}', 'name': fake.name(), 'email': fake.email(),
+         'phone': fake.numerify('555-####'), 'vehicle': rng.choice(VEHICLES)}
+        for i in range(1, config['couriers'] + 1)
+    ])
+
+    for start, end in _batches(config['customers']):
+        db.session.execute(insert(Customer), [
+            geocoder.locate({'id': i + 1, 'name': fake.name(), 'email': fake.email(),
+                             'phone': fake.numerify('555-####'), 'address': fake.street_address()})
+            for i in range(start, end)
+        ])
+    db.session.commit()
+    log(f"seeded {config['couriers']} couriers and {config['customers']} customers")
+
+    descriptions = [fake.sentence(nb_words=4) for _ in range(1000)]
+    alphabet = string.ascii_uppercase + string.digits
+    seen = set()
+    per_parcel, extra = divmod(config['tracking_updates'], max(config['parcels'], 1))
+
+    for start, end in _batches(config['parcels']):
+        parcels, updates = [], []
+        for i in range(start, end):
+            tracking_number = ''.join(rng.choices(alphabet, k=12))
+            while tracking_number in seen:
+                tracking_number = ''.join(rng.choices(alphabet, k=12))
+            seen.add(tracking_number)
+
+            created = BASE_TIME + timedelta(minutes=i)
+            count = per_parcel + (1 if i < extra else 0)
+            statuses = [STATUSES[min(n, len(STATUSES) - 1)] for n in range(count)]
+            parcels.append({
+                'id': i + 1,
+                'tracking_number': tracking_number,
+                'sender_id': rng.randint(1, config['customers']),
+                'recipient_id': rng.randint(1, config['customers']),
+                'courier_id': f"CR{rng.randint(1, config['couriers']):03d}",
+                'weight': round(rng.uniform(0.1, 30), 2),
+                'length': rng.randint(5, 100),
+                'width': rng.randint(5, 80),
+                'height': rng.randint(1, 60),
+                'service_type': rng.choice(SERVICE_TYPES),
+                'estimated_delivery': created + timedelta(days=rng.randint(2, 7)),
+                'description': rng.choice(descriptions),
+                'status': statuses[-1] if statuses else 'Created',
+            })
+            history = [{
+                'parcel_id': i + 1,
+                'timestamp': created + timedelta(hours=6 * n),
+                'status': status,
+                'location': rng.choice(LOCATIONS),
+                'description': f'{status} scan',
+            } for n, status in enumerate(statuses)]
+            parcels[-1].update(fold_tracking_updates(None, None, None, history))
+            updates.extend(history)
+        db.session.execute(insert(Parcel), parcels)
+        if updates:
+            db.session.execute(insert(TrackingUpdate), updates)
+        db.session.commit()
+        if end % (BATCH * 10) == 0 or end == config['parcels']:
+            log(f"seeded {end} parcels in {time.perf_counter() - started:.0f}s")
+
+    report = rebuild_rollups()
+    log(f"built {report['buckets']} delivery rollup buckets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='Empty database to migrate and seed.')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    sys.path.insert(0, ROOT)
+    from flask_migrate import upgrade
+    from app import app, db
+
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+        seed(db, config_of(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""Throughput and latency of every HTTP endpoint against a synthetic dataset.
+
+Seeds (or reuses) a deterministic dataset, then drives each endpoint in
+app.py and parcels.py through the WSGI app from concurrent client threads
+and prints machine-readable JSON with requests/second and p50/p95/p99
+latency per endpoint. The report records the git commit and dataset so
+runs can be compared across commits.
+
+    python benchmarks/endpoints.py --parcels 100000 --customers 10000 \\
+        --tracking-updates 500000 --concurrency 8 --requests 500 --output bench.json
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dataset  # noqa: E402
+
+
+def parcel_payload(rng):
+    def person():
+        n = rng.randint(1, 10 ** 6)
+        return {'name': f'Bench {n}', 'email': f'bench{n}@example.com',
+                'phone': '555-0000', 'address': f'{n} Bench St'}
+    return {'sender': person(), 'recipient': person(), 'weight': round(rng.uniform(0.5, 20), 2),
+            'service_type': rng.choice(dataset.SERVICE_TYPES), 'description': 'Benchmark parcel'}
+
+
+def scenarios(sample):
+    """Endpoint name -> (request function, expected status)."""
+    pick = random.Random.choice
+    return {
+        'index': (lambda c, r: c.get('/'), 200),
+        'health': (lambda c, r: c.get('/health'), 200),
+        'couriers': (lambda c, r: c.get('/couriers'), 200),
+        'courier_login': (lambda c, r: c.post('/couriers/login', json={'courier_id': 'CR001', 'password': 'john123'}), 200),
+        'courier_parcels': (lambda c, r: c.get(f"/couriers/{pick(r, sample['couriers'])}/parcels"), 200),
+        'stats_by_courier': (lambda c, r: c.get('/stats?group_by=courier_id'), 200),
+        'courier_route': (lambda c, r: c.get(f"/couriers/{pick(r, sample['couriers'])}/route"), 200),
+        'track_parcel': (lambda c, r: c.get(f"/parcels/track/{pick(r, sample['tracking_numbers'])}"), 200),
+        'track_parcel_missing': (lambda c, r: c.get(f"/parcels/track/MISSING{r.randint(10000, 99999)}"), 404),
+        'search_tracking_prefix': (lambda c, r: c.get(
+            f"/parcels/search?q={pick(r, sample['tracking_numbers'])[:5]}&fields=tracking_number,status&history=none"),
+            200),
+        'search_customer': (lambda c, r: c.get(f"/parcels/search?q={pick(r, sample['customer_names'])}&in=sender,recipient"),
+                            200),
+        'parcels_page': (lambda c, r: c.get(f"/parcels/?limit=100&after={r.randint(0, sample['max_id'])}"), 200),
+        'parcels_filtered_stream': (lambda c, r: c.get(
+            f"/parcels/?stream=1&courier_id={pick(r, sample['couriers'])}&status=Delivered"), 200),
+        'create_parcel': (lambda c, r: c.post('/parcels/', json=parcel_payload(r)), 201),
+        'update_status': (lambda c, r: c.put(
+            f"/parcels/{pick(r, sample['tracking_numbers'])}/status",
+            json={'status': 'In Transit', 'location': 'Bench Hub'}), (200, 202)),
+        'scan_batch_50': (lambda c, r: c.post('/parcels/scans', json=[
+            {'tracking_number': pick(r, sample['tracking_numbers']), 'status': 'In Transit', 'location': 'Bench Hub'}
+            for _ in range(50)]), (200, 202)),
+        'bulk_create_20': (lambda c, r: c.post('/parcels/bulk', json=[parcel_payload(r) for _ in range(20)]), 200),
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(app, request, expected, requests, concurrency, seed):
+    expected = expected if isinstance(expected, tuple) else (expected,)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(index):
+        nonlocal errors
+        client = app.test_client()
+        rng = random.Random(seed * 1000 + index)
+        local, failed = [], 0
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            started = time.perf_counter()
+            response = request(client, rng)
+            # Read the full body so streamed responses are measured too.
+            response.get_data()
+            local.append(time.perf_counter() - started)
+            if response.status_code not in expected:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None  # noqa: E731
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'latency_ms': {
+            'mean': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': to_ms(percentile(latencies, 0.50)),
+            'p95': to_ms(percentile(latencies, 0.95)),
+            'p99': to_ms(percentile(latencies, 0.99)),
+            'max': to_ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def sample_dataset(db, rng, size=1000):
+    from sqlalchemy import func, select
+    from models import Courier, Customer, Parcel
+
+    max_id = db.session.scalar(select(func.max(Parcel.id))) or 0
+    ids = sorted({rng.randint(1, max_id) for _ in range(size)}) if max_id else []
+    tracking_numbers = db.session.scalars(select(Parcel.tracking_number).where(Parcel.id.in_(ids))).all()
+    couriers = db.session.scalars(select(Courier.id).order_by(Courier.id)).all()
+    # Last names, which several customers share.
+    names = db.session.scalars(select(Customer.name).where(Customer.id.in_(ids))).all()
+    customer_names = sorted({name.split()[-1] for name in names if name}) or ['Bench']
+    return {'max_id': max_id, 'tracking_numbers': tracking_numbers, 'couriers': couriers,
+            'customer_names': customer_names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Seeded database to benchmark; by default a cached '
+                        'SQLite file keyed by the dataset options is created or reused.')
+    dataset.add_arguments(parser)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads.')
+    parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per endpoint.')
+    parser.add_argument('--endpoints', help='Comma-separated subset of endpoint names to run.')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+    parser.add_argument('--fresh', action='store_true', help='Reseed the cached dataset. Write '
+                        'endpoints add rows, so reseed before runs that are compared with each other.')
+    args = parser.parse_args()
+
+    config = dataset.config_of(args)
+    seeded_marker = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        # A schema change invalidates the cached database too.
+        migrations = sorted(name for name in os.listdir(os.path.join(ROOT, 'migrations', 'versions'))
+                            if name.endswith('.py'))
+        key = hashlib.sha1(json.dumps([config, migrations], sort_keys=True).encode()).hexdigest()[:12]
+        directory = os.path.join(tempfile.gettempdir(), 'parcel-bench')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{key}.db')
+        seeded_marker = path + '.seeded'
+        if args.fresh or not os.path.exists(seeded_marker):
+            for stale in (path, seeded_marker):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    # Every client thread shares one address, which the tracking rate limit
+    # would throttle; run with ADMISSION_ENABLED=1 to measure with it.
+    os.environ.setdefault('ADMISSION_ENABLED', '0')
+    sys.path.insert(0, ROOT)
+
+    from flask_migrate import upgrade
+    from app import app, db
+    from tracking_numbers import tracking_numbers
+
+    log = lambda message: print(message, file=sys.stderr)  # noqa: E731
+    with app.app_context():
+        if seeded_marker and not os.path.exists(seeded_marker):
+            upgrade(directory=os.path.join(ROOT, 'migrations'))
+            dataset.seed(db, config, log=log)
+            open(seeded_marker, 'w').close()
+            # The app started before the parcels existed.
+            tracking_numbers.rebuild()
+        sample = sample_dataset(db, random.Random(args.seed))
+        backend = db.engine.url.get_backend_name()
+
+    selected = scenarios(sample)
+    if args.endpoints:
+        names = args.endpoints.split(',')
+        unknown = set(names) - set(selected)
+        if unknown:
+            parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+        selected = {name: selected[name] for name in names}
+
+    results = {}
+    # Keep stdout for the report; views print debugging output.
+    with contextlib.redirect_stdout(sys.stderr):
+        for name, (request, expected) in selected.items():
+            log(f'benchmarking {name}')
+            if args.warmup:
+                run_scenario(app, request, expected, args.warmup, 1, args.seed)
+            results[name] = run_scenario(app, request, expected, args.requests, args.concurrency, args.seed)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': backend,
+            'dataset': config,
+            'requests_per_endpoint': args.requests,
+            'concurrency': args.concurrency,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Before/after query plans and timings for the tracking_update / parcel index migration.
+
+Builds a scratch database at the initial schema, seeds it, then measures
+the courier-parcel and tracking-history queries before and after
+upgrading to 3f9a1c2e7b4d. Prints the results as JSON.
+
+    python benchmarks/query_plans.py --parcels 200000 --updates-per-parcel 5
+    python benchmarks/query_plans.py --database-url postgresql://localhost/bench
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BEFORE_REVISION = 'c76f2810b6fa'
+AFTER_REVISION = '3f9a1c2e7b4d'
+
+QUERIES = {
+    'courier_parcels': 'SELECT id, status FROM parcel WHERE courier_id = :courier_id',
+    'tracking_history': (
+        'SELECT timestamp, status, location FROM tracking_update '
+        'WHERE parcel_id = :parcel_id ORDER BY timestamp'
+    ),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Empty database to use; defaults to a temporary SQLite file.')
+    parser.add_argument('--parcels', type=int, default=200000)
+    parser.add_argument('--updates-per-parcel', type=int, default=5)
+    parser.add_argument('--couriers', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=200, help='Executions per query when timing.')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def seed(conn, text, args, rng):
+    now = datetime.utcnow()
+    conn.execute(text('INSERT INTO courier (id, name) VALUES (:id, :name)'),
+                 [{'id': f'C{i:05d}', 'name': f'Courier {i}'} for i in range(args.couriers)])
+    conn.execute(text('INSERT INTO customer (id, name) VALUES (1, :name)'), {'name': 'Bench customer'})
+    batch = 10000
+    for start in range(0, args.parcels, batch):
+        ids = range(start + 1, min(start + batch, args.parcels) + 1)
+        conn.execute(text(
+            'INSERT INTO parcel (id, tracking_number, sender_id, recipient_id, courier_id, weight, status) '
+            'VALUES (:id, :tracking_number, 1, 1, :courier_id, 1.0, :status)'
+        ), [{
+            'id': i,
+            'tracking_number': f'{i:06d}' + ''.join(rng.choices(string.ascii_uppercase, k=6)),
+            'courier_id': f'C{rng.randrange(args.couriers):05d}',
+            'status': rng.choice(['Created', 'In Transit', 'Delivered']),
+        } for i in ids])
+        # Stored as text, the way the original String(12) column held it.
+        conn.execute(text(
+            'INSERT INTO tracking_update (parcel_id, timestamp, status, location) '
+            'VALUES (:parcel_id, :timestamp, :status, :location)'
+        ), [{
+            'parcel_id': str(i),
+            'timestamp': now - timedelta(hours=n),
+            'status': 'In Transit',
+            'location': 'Hub',
+        } for i in ids for n in range(args.updates_per_parcel)])
+
+
+def measure(conn, text, args, rng):
+    explain = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    params = {
+        'courier_parcels': lambda: {'courier_id': f'C{rng.randrange(args.couriers):05d}'},
+        'tracking_history': lambda: {'parcel_id': rng.randint(1, args.parcels)},
+    }
+    results = {}
+    for name, sql in QUERIES.items():
+        plan = [' '.join(str(col) for col in row) for row in conn.execute(text(explain + sql), params[name]())]
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            conn.execute(text(sql), params[name]()).fetchall()
+        elapsed = time.perf_counter() - started
+        results[name] = {'plan': plan, 'mean_ms': round(elapsed / args.repeat * 1000, 3)}
+    return results
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.mkdtemp(prefix='parcel-bench-')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch, 'bench.db')
+    sys.path.insert(0, ROOT)
+
+    from flask_migrate import upgrade
+    from sqlalchemy import text
+    from app import app, db
+
+    migrations = os.path.join(ROOT, 'migrations')
+    report = {'parcels': args.parcels, 'tracking_updates': args.parcels * args.updates_per_parcel}
+    with app.app_context():
+        upgrade(directory=migrations, revision=BEFORE_REVISION)
+        with db.engine.begin() as conn:
+            seed(conn, text, args, rng)
+        with db.engine.connect() as conn:
+            report['before'] = measure(conn, text, args, rng)
+
+        started = time.perf_counter()
+        upgrade(directory=migrations, revision=AFTER_REVISION)
+        report['migration_seconds'] = round(time.perf_counter() - started, 2)
+        with db.engine.connect() as conn:
+            report['after'] = measure(conn, text, args, rng)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Route planner speed and quality by number of stops.
+
+Plans open routes through random points spread like the offline geocoder
+spreads addresses and prints JSON with the planning time percentiles and
+the route length after nearest-neighbour alone and after 2-opt.
+
+    python benchmarks/route_planning.py --stops 100,500,1000 --runs 5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from endpoints import git_commit, percentile  # noqa: E402
+from geocoding import DEFAULT_BOUNDS  # noqa: E402
+from routing import plan_route  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stops', default='100,500,1000', help='Comma-separated stop counts.')
+    parser.add_argument('--runs', type=int, default=5, help='Random stop sets per count.')
+    parser.add_argument('--time-budget', type=float, default=0.5, help='2-opt budget in seconds.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    south, west, north, east = DEFAULT_BOUNDS
+    rng = random.Random(args.seed)
+    results = {}
+    for count in (int(value) for value in args.stops.split(',')):
+        timings, greedy, improved, converged = [], [], [], 0
+        for _ in range(args.runs):
+            latitudes = [rng.uniform(south, north) for _ in range(count)]
+            longitudes = [rng.uniform(west, east) for _ in range(count)]
+            greedy.append(plan_route(latitudes, longitudes, time_budget=0)[1])
+            started = time.perf_counter()
+            _, km, done = plan_route(latitudes, longitudes, time_budget=args.time_budget)
+            timings.append(time.perf_counter() - started)
+            improved.append(km)
+            converged += done
+        timings.sort()
+        results[count] = {
+            'planning_ms': {'p50': round(percentile(timings, 0.5) * 1000, 1),
+                            'max': round(timings[-1] * 1000, 1)},
+            'nearest_neighbour_km': round(sum(greedy) / len(greedy), 1),
+            'two_opt_km': round(sum(improved) / len(improved), 1),
+            'converged_runs': converged,
+        }
+    print(json.dumps({'git_commit': git_commit(), 'time_budget': args.time_budget, 'runs': args.runs,
+                      'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Throughput and lag of webhook delivery from the outbox.
+
+Seeds a SQLite file, registers --subscribers endpoints on a local stand-in
+HTTP receiver, then posts --events scan events through /parcels/scans while
+a real `flask deliver-webhooks` process delivers them. Reports, per
+OUTBOX_BATCH_SIZE in --batch-sizes, delivered events/second, POSTs,
+duplicates and the lag from commit to receipt as JSON.
+
+    python benchmarks/webhooks.py --events 20000 --subscribers 4 --batch-sizes 1,100 --fail-rate 0.05
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_KEY = 'benchmark-admin-key'
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dataset  # noqa: E402
+from endpoints import git_commit, percentile  # noqa: E402
+
+
+class Receiver(ThreadingHTTPServer):
+    """Stand-in subscriber endpoint: records every event, optionally failing or slow."""
+
+    daemon_threads = True
+
+    def __init__(self, fail_rate=0.0, delay=0.0, seed=42):
+        super().__init__(('127.0.0.1', 0), ReceiverHandler)
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.seen = {}
+            self.latencies = []
+            self.posts = 0
+            self.failed_posts = 0
+            self.duplicates = 0
+            self.last_received = None
+
+    def record(self, path, events):
+        now = datetime.utcnow()
+        with self.lock:
+            if self.rng.random() < self.fail_rate:
+                self.failed_posts += 1
+                return False
+            self.posts += 1
+            seen = self.seen.setdefault(path, set())
+            for event in events:
+                if event['id'] in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(event['id'])
+                self.latencies.append((now - datetime.fromisoformat(event['created_at'])).total_seconds())
+            self.last_received = time.perf_counter()
+            return True
+
+    def delivered(self, path):
+        with self.lock:
+            return len(self.seen.get(path, ()))
+
+
+class ReceiverHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        ok = self.server.record(self.path, json.loads(body)['events'])
+        self.send_response(204 if ok else 503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def produce(app, tracking_numbers, events, batch, seed):
+    """POST ``events`` scan events in batches of ``batch``; returns the seconds it took."""
+    rng = random.Random(seed)
+    client = app.test_client()
+    started = time.perf_counter()
+    sent = 0
+    with contextlib.redirect_stdout(sys.stderr):
+        while sent < events:
+            count = min(batch, events - sent)
+            response = client.post('/parcels/scans', json=[
+                {'tracking_number': rng.choice(tracking_numbers), 'status': 'In Transit', 'location': 'Bench Hub'}
+                for _ in range(count)])
+            if response.status_code != 200:
+                raise RuntimeError(f'scan batch failed with {response.status_code}')
+            sent += count
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=20000, help='Scan events produced per run.')
+    parser.add_argument('--scan-batch', type=int, default=50, help='Scan events per /parcels/scans request.')
+    parser.add_argument('--subscribers', type=int, default=4, help='Webhook subscribers, all on the receiver.')
+    parser.add_argument('--batch-sizes', default='1,100', help='Comma-separated OUTBOX_BATCH_SIZE values to run.')
+    parser.add_argument('--threads', type=int, default=8, help='OUTBOX_DELIVERY_THREADS of the worker.')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of POSTs the receiver answers with 503.')
+    parser.add_argument('--receiver-delay', type=float, default=0.002, help='Seconds the receiver takes per POST.')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds to wait for delivery to catch up.')
+    parser.add_argument('--parcels', type=int, default=5000, help='Parcels in the seeded SQLite file.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='parcel-webhooks-')
+    path = os.path.join(workdir, 'bench.db')
+    os.environ.update(DATABASE_URL='sqlite:///' + path, DB_PROFILE='worker',
+                      # One client address would trip the tracking rate limit.
+                      ADMISSION_ENABLED='0', SLOW_REQUEST_SECONDS='3600',
+                      # The receiver is on loopback.
+                      ADMIN_API_KEY=ADMIN_KEY, WEBHOOK_ALLOW_PRIVATE_URLS='1')
+    sys.path.insert(0, ROOT)
+
+    import logging
+    from flask_migrate import upgrade
+    from sqlalchemy import select
+    from app import app, db
+    from models import Parcel
+
+    logging.disable(logging.INFO)
+    log = lambda message: print(message, file=sys.stderr)  # noqa: E731
+    config = {'parcels': args.parcels, 'customers': max(args.parcels // 10, 1), 'couriers': 20,
+              'tracking_updates': args.parcels * 2, 'seed': args.seed}
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+        dataset.seed(db, config, log=log)
+        tracking_numbers = db.session.scalars(select(Parcel.tracking_number).limit(1000)).all()
+
+    receiver = Receiver(args.fail_rate, args.receiver_delay, args.seed)
+    threading.Thread(target=receiver.serve_forever, daemon=True).start()
+    port = receiver.server_address[1]
+    client = app.test_client()
+    admin = {'Authorization': f'Bearer {ADMIN_KEY}'}
+
+    results = {}
+    for batch_size in (int(value) for value in args.batch_sizes.split(',')):
+        receiver.reset()
+        # Fresh subscribers start at the current end of the outbox.
+        for subscriber in client.get('/webhooks', headers=admin).get_json():
+            client.delete(f"/webhooks/{subscriber['id']}", headers=admin)
+        paths = [f'/hook/{batch_size}/{index}' for index in range(args.subscribers)]
+        for hook in paths:
+            client.post('/webhooks', json={'url': f'http://127.0.0.1:{port}{hook}'}, headers=admin)
+
+        env = dict(os.environ, OUTBOX_BATCH_SIZE=str(batch_size), OUTBOX_DELIVERY_THREADS=str(args.threads),
+                   OUTBOX_POLL_INTERVAL='0.05', OUTBOX_BACKOFF_BASE='0.1', OUTBOX_BACKOFF_MAX='2')
+        worker = subprocess.Popen(['flask', 'deliver-webhooks', '--stats-interval', '0'], cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL)
+        try:
+            log(f'batch size {batch_size}: producing {args.events} events')
+            started = time.perf_counter()
+            produce_seconds = produce(app, tracking_numbers, args.events, args.scan_batch, args.seed)
+            produced_at = time.perf_counter()
+            deadline = produced_at + args.timeout
+            while time.perf_counter() < deadline and any(receiver.delivered(hook) < args.events for hook in paths):
+                if worker.poll() is not None:
+                    raise RuntimeError(f'worker exited with {worker.returncode}')
+                time.sleep(0.05)
+        finally:
+            worker.terminate()
+            worker.wait(timeout=30)
+
+        delivered = sum(receiver.delivered(hook) for hook in paths)
+        finished = receiver.last_received or produced_at
+        latencies = sorted(receiver.latencies)
+        to_ms = lambda value: round(value * 1000, 1) if value is not None else None  # noqa: E731
+        results[str(batch_size)] = {
+            'events_produced': args.events,
+            'produce_events_per_second': round(args.events / produce_seconds, 1),
+            'events_delivered': delivered,
+            'complete': delivered == args.events * len(paths),
+            'delivered_events_per_second': round(delivered / (finished - started), 1),
+            'drain_seconds_after_producer': round(max(0.0, finished - produced_at), 3),
+            'posts': receiver.posts,
+            'failed_posts': receiver.failed_posts,
+            'duplicates': receiver.duplicates,
+            'lag_ms': {
+                'p50': to_ms(percentile(latencies, 0.50)),
+                'p95': to_ms(percentile(latencies, 0.95)),
+                'p99': to_ms(percentile(latencies, 0.99)),
+                'max': to_ms(latencies[-1] if latencies else None),
+            },
+        }
+    receiver.shutdown()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'database': 'sqlite',
+            'events': args.events,
+            'subscribers': args.subscribers,
+            'delivery_threads': args.threads,
+            'fail_rate': args.fail_rate,
+            'receiver_delay_seconds': args.receiver_delay,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
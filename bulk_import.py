@@ -0,0 +1,256 @@
+# bulk_import.py
+import csv
+import io
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+
+from models import db, Parcel, Customer, Courier, TrackingUpdate
+from assignment import courier_loads, parcel_volume
+from parcel_summary import fold_tracking_updates
+from counters import next_value, PARCEL_VERSION
+from geocoding import geocoding
+from tracking_numbers import tracking_numbers
+from rollups import record_rollups, rollup_entry, ROLLUP_FIELDS
+from events import tracking_event
+from outbox import record_events
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+CUSTOMER_FIELDS = ('name', 'email', 'phone', 'address')
+
+
+def read_csv(stream):
+    # Flat columns: sender_name, sender_email, ..., recipient_address,
+    # weight, length, width, height, service_type, description
+    for row in csv.DictReader(stream):
+        data = {key: value for key, value in row.items() if value not in (None, '')}
+        for role in ('sender', 'recipient'):
+            data[role] = {
+                field: data.pop(f'{role}_{field}')
+                for field in CUSTOMER_FIELDS if f'{role}_{field}' in data
+            }
+        yield data
+
+
+def read_jsonl(stream):
+    # One create_parcel payload per line; a line that is not valid JSON is
+    # passed on as its error so it is reported against its own row.
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f'invalid JSON: {e}')
+
+
+def read_rows(stream, fmt):
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.StringIO(stream.decode('utf-8'))
+    elif not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        return read_csv(stream)
+    if fmt == 'jsonl':
+        return read_jsonl(stream)
+    raise ValueError(f'Unsupported import format: {fmt}')
+
+
+def _parse_row(data):
+    if isinstance(data, ValueError):
+        raise data
+    if not isinstance(data, dict):
+        raise ValueError('row must be an object')
+    customers = {}
+    for role in ('sender', 'recipient'):
+        person = data.get(role)
+        if not isinstance(person, dict):
+            raise ValueError(f'{role} is required')
+        missing = [field for field in CUSTOMER_FIELDS if not person.get(field)]
+        if missing:
+            raise ValueError(f"{role} is missing {', '.join(missing)}")
+        customers[role] = {field: person[field] for field in CUSTOMER_FIELDS}
+    try:
+        dimensions = {
+            'weight': float(data.get('weight', 1.0)),
+            'length': float(data.get('length', 10)),
+            'width': float(data.get('width', 5)),
+            'height': float(data.get('height', 2)),
+        }
+    except (TypeError, ValueError):
+        raise ValueError('weight, length, width and height must be numbers')
+    return {
+        'sender': customers['sender'],
+        'recipient': customers['recipient'],
+        'service_type': data.get('service_type', 'Standard'),
+        'description': data.get('description', 'Demo parcel'),
+        **dimensions,
+    }
+
+
+def _insert_chunk(rows, courier_names, reservations, merchant_id=None):
+    """Insert parsed rows with three set-based INSERTs; returns their tracking numbers.
+
+    Couriers reserved from the load index are appended to ``reservations``
+    so the caller can release them if the chunk is rolled back.
+    """
+    now = datetime.utcnow()
+    numbers = tracking_numbers.allocate(len(rows))
+
+    customer_rows = []
+    for row in rows:
+        customer_rows.append(geocoding.locate(row['sender']))
+        customer_rows.append(geocoding.locate(row['recipient']))
+    customer_ids = db.session.scalars(
+        insert(Customer).returning(Customer.id, sort_by_parameter_order=True), customer_rows
+    ).all()
+
+    assigned = []
+    for row in rows:
+        volume = parcel_volume(row['length'], row['width'], row['height'])
+        courier_id = courier_loads.acquire(row['weight'], volume)
+        if courier_id is None:
+            raise RuntimeError('No couriers available')
+        reservations.append((courier_id, row['weight'], volume))
+        assigned.append(courier_id)
+    summary = fold_tracking_updates(None, None, None, [{'status': 'Created', 'location': 'System', 'timestamp': now}])
+    first_version = next_value(PARCEL_VERSION, len(rows)) - len(rows) + 1
+    parcel_rows = [
+        {
+            'tracking_number': tracking_number,
+            'sender_id': customer_ids[2 * i],
+            'recipient_id': customer_ids[2 * i + 1],
+            'courier_id': courier_id,
+            'merchant_id': merchant_id,
+            'weight': row['weight'],
+            'length': row['length'],
+            'width': row['width'],
+            'height': row['height'],
+            'service_type': row['service_type'],
+            'estimated_delivery': now + timedelta(days=random.randint(2, 7)),
+            'description': row['description'],
+            'status': 'Created',
+            'version': first_version + i,
+            **summary,
+        }
+        for i, (row, tracking_number, courier_id) in enumerate(zip(rows, numbers, assigned))
+    ]
+    parcel_ids = db.session.scalars(
+        insert(Parcel).returning(Parcel.id, sort_by_parameter_order=True), parcel_rows
+    ).all()
+    record_rollups(added=[rollup_entry(**{field: row[field] for field in ROLLUP_FIELDS}) for row in parcel_rows])
+
+    update_rows = [
+        {
+            'parcel_id': parcel_id,
+            'status': 'Created',
+            'location': 'System',
+            'timestamp': now,
+            'description': 'Parcel created and assigned to courier: ' + (courier_names.get(courier_id) or ''),
+        }
+        for parcel_id, courier_id in zip(parcel_ids, assigned)
+    ]
+    update_ids = db.session.scalars(
+        insert(TrackingUpdate).returning(TrackingUpdate.id, sort_by_parameter_order=True), update_rows
+    ).all()
+    record_events([tracking_event(update_id, tracking_number, courier_id, row)
+                   for update_id, tracking_number, courier_id, row in zip(update_ids, numbers, assigned, update_rows)],
+                  'parcel.created')
+    return numbers
+
+
+def import_parcels(rows, chunk_size=DEFAULT_CHUNK_SIZE, merchant_id=None):
+    """Create parcels from an iterable of create_parcel payloads, committing per chunk.
+
+    The parcels belong to ``merchant_id`` when it is given.
+
+    Rows that fail validation are reported and skipped. If a chunk fails in
+    the database it is retried row by row, so one bad row never aborts the
+    rest of the import.
+    """
+    courier_names = dict(db.session.execute(select(Courier.id, Courier.name)).all())
+    if not courier_names:
+        raise RuntimeError('No couriers available')
+
+    report = {'created': 0, 'failed': 0, 'errors': []}
+
+    def fail(line, error):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': line, 'error': error})
+
+    started = time.perf_counter()
+    numbered = enumerate(rows, start=1)
+    while True:
+        try:
+            chunk = list(islice(numbered, chunk_size))
+        except csv.Error as e:
+            # A malformed line in the source ends the readable part of the file.
+            fail(report['created'] + report['failed'] + 1, f'Unreadable input: {e}')
+            break
+        if not chunk:
+            break
+
+        parsed = []
+        for line, data in chunk:
+            try:
+                parsed.append((line, _parse_row(data)))
+            except ValueError as e:
+                fail(line, str(e))
+        if not parsed:
+            continue
+
+        reservations = []
+        try:
+            created = _insert_chunk([row for _, row in parsed], courier_names, reservations, merchant_id)
+            db.session.commit()
+            tracking_numbers.add_many(created)
+            report['created'] += len(parsed)
+        except Exception:
+            db.session.rollback()
+            for reservation in reservations:
+                courier_loads.release(*reservation)
+            for line, row in parsed:
+                reservations = []
+                try:
+                    created = _insert_chunk([row], courier_names, reservations, merchant_id)
+                    db.session.commit()
+                    tracking_numbers.add_many(created)
+                    report['created'] += 1
+                except Exception as e:
+                    db.session.rollback()
+                    for reservation in reservations:
+                        courier_loads.release(*reservation)
+                    fail(line, str(e))
+
+        elapsed = time.perf_counter() - started
+        logging.info("Imported %d parcels (%d failed) in %.1fs, %.0f rows/s",
+                     report['created'], report['failed'], elapsed,
+                     (report['created'] + report['failed']) / elapsed if elapsed else 0)
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['rows_per_second'] = round(report['created'] / report['seconds'], 1) if report['seconds'] else None
+    return report
+
+
+@click.command('import-parcels')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Input format; defaults to the file extension.')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True,
+              help='Rows inserted per transaction.')
+@click.option('--merchant-id', type=int, help='Customer id of the merchant the parcels belong to.')
+@with_appcontext
+def import_parcels_command(path, fmt, chunk_size, merchant_id):
+    """Bulk-create parcels from a CSV or JSON-lines file."""
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'jsonl')
+    with open(path, encoding='utf-8', newline='') as stream:
+        report = import_parcels(read_rows(stream, fmt), chunk_size=chunk_size, merchant_id=merchant_id)
+    click.echo(json.dumps(report, indent=2))
@@ -0,0 +1,225 @@
+# cache.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """In-process LRU cache with a per-entry TTL and a bound on entry count."""
+
+    def __init__(self, max_entries=10000, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value, None)
+
+    def set_if_newer(self, key, value, version):
+        """Store ``value`` unless a live entry has a higher version; returns whether it was stored."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] > version \
+                    and entry[1] > time.monotonic():
+                return False
+            self._store(key, value, version)
+            return True
+
+    def _store(self, key, value, version):
+        self._entries[key] = (value, time.monotonic() + self.ttl, version)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """Cache shared by every worker process through a local SQLite file.
+
+    Stands in for a networked cache such as Redis: entries written by one
+    gunicorn worker are visible to (and invalidated for) all the others.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_entries=10000, ttl=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._writes = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entry ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, version INTEGER)'
+            )
+            # Cache files written before entries were versioned.
+            if 'version' not in {row[1] for row in conn.execute('PRAGMA table_info(cache_entry)')}:
+                conn.execute('ALTER TABLE cache_entry ADD COLUMN version INTEGER')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM cache_entry WHERE key = ? AND expires_at > ?',
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, value, time.time() + self.ttl),
+        )
+        self._wrote(conn)
+
+    def set_if_newer(self, key, value, version):
+        """Store ``value`` unless a live entry has a higher version; returns whether it was stored."""
+        conn = self._connect()
+        now = time.time()
+        # One statement, so the check and the write are atomic across workers.
+        cursor = conn.execute(
+            'INSERT INTO cache_entry (key, value, expires_at, version) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at, '
+            'version = excluded.version WHERE cache_entry.version IS NULL '
+            'OR cache_entry.version <= excluded.version OR cache_entry.expires_at <= ?',
+            (key, value, now + self.ttl, version, now),
+        )
+        self._wrote(conn)
+        return cursor.rowcount > 0
+
+    def _wrote(self, conn):
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune(conn)
+
+    def _prune(self, conn):
+        conn.execute('DELETE FROM cache_entry WHERE expires_at <= ?', (time.time(),))
+        # Entries expiring soonest were written longest ago, which makes this
+        # an approximate LRU bound that needs no per-read bookkeeping.
+        cursor = conn.execute(
+            'DELETE FROM cache_entry WHERE key IN ('
+            'SELECT key FROM cache_entry ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        )
+        self.evictions += max(cursor.rowcount, 0)
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache_entry')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+
+
+class TrackingCache:
+    """Read-through cache of serialized /parcels/track/<tracking_number> bodies.
+
+    The backend is an in-process LRU by default. Setting
+    TRACKING_CACHE_BACKEND to ``sqlite:///<path>`` switches to a backend
+    shared by all workers, so an invalidation in one worker is seen by the
+    rest.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('TRACKING_CACHE_ENABLED', True)
+        max_entries = int(app.config.get('TRACKING_CACHE_MAX_ENTRIES', 10000))
+        ttl = float(app.config.get('TRACKING_CACHE_TTL', 30))
+        backend = app.config.get('TRACKING_CACHE_BACKEND', 'memory')
+        if backend.startswith('sqlite:///'):
+            path = backend[len('sqlite:///'):]
+            if not os.path.isabs(path):
+                path = os.path.join(app.instance_path, path)
+                os.makedirs(app.instance_path, exist_ok=True)
+            self.backend = SQLiteCacheBackend(path, max_entries=max_entries, ttl=ttl)
+        elif backend == 'memory':
+            self.backend = LRUCache(max_entries=max_entries, ttl=ttl)
+        else:
+            raise ValueError(f'Unsupported TRACKING_CACHE_BACKEND: {backend}')
+        app.extensions['tracking_cache'] = self
+
+    def get(self, tracking_number):
+        """(version, body) of a cached parcel, or None."""
+        if not self.enabled:
+            return None
+        value = self.backend.get(tracking_number)
+        version, _, body = (value or '').partition('\n')
+        # An invalidation leaves its version with an empty body.
+        if not version.isdigit() or not body:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return int(version), body
+
+    def set(self, tracking_number, body, version):
+        """Cache a parcel's body with the version read before it, which its ETag is built from.
+
+        A reader that lost a race with a writer holds an older version than
+        the writer's invalidation, so its body is not stored.
+        """
+        if self.enabled:
+            self.backend.set_if_newer(tracking_number, f'{version}\n{body}', version)
+
+    def invalidate(self, tracking_number, version):
+        """Drop a parcel's body once ``version`` of it has committed."""
+        if self.enabled:
+            self.backend.set_if_newer(tracking_number, f'{version}\n', version)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+        }
+
+
+tracking_cache = TrackingCache()
@@ -0,0 +1,63 @@
+# compression.py
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/html', 'text/csv'}
+
+
+class Compression:
+    """gzip/brotli encoding of responses negotiated through Accept-Encoding.
+
+    Only buffered bodies of at least COMPRESS_MIN_SIZE bytes are encoded;
+    streamed responses, including server-sent events, pass through
+    untouched so they are not held back. Brotli is used when the
+    ``brotli`` package is installed and the client prefers it.
+    """
+
+    def __init__(self, app=None):
+        self.min_size = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 4
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = int(app.config.get('COMPRESS_MIN_SIZE', self.min_size))
+        self.gzip_level = int(app.config.get('COMPRESS_GZIP_LEVEL', self.gzip_level))
+        self.brotli_quality = int(app.config.get('COMPRESS_BROTLI_QUALITY', self.brotli_quality))
+        app.after_request(self._compress)
+        app.extensions['compression'] = self
+
+    def encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def _compress(self, response):
+        if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.is_streamed
+                or response.direct_passthrough or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        if response.content_length is None or response.content_length < self.min_size:
+            return response
+        encoding = request.accept_encodings.best_match(self.encodings())
+        if encoding is None:
+            return response
+
+        body = response.get_data()
+        if encoding == 'br':
+            body = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            body = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+compression = Compression()
@@ -0,0 +1,32 @@
+# conditional.py
+import hashlib
+
+from flask import current_app, request
+
+# Conditional GETs: endpoints build a weak ETag from a cheap validator
+# (parcel versions, a courier's version aggregate) before touching the
+# payload, and answer a matching If-None-Match with an empty 304. Tags
+# are weak because compression changes the bytes but not the meaning.
+
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()[:20]
+
+
+def variant(fields, history):
+    """ETag part for the ?fields= and ?history= options of a parcel payload."""
+    return f"{','.join(sorted(fields))};{history}"
+
+
+def with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    # Cached copies may be kept, but must be revalidated before reuse.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def not_modified(etag):
+    """A 304 response when the request's If-None-Match matches ``etag``, else None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(current_app.response_class(status=304), etag)
@@ -0,0 +1,80 @@
+# counters.py
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Counter
+
+PARCEL_VERSION = 'parcel_version'
+# Highest parcel version whose tombstones have been pruned; delta cursors
+# below it can no longer be served.
+TOMBSTONE_HORIZON = 'tombstone_horizon'
+# Sequence behind generated tracking numbers; see tracking_numbers.py.
+TRACKING_NUMBER_SEQUENCE = 'tracking_number'
+
+# Built once: every write path advances a counter, and building and
+# caching the statement again would cost more than running it.
+ADVANCE = (update(Counter).where(Counter.name == bindparam('counter_name'))
+           .values(value=Counter.value + bindparam('step')).returning(Counter.value))
+
+
+def next_value(name, count=1):
+    """Advance counter ``name`` by ``count`` and return its new value.
+
+    The values ``value - count + 1`` through ``value`` belong to the caller.
+    The counter row stays locked until the transaction ends, so values are
+    handed out in commit order: once a reader sees value N committed,
+    nothing at or below N can still appear.
+    """
+    params = {'counter_name': name, 'step': count}
+    # On the session's connection, skipping the ORM's bulk UPDATE handling.
+    value = db.session.connection().scalar(ADVANCE, params)
+    if value is not None:
+        return value
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(Counter).values(name=name, value=count))
+        return count
+    except IntegrityError:
+        # Created by a concurrent transaction in the meantime.
+        return db.session.connection().scalar(ADVANCE, params)
+
+
+def reserve(name, count):
+    """Like next_value(), but committed at once in a transaction of its own.
+
+    The block stays taken even if the caller's transaction rolls back, and
+    the counter row is not held locked meanwhile. Call it before the
+    caller's transaction has written anything, which on SQLite would block
+    this one.
+    """
+    params = {'counter_name': name, 'step': count}
+    with db.engine.begin() as connection:
+        value = connection.scalar(ADVANCE, params)
+        if value is None:
+            try:
+                with connection.begin_nested():
+                    connection.execute(insert(Counter).values(name=name, value=count))
+                value = count
+            except IntegrityError:
+                value = connection.scalar(ADVANCE, params)
+    return value
+
+
+def advance_to(name, value):
+    """Raise counter ``name`` to at least ``value``."""
+    if next_value(name, 0) < value:
+        db.session.execute(update(Counter).where(Counter.name == name).values(value=value))
+
+
+def counter_statement(name):
+    return select(Counter.value).where(Counter.name == name)
+
+
+def read_current_value(name):
+    """Reader (see read_models.py): the value of counter ``name``, 0 before its first use."""
+    rows = yield counter_statement(name)
+    return rows[0][0] if rows else 0
+
+
+def current_value(name):
+    return db.session.scalar(counter_statement(name)) or 0
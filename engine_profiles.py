@@ -0,0 +1,115 @@
+# engine_profiles.py
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from database import db
+
+# Each profile has settings for SQLite and for server databases (Postgres,
+# MySQL). 'default' leaves SQLAlchemy's and the driver's defaults alone.
+PROFILES = {
+    'default': {
+        'sqlite': {},
+        'server': {},
+    },
+    # Gunicorn workers serving short requests.
+    'web': {
+        'sqlite': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+        },
+        'server': {
+            'pool_size': 5,
+            'max_overflow': 10,
+            'pool_timeout': 10,
+            'pool_pre_ping': True,
+            'pool_recycle': 1800,
+            'statement_timeout': 30000,
+        },
+    },
+    # CLI commands and background jobs: few connections, long statements.
+    'worker': {
+        'sqlite': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 60000,
+            'mmap_size': 256 * 1024 * 1024,
+        },
+        'server': {
+            'pool_size': 2,
+            'max_overflow': 2,
+            'pool_pre_ping': True,
+            'pool_recycle': 1800,
+            'statement_timeout': 0,
+        },
+    },
+}
+
+# Config keys that override a single setting of the selected profile.
+OVERRIDES = {
+    'DB_POOL_SIZE': ('server', 'pool_size'),
+    'DB_MAX_OVERFLOW': ('server', 'max_overflow'),
+    'DB_POOL_RECYCLE': ('server', 'pool_recycle'),
+    'DB_STATEMENT_TIMEOUT_MS': ('server', 'statement_timeout'),
+    'SQLITE_BUSY_TIMEOUT_MS': ('sqlite', 'busy_timeout'),
+}
+
+
+class EngineProfile:
+    """Named engine settings selected with DB_PROFILE.
+
+    init_app() must run before db.init_app() so the pool settings reach
+    SQLALCHEMY_ENGINE_OPTIONS; install() runs after it and applies the
+    SQLite pragmas to every new connection.
+    """
+
+    def __init__(self):
+        self.name = None
+        self.settings = {}
+        self.backend = None
+
+    def init_app(self, app):
+        self.name = app.config.get('DB_PROFILE', 'web')
+        if self.name not in PROFILES:
+            raise ValueError(f"Unknown DB_PROFILE {self.name!r}; choose from {', '.join(PROFILES)}")
+        url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        self.backend = url.get_backend_name()
+        kind = 'sqlite' if self.backend == 'sqlite' else 'server'
+        self.settings = dict(PROFILES[self.name][kind])
+        for key, (applies_to, setting) in OVERRIDES.items():
+            if applies_to == kind and app.config.get(key) is not None:
+                self.settings[setting] = int(app.config[key])
+
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        if kind == 'server':
+            settings = dict(self.settings)
+            timeout = settings.pop('statement_timeout', None)
+            options.update(settings)
+            if timeout is not None and self.backend == 'postgresql':
+                connect_args = dict(options.get('connect_args', {}))
+                connect_args['options'] = f"{connect_args.get('options', '')} -c statement_timeout={timeout}".strip()
+                options['connect_args'] = connect_args
+            elif timeout:
+                logging.warning("statement_timeout is only applied on PostgreSQL; ignoring it for %s", self.backend)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+        app.extensions['engine_profile'] = self
+
+    def install(self, app):
+        with app.app_context():
+            engine = db.engine
+            if self.backend == 'sqlite' and self.settings:
+                event.listen(engine, 'connect', self._apply_pragmas)
+            logging.info("Database profile %r on %s (%s): %s", self.name, self.backend,
+                         type(engine.pool).__name__, self.settings or 'driver defaults')
+
+    def _apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in self.settings.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+        cursor.close()
+
+
+engine_profile = EngineProfile()
@@ -0,0 +1,354 @@
+# events.py
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, jsonify, request, stream_with_context
+from sqlalchemy import select
+
+from models import db, OutboxEvent, Parcel
+
+REPLAY_LIMIT = 1000
+RETRY_MS = 3000
+
+
+class Subscription:
+    def __init__(self, channels, max_pending):
+        self.channels = channels
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.closed = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LoopQueue:
+    """Queue fed from any thread and drained by a coroutine on ``loop``."""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.maxsize = maxsize
+        self.items = asyncio.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def put_nowait(self, item):
+        with self._lock:
+            if self._pending >= self.maxsize:
+                raise queue.Full
+            self._pending += 1
+        self.loop.call_soon_threadsafe(self.items.put_nowait, item)
+
+    async def get(self, timeout):
+        try:
+            item = await asyncio.wait_for(self.items.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        with self._lock:
+            self._pending -= 1
+        return item
+
+
+class AsyncSubscription:
+    """A subscription for a stream served on an event loop instead of a thread."""
+
+    def __init__(self, channels, max_pending, loop):
+        self.channels = channels
+        self.queue = LoopQueue(loop, max_pending)
+        self.closed = False
+
+    async def get(self, timeout):
+        return await self.queue.get(timeout)
+
+    def close(self):
+        """Wake the stream and end it; call on the subscription's loop."""
+        self.closed = True
+        self.queue.items.put_nowait(None)
+
+
+class FileBroker:
+    """Fans events out across worker processes through an append-only file.
+
+    A local stand-in for a message broker such as Redis pub/sub: every
+    worker appends published events as JSON lines and tails the file from a
+    background thread. The file is rotated to ``<path>.1`` once it exceeds
+    ``max_bytes``; readers finish the old file through their open handle
+    before switching to the new one.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, poll_interval=0.1):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        open(self.path, 'a').close()
+
+    def publish(self, channels, event):
+        line = json.dumps({'channels': channels, 'event': event}) + '\n'
+        while True:
+            with open(self.path, 'a') as log:
+                fcntl.flock(log, fcntl.LOCK_EX)
+                # Another worker may have rotated the file while we waited.
+                try:
+                    if os.fstat(log.fileno()).st_ino != os.stat(self.path).st_ino:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if log.tell() > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+                    open(self.path, 'a').close()
+                    continue
+                log.write(line)
+                return
+
+    def listen(self, dispatch):
+        log = open(self.path)
+        log.seek(0, os.SEEK_END)
+        pending = ''
+        while True:
+            pending = self._drain(log, pending, dispatch)
+            current = os.fstat(log.fileno()).st_ino
+            try:
+                rotated = os.stat(self.path).st_ino != current
+            except FileNotFoundError:
+                rotated = False
+            if not rotated:
+                time.sleep(self.poll_interval)
+                continue
+            # Nothing is appended to a file once it has been rotated, so
+            # whatever landed after our last read is still there to drain.
+            pending = self._drain(log, pending, dispatch)
+            log.close()
+            # If the file was rotated again before we got to it, the
+            # backlog still sits in <path>.1; read that first.
+            try:
+                missed = os.stat(self.path + '.1').st_ino != current
+            except FileNotFoundError:
+                missed = False
+            log = open(self.path + '.1' if missed else self.path)
+
+    @staticmethod
+    def _drain(log, pending, dispatch):
+        for line in iter(log.readline, ''):
+            pending += line
+            if not pending.endswith('\n'):
+                break
+            try:
+                message = json.loads(pending)
+                dispatch(message['channels'], message['event'])
+            except ValueError:
+                logging.warning("Skipping malformed event broker line")
+            pending = ''
+        return pending
+
+
+class EventHub:
+    """In-process publish/subscribe hub for tracking events.
+
+    Subscribers wait on their own queue, so an idle SSE connection costs no
+    database work. Under gunicorn each stream also parks a worker thread,
+    and at most EVENTS_MAX_STREAMS are open per worker; under asgi.py
+    streams wait on the event loop instead (subscribe() with ``loop``).
+    Channels are ``parcel:<tracking number>`` and ``courier:<courier id>``. When EVENTS_BROKER names a file,
+    events go through a FileBroker so subscribers in every worker see them.
+    A subscriber that stops draining its queue is dropped; its client
+    reconnects with Last-Event-ID and resumes from the database.
+    """
+
+    def __init__(self, app=None):
+        self.broker = None
+        self.heartbeat = 15.0
+        self.max_pending = 256
+        self.max_streams = 4
+        self._streams = 0
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.heartbeat = float(app.config.get('EVENTS_HEARTBEAT', self.heartbeat))
+        self.max_pending = int(app.config.get('EVENTS_MAX_PENDING', self.max_pending))
+        self.max_streams = int(app.config.get('EVENTS_MAX_STREAMS', self.max_streams))
+        broker = app.config.get('EVENTS_BROKER', 'local')
+        if broker.startswith('file://'):
+            self.broker = FileBroker(broker[len('file://'):])
+            threading.Thread(target=self.broker.listen, args=(self.dispatch,),
+                             name='event-broker', daemon=True).start()
+        elif broker != 'local':
+            raise ValueError(f'Unsupported EVENTS_BROKER: {broker}')
+        app.extensions['event_hub'] = self
+
+    def subscribe(self, channels, loop=None):
+        if loop is not None:
+            subscription = AsyncSubscription(channels, self.max_pending, loop)
+        else:
+            subscription = Subscription(channels, self.max_pending)
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channels, event):
+        if self.broker is not None:
+            self.broker.publish(channels, event)
+        else:
+            self.dispatch(channels, event)
+
+    def dispatch(self, channels, event):
+        with self._lock:
+            targets = set()
+            for channel in channels:
+                targets.update(self._subscribers.get(channel, ()))
+        for subscription in targets:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.closed = True
+                self.unsubscribe(subscription)
+
+    def open_stream(self):
+        """Take one of this worker's thread-bound stream slots; False when all are taken."""
+        with self._lock:
+            if self._streams >= self.max_streams:
+                return False
+            self._streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self._streams -= 1
+
+    def stream_count(self):
+        with self._lock:
+            return self._streams
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subscribers in self._subscribers.values() for s in subscribers})
+
+
+def tracking_event(update_id, tracking_number, courier_id, update):
+    return {
+        'id': update_id,
+        'tracking_number': tracking_number,
+        'courier_id': courier_id,
+        'timestamp': update['timestamp'].isoformat(),
+        'status': update['status'],
+        'location': update['location'],
+        'description': update['description'],
+    }
+
+
+def publish_tracking_events(events):
+    for event in events:
+        channels = [f"parcel:{event['tracking_number']}"]
+        if event['courier_id']:
+            channels.append(f"courier:{event['courier_id']}")
+        event_hub.publish(channels, event)
+
+
+def format_sse(event):
+    return f"id: {event['sequence']}\nevent: tracking\ndata: {json.dumps(event)}\n\n"
+
+
+def stream_channels(tracking_number=None, courier_id=None):
+    if tracking_number is not None:
+        return [f'parcel:{tracking_number}']
+    return [f'courier:{courier_id}']
+
+
+def replay_statement(last_id, tracking_number=None, courier_id=None):
+    """Events after ``last_id`` from the outbox, whose ids are handed out in commit order.
+
+    Tracking update ids are not: an update with a lower id can commit after
+    one with a higher id, and would never be replayed.
+    """
+    query = (
+        select(OutboxEvent.id, OutboxEvent.payload)
+        .where(OutboxEvent.id > last_id)
+        .order_by(OutboxEvent.id)
+        .limit(REPLAY_LIMIT)
+    )
+    if tracking_number is not None:
+        query = query.where(OutboxEvent.tracking_number == tracking_number)
+    if courier_id is not None:
+        query = query.join(Parcel, Parcel.tracking_number == OutboxEvent.tracking_number) \
+            .where(Parcel.courier_id == courier_id)
+    return query
+
+
+def replayed_event(row):
+    return dict(row.payload, sequence=row.id)
+
+
+def replay_events(last_id, tracking_number=None, courier_id=None):
+    return [replayed_event(row) for row in db.session.execute(replay_statement(last_id, tracking_number, courier_id))]
+
+
+def event_stream(channels, last_id, **filters):
+    # Subscribe before replaying so nothing committed in between is missed;
+    # live events already covered by the replay are skipped by sequence.
+    subscription = event_hub.subscribe(channels)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        if last_id is not None:
+            for event in replay_events(last_id, **filters):
+                last_id = event['sequence']
+                yield format_sse(event)
+        # Idle streams must not pin a pooled connection.
+        db.session.remove()
+        while not subscription.closed:
+            event = subscription.get(event_hub.heartbeat)
+            if event is None:
+                yield ': keep-alive\n\n'
+            elif last_id is None or event['sequence'] > last_id:
+                yield format_sse(event)
+    finally:
+        event_hub.unsubscribe(subscription)
+
+
+def last_event_id():
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_event_id', type=int)
+    return last_id
+
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def sse_response(**filters):
+    # Each open stream holds a worker thread until the client leaves.
+    if not event_hub.open_stream():
+        response = jsonify({'error': 'Too many open event streams, try again shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(RETRY_MS // 1000)
+        return response
+    response = current_app.response_class(
+        stream_with_context(event_stream(stream_channels(**filters), last_event_id(), **filters)),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS,
+    )
+    response.call_on_close(event_hub.close_stream)
+    return response
+
+
+event_hub = EventHub()
@@ -0,0 +1,108 @@
+# geocoding.py
+import hashlib
+import importlib
+import logging
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import or_, select, update
+
+from models import db, Customer
+
+# Customer.latitude/longitude come from a geocoder picked by GEOCODER:
+# 'offline' (the default) or 'package.module:ClassName' for any class
+# whose instances have geocode(address) -> (latitude, longitude) or None.
+# The class is built with the app config, e.g. to read an API key.
+
+DEFAULT_BOUNDS = (51.28, -0.51, 51.69, 0.33)  # Greater London
+DEFAULT_BACKFILL_BATCH = 1000
+
+
+class OfflineGeocoder:
+    """Stand-in geocoder that needs no network.
+
+    Hashes the address to a point inside GEOCODER_BOUNDS (south, west,
+    north, east), so the same address always gets the same coordinates.
+    Good enough to exercise route planning in development and benchmarks.
+    """
+
+    def __init__(self, config=None):
+        bounds = (config or {}).get('GEOCODER_BOUNDS') or DEFAULT_BOUNDS
+        if isinstance(bounds, str):
+            bounds = [float(value) for value in bounds.split(',')]
+        self.south, self.west, self.north, self.east = bounds
+
+    def geocode(self, address):
+        digest = hashlib.sha256(address.strip().lower().encode()).digest()
+        x = int.from_bytes(digest[:8], 'big') / 2 ** 64
+        y = int.from_bytes(digest[8:16], 'big') / 2 ** 64
+        return (round(self.south + x * (self.north - self.south), 6),
+                round(self.west + y * (self.east - self.west), 6))
+
+
+class Geocoding:
+    def __init__(self, app=None):
+        self.geocoder = OfflineGeocoder()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config.get('GEOCODER') or 'offline'
+        if name == 'offline':
+            self.geocoder = OfflineGeocoder(app.config)
+        else:
+            module, _, attr = name.partition(':')
+            self.geocoder = getattr(importlib.import_module(module), attr)(app.config)
+        app.extensions['geocoding'] = self
+
+    def geocode(self, address):
+        """(latitude, longitude) of ``address``, or (None, None) when it cannot be placed."""
+        if not address:
+            return None, None
+        try:
+            location = self.geocoder.geocode(address)
+        except Exception:
+            logging.exception("Geocoding failed for %r", address)
+            return None, None
+        return location or (None, None)
+
+    def locate(self, customer):
+        """Fill in the coordinates of a customer dict; returns it."""
+        customer['latitude'], customer['longitude'] = self.geocode(customer.get('address'))
+        return customer
+
+
+def backfill_coordinates(batch_size=DEFAULT_BACKFILL_BATCH, everything=False):
+    """Geocode customers without coordinates (or all of them), committing per batch."""
+    missing = or_(Customer.latitude.is_(None), Customer.longitude.is_(None))
+    total = 0
+    after = 0
+    while True:
+        query = select(Customer.id, Customer.address).where(Customer.id > after, Customer.address.is_not(None))
+        if not everything:
+            query = query.where(missing)
+        rows = db.session.execute(query.order_by(Customer.id).limit(batch_size)).all()
+        if not rows:
+            break
+        located = [{'id': row.id, 'address': row.address} for row in rows]
+        db.session.execute(update(Customer), [
+            {'id': customer['id'], 'latitude': customer['latitude'], 'longitude': customer['longitude']}
+            for customer in map(geocoding.locate, located)
+        ])
+        db.session.commit()
+        total += len(rows)
+        after = rows[-1].id
+    return total
+
+
+@click.command('geocode-customers')
+@click.option('--batch-size', default=DEFAULT_BACKFILL_BATCH, show_default=True, type=click.IntRange(1, 100000))
+@click.option('--all', 'everything', is_flag=True, help='Geocode every customer, not only those without coordinates.')
+@with_appcontext
+def geocode_customers_command(batch_size, everything):
+    """Fill in Customer.latitude/longitude from their addresses."""
+    total = backfill_coordinates(batch_size, everything)
+    click.echo(f'Geocoded {total} customers')
+
+
+geocoding = Geocoding()
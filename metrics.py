@@ -0,0 +1,292 @@
+# metrics.py
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from database import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+MAX_CAPTURED_STATEMENTS = 50
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Request latency by route.', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('Response body size by route.', SIZE_BUCKETS),
+    'http_request_sql_statements': ('SQL statements executed per request.', SQL_COUNT_BUCKETS),
+    'http_request_sql_duration_seconds': ('Total SQL time per request.', LATENCY_BUCKETS),
+}
+COUNTERS = {
+    'http_requests_total': 'Requests by route, method and status.',
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metrics:
+    """Per-route request instrumentation exposed in Prometheus text format.
+
+    Latency, response size and the number and total time of SQL statements
+    (counted through SQLAlchemy engine events) are recorded per route.
+    With METRICS_DIR set, every worker process periodically writes a
+    snapshot there and /metrics merges all of them, so the numbers cover
+    the whole gunicorn deployment rather than whichever worker answered.
+    Clear the directory when the server (re)starts, as counters of exited
+    workers are kept.
+    Requests slower than SLOW_REQUEST_SECONDS are logged with their SQL.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.slow_request_seconds = 1.0
+        self.flush_interval = 1.0
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._logger = logging.getLogger('slow_requests')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('METRICS_DIR')
+        self.slow_request_seconds = float(app.config.get('SLOW_REQUEST_SECONDS', self.slow_request_seconds))
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        with app.app_context():
+            for engine in db.engines.values():
+                self.instrument_engine(engine)
+        app.extensions['metrics'] = self
+
+    def instrument_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def register_collector(self, collector):
+        """Add a callable returning (name, type, help, labels, value) samples."""
+        self._collectors.append(collector)
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        # Background writers run outside any request.
+        if not has_request_context() or 'sql_count' not in g:
+            return
+        g.sql_count += 1
+        g.sql_seconds += elapsed
+        if len(g.sql_statements) < MAX_CAPTURED_STATEMENTS:
+            g.sql_statements.append((elapsed, statement))
+
+    def _after_request(self, response):
+        if 'metrics_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = {'route': route, 'method': request.method}
+
+        with self._lock:
+            self._counters[('http_requests_total', _labels_key({**labels, 'status': response.status_code}))] += 1
+            self._observe('http_request_duration_seconds', labels, elapsed)
+            self._observe('http_request_sql_statements', labels, g.sql_count)
+            self._observe('http_request_sql_duration_seconds', labels, g.sql_seconds)
+            # Streamed bodies have no length until they have been sent.
+            if response.content_length is not None:
+                self._observe('http_response_size_bytes', labels, response.content_length)
+
+        if elapsed >= self.slow_request_seconds:
+            self._logger.warning(
+                "Slow request %s %s took %.3fs with %d SQL statements (%.3fs):\n%s",
+                request.method, request.full_path, elapsed, g.sql_count, g.sql_seconds,
+                '\n'.join(f'  [{seconds * 1000:.1f} ms] {statement}' for seconds, statement in g.sql_statements),
+            )
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return response
+
+    def _observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, _labels_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = {'counts': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram['counts'][index] += 1
+                break
+        else:
+            histogram['counts'][-1] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                'pid': os.getpid(),
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), dict(data, counts=list(data['counts']))]
+                               for (name, labels), data in self._histograms.items()],
+            }
+        samples = []
+        for collector in self._collectors:
+            try:
+                samples.extend(collector())
+            except Exception:
+                logging.exception("Metrics collector failed")
+        snapshot['samples'] = [[name, kind, help_text, sorted(labels.items()), value]
+                               for name, kind, help_text, labels, value in samples]
+        return snapshot
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(self.snapshot(), handle)
+        os.replace(path + '.tmp', path)
+
+    def _snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as handle:
+                    snapshots.append(json.load(handle))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        counters = defaultdict(float)
+        histograms = {}
+        samples = {}
+        for snapshot in self._snapshots():
+            alive = _pid_alive(snapshot['pid'])
+            for name, labels, value in snapshot['counters']:
+                counters[(name, tuple(map(tuple, labels)))] += value
+            for name, labels, data in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, {'counts': [0] * len(data['counts']), 'sum': 0.0, 'count': 0})
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], data['counts'])]
+                merged['sum'] += data['sum']
+                merged['count'] += data['count']
+            for name, kind, help_text, labels, value in snapshot['samples']:
+                # Gauges describe live processes only; counters keep what
+                # exited workers contributed so totals never go backwards.
+                if kind == 'gauge' and not alive:
+                    continue
+                key = (name, tuple(map(tuple, labels)))
+                entry = samples.setdefault(key, [kind, help_text, 0])
+                entry[2] += value
+
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (metric, labels), data in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], data['counts']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(data["sum"])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {data["count"]}')
+        described = set()
+        for (name, labels), (kind, help_text, value) in sorted(samples.items()):
+            if name not in described:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                described.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def component_samples():
+    """Samples from the tracking cache, event hub and write-behind queue."""
+    from cache import tracking_cache
+    from events import event_hub
+    from write_behind import write_behind
+
+    cache = tracking_cache.stats()
+    samples = [
+        ('tracking_cache_hits_total', 'counter', 'Tracking cache hits.', {}, cache['hits']),
+        ('tracking_cache_misses_total', 'counter', 'Tracking cache misses.', {}, cache['misses']),
+        ('tracking_cache_evictions_total', 'counter', 'Tracking cache evictions.', {}, cache['evictions']),
+    ]
+    if cache['backend'] == 'LRUCache':
+        # A shared backend reports the same entries from every worker.
+        samples.append(('tracking_cache_entries', 'gauge', 'Entries in the tracking cache.', {}, cache['entries']))
+    samples.append(('sse_subscribers', 'gauge', 'Open tracking event streams.', {}, event_hub.subscriber_count()))
+    samples.append(('sse_thread_streams', 'gauge', 'Event streams holding a worker thread.', {},
+                    event_hub.stream_count()))
+    if write_behind.enabled and write_behind.slot:
+        queue = write_behind.stats()
+        samples += [
+            ('write_behind_queue_depth', 'gauge', 'Events waiting for group commit.', {}, queue['queue_depth']),
+            ('write_behind_events_committed_total', 'counter', 'Events written by group commits.', {}, queue['committed']),
+            ('write_behind_events_rejected_total', 'counter', 'Events dropped at commit time.', {}, queue['rejected']),
+            ('write_behind_commits_total', 'counter', 'Group commits.', {}, queue['commits']),
+            ('write_behind_commit_failures_total', 'counter', 'Failed group commits.', {}, queue['commit_failures']),
+            ('write_behind_events_dead_lettered_total', 'counter', 'Events the database refused, set aside.', {},
+             queue['dead_lettered']),
+        ]
+        samples += [
+            ('write_behind_commit_batches_total', 'counter', 'Group commits by batch size bucket.',
+             {'le': bucket}, count)
+            for bucket, count in queue['batch_sizes'].items()
+        ]
+    return samples
+
+
+metrics = Metrics()
@@ -45,6 +45,20 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# Tables maintained by raw SQL rather than models; autogenerate must not
+# offer to drop them. parcel_search is the search index (search.py), with
+# its FTS5 shadow tables on SQLite; tracking_update_orphan holds the
+# updates set aside by migration 3f9a1c2e7b4d.
+UNMANAGED_TABLES = {'parcel_search', 'tracking_update_orphan'}
+UNMANAGED_PREFIXES = ('parcel_search_',)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and reflected and compare_to is None:
+        return name not in UNMANAGED_TABLES and not name.startswith(UNMANAGED_PREFIXES)
+    return True
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -65,7 +79,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +108,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
@@ -0,0 +1,76 @@
+"""Integer tracking_update.parcel_id and hot-path indexes
+
+Revision ID: 3f9a1c2e7b4d
+Revises: c76f2810b6fa
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2e7b4d'
+down_revision = 'c76f2810b6fa'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'id, parcel_id, timestamp, status, location, description'
+ORPHANED = 'parcel_id NOT IN (SELECT CAST(id AS VARCHAR(12)) FROM parcel)'
+
+
+def upgrade():
+    # add_demo_parcels.py used to store the tracking number in parcel_id;
+    # point those rows at the parcel they were meant for.
+    op.execute(
+        "UPDATE tracking_update SET parcel_id = ("
+        "SELECT CAST(parcel.id AS VARCHAR(12)) FROM parcel "
+        "WHERE parcel.tracking_number = tracking_update.parcel_id) "
+        "WHERE parcel_id IN (SELECT tracking_number FROM parcel)"
+    )
+    # Whatever still matches no parcel id cannot be cast and is unreachable
+    # through the API. Keep it, as it was, in tracking_update_orphan and
+    # take it out of the way of the conversion.
+    op.create_table('tracking_update_orphan',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('parcel_id', sa.String(length=12), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('location', sa.String(length=100), nullable=True),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        f"INSERT INTO tracking_update_orphan ({COLUMNS}) SELECT {COLUMNS} FROM tracking_update "
+        f"WHERE {ORPHANED}"
+    )
+    op.execute(f"DELETE FROM tracking_update WHERE {ORPHANED}")
+
+    with op.batch_alter_table('tracking_update', schema=None) as batch_op:
+        batch_op.alter_column('parcel_id',
+               existing_type=sa.String(length=12),
+               type_=sa.Integer(),
+               existing_nullable=False,
+               postgresql_using='parcel_id::integer')
+        batch_op.create_index('ix_tracking_update_parcel_id_timestamp', ['parcel_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('parcel', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_parcel_courier_id'), ['courier_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_parcel_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('parcel', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_parcel_status'))
+        batch_op.drop_index(batch_op.f('ix_parcel_courier_id'))
+
+    with op.batch_alter_table('tracking_update', schema=None) as batch_op:
+        batch_op.drop_index('ix_tracking_update_parcel_id_timestamp')
+        batch_op.alter_column('parcel_id',
+               existing_type=sa.Integer(),
+               type_=sa.String(length=12),
+               existing_nullable=False,
+               postgresql_using='parcel_id::varchar(12)')
+
+    op.execute(f"INSERT INTO tracking_update ({COLUMNS}) SELECT {COLUMNS} FROM tracking_update_orphan")
+    op.drop_table('tracking_update_orphan')
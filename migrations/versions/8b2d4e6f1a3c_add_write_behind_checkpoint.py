@@ -0,0 +1,28 @@
+"""Add write_behind_checkpoint
+
+Revision ID: 8b2d4e6f1a3c
+Revises: 3f9a1c2e7b4d
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2d4e6f1a3c'
+down_revision = '3f9a1c2e7b4d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('write_behind_checkpoint',
+    sa.Column('slot', sa.String(length=50), nullable=False),
+    sa.Column('sequence', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('slot')
+    )
+
+
+def downgrade():
+    op.drop_table('write_behind_checkpoint')
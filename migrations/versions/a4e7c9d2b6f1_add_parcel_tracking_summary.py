@@ -0,0 +1,31 @@
+"""Add parcel tracking summary columns
+
+Revision ID: a4e7c9d2b6f1
+Revises: 8b2d4e6f1a3c
+Create Date: 2026-10-18 14:00:00.000000
+
+Existing parcels are summarised by ``flask backfill-parcel-summaries``.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e7c9d2b6f1'
+down_revision = '8b2d4e6f1a3c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('parcel', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_update_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_location', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('status_counts', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('parcel', schema=None) as batch_op:
+        batch_op.drop_column('status_counts')
+        batch_op.drop_column('last_location')
+        batch_op.drop_column('last_update_at')
@@ -0,0 +1,49 @@
+"""Add api_key and webhook_subscriber.merchant_id
+
+Revision ID: b1f6d3a8e4c7
+Revises: a4e7c2d9f1b5
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1f6d3a8e4c7'
+down_revision = 'a4e7c2d9f1b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('api_key',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('customer_id', sa.Integer(), nullable=False),
+    sa.Column('key_hash', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['customer_id'], ['customer.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key_hash')
+    )
+    with op.batch_alter_table('api_key', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_api_key_customer_id'), ['customer_id'], unique=False)
+
+    # Existing subscriptions were made without a credential; they stay
+    # admin subscriptions, receiving every parcel's events.
+    with op.batch_alter_table('webhook_subscriber', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('merchant_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_webhook_subscriber_merchant_id'), ['merchant_id'], unique=False)
+        batch_op.create_foreign_key('fk_webhook_subscriber_merchant_id', 'customer', ['merchant_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('webhook_subscriber', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_webhook_subscriber_merchant_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_webhook_subscriber_merchant_id'))
+        batch_op.drop_column('merchant_id')
+
+    with op.batch_alter_table('api_key', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_api_key_customer_id'))
+
+    op.drop_table('api_key')
@@ -0,0 +1,38 @@
+"""Add parcel.merchant_id
+
+Revision ID: c3e8a5f2d7b9
+Revises: b1f6d3a8e4c7
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8a5f2d7b9'
+down_revision = 'b1f6d3a8e4c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        # A plain ALTER: a batch migration would recreate parcel and drop
+        # its search triggers.
+        op.execute('ALTER TABLE parcel ADD COLUMN merchant_id INTEGER REFERENCES customer (id)')
+    else:
+        op.add_column('parcel', sa.Column('merchant_id', sa.Integer(), nullable=True))
+        op.create_foreign_key('fk_parcel_merchant_id', 'parcel', 'customer', ['merchant_id'], ['id'])
+    op.create_index(op.f('ix_parcel_merchant_id'), 'parcel', ['merchant_id'], unique=False)
+    op.add_column('parcel_archive', sa.Column('merchant_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('parcel_archive', 'merchant_id')
+    op.drop_index(op.f('ix_parcel_merchant_id'), table_name='parcel')
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('ALTER TABLE parcel DROP COLUMN merchant_id')
+    else:
+        op.drop_constraint('fk_parcel_merchant_id', 'parcel', type_='foreignkey')
+        op.drop_column('parcel', 'merchant_id')
@@ -0,0 +1,34 @@
+"""Add delivery_rollup
+
+Revision ID: c9a3f6e1d2b8
+Revises: b7e2d5c8a1f4
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9a3f6e1d2b8'
+down_revision = 'b7e2d5c8a1f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('delivery_rollup',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('courier_id', sa.String(length=10), nullable=False),
+    sa.Column('service_type', sa.String(length=20), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('parcels', sa.Integer(), nullable=False),
+    sa.Column('weight_sum', sa.Float(), nullable=False),
+    sa.Column('on_time', sa.Integer(), nullable=False),
+    sa.Column('late', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'courier_id', 'service_type', 'status')
+    )
+
+
+def downgrade():
+    op.drop_table('delivery_rollup')
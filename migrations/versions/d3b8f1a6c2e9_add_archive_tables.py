@@ -0,0 +1,59 @@
+"""Add parcel_archive and tracking_update_archive
+
+Revision ID: d3b8f1a6c2e9
+Revises: a4e7c9d2b6f1
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b8f1a6c2e9'
+down_revision = 'a4e7c9d2b6f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('parcel_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tracking_number', sa.String(length=12), nullable=False),
+    sa.Column('sender_id', sa.Integer(), nullable=False),
+    sa.Column('recipient_id', sa.Integer(), nullable=False),
+    sa.Column('courier_id', sa.String(length=10), nullable=True),
+    sa.Column('weight', sa.Float(), nullable=False),
+    sa.Column('length', sa.Float(), nullable=True),
+    sa.Column('width', sa.Float(), nullable=True),
+    sa.Column('height', sa.Float(), nullable=True),
+    sa.Column('service_type', sa.String(length=20), nullable=True),
+    sa.Column('estimated_delivery', sa.DateTime(), nullable=True),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('last_update_at', sa.DateTime(), nullable=True),
+    sa.Column('last_location', sa.String(length=100), nullable=True),
+    sa.Column('status_counts', sa.JSON(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tracking_number')
+    )
+    op.create_table('tracking_update_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('parcel_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('location', sa.String(length=100), nullable=True),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tracking_update_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_tracking_update_archive_parcel_id_timestamp', ['parcel_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tracking_update_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_tracking_update_archive_parcel_id_timestamp')
+
+    op.drop_table('tracking_update_archive')
+    op.drop_table('parcel_archive')
@@ -0,0 +1,32 @@
+"""Give parcel_archive and tracking_update_archive ids of their own
+
+Revision ID: d7a2c6e9f3b1
+Revises: c3e8a5f2d7b9
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a2c6e9f3b1'
+down_revision = 'c3e8a5f2d7b9'
+branch_labels = None
+depends_on = None
+
+TABLES = ('parcel_archive', 'tracking_update_archive')
+
+
+def upgrade():
+    # Archived rows used to keep their hot table ids, so on PostgreSQL the
+    # id sequences never moved; start them after the rows already there.
+    # SQLite picks max(id) + 1 by itself.
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in TABLES:
+            op.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                       f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)")
+
+
+def downgrade():
+    pass
@@ -0,0 +1,151 @@
+"""Add parcel_search index
+
+Revision ID: e5d1b9c3a7f2
+Revises: c9a3f6e1d2b8
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5d1b9c3a7f2'
+down_revision = 'c9a3f6e1d2b8'
+branch_labels = None
+depends_on = None
+
+SQLITE_CUSTOMER = "trim(coalesce({0}.name, '') || ' ' || coalesce({0}.email, '') || ' ' || coalesce({0}.phone, ''))"
+POSTGRES_CUSTOMER = "concat_ws(' ', {0}.name, {0}.email, {0}.phone)"
+SOURCES = (('parcel', 0), ('parcel_archive', 1))
+
+
+def _lookup(customer, column):
+    return f"coalesce((SELECT {customer.format('c')} FROM customer AS c WHERE c.id = {column}), '')"
+
+
+def _sqlite_upgrade():
+    op.execute(
+        "CREATE VIRTUAL TABLE parcel_search USING fts5("
+        "tracking_number, sender, recipient, description, "
+        "tokenize = 'unicode61', prefix = '2 3')"
+    )
+    for source, archived in SOURCES:
+        upsert = (
+            f"DELETE FROM parcel_search WHERE rowid = new.id * 2 + {archived}; "
+            "INSERT INTO parcel_search (rowid, tracking_number, sender, recipient, description) "
+            f"VALUES (new.id * 2 + {archived}, new.tracking_number, {_lookup(SQLITE_CUSTOMER, 'new.sender_id')}, "
+            f"{_lookup(SQLITE_CUSTOMER, 'new.recipient_id')}, coalesce(new.description, ''));"
+        )
+        op.execute(f"CREATE TRIGGER {source}_search_insert AFTER INSERT ON {source} BEGIN {upsert} END")
+        op.execute(
+            f"CREATE TRIGGER {source}_search_update AFTER UPDATE OF tracking_number, sender_id, recipient_id, "
+            f"description ON {source} BEGIN {upsert} END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {source}_search_delete AFTER DELETE ON {source} BEGIN "
+            f"DELETE FROM parcel_search WHERE rowid = old.id * 2 + {archived}; END"
+        )
+    customer = SQLITE_CUSTOMER.format('new')
+    op.execute(
+        "CREATE TRIGGER customer_search_update AFTER UPDATE OF name, email, phone ON customer BEGIN "
+        f"UPDATE parcel_search SET sender = {customer} WHERE rowid IN ("
+        "SELECT id * 2 FROM parcel WHERE sender_id = new.id "
+        "UNION ALL SELECT id * 2 + 1 FROM parcel_archive WHERE sender_id = new.id); "
+        f"UPDATE parcel_search SET recipient = {customer} WHERE rowid IN ("
+        "SELECT id * 2 FROM parcel WHERE recipient_id = new.id "
+        "UNION ALL SELECT id * 2 + 1 FROM parcel_archive WHERE recipient_id = new.id); END"
+    )
+    for source, archived in SOURCES:
+        op.execute(
+            "INSERT INTO parcel_search (rowid, tracking_number, sender, recipient, description) "
+            f"SELECT p.id * 2 + {archived}, p.tracking_number, coalesce({SQLITE_CUSTOMER.format('s')}, ''), "
+            f"coalesce({SQLITE_CUSTOMER.format('r')}, ''), coalesce(p.description, '') FROM {source} AS p "
+            "LEFT JOIN customer AS s ON s.id = p.sender_id LEFT JOIN customer AS r ON r.id = p.recipient_id"
+        )
+
+
+def _postgresql_upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "CREATE TABLE parcel_search ("
+        "parcel_id INTEGER NOT NULL, archived BOOLEAN NOT NULL, tracking_number VARCHAR(12) NOT NULL, "
+        "sender TEXT NOT NULL, recipient TEXT NOT NULL, description TEXT NOT NULL, "
+        "document TEXT GENERATED ALWAYS AS "
+        "(tracking_number || ' ' || sender || ' ' || recipient || ' ' || description) STORED, "
+        "PRIMARY KEY (parcel_id, archived))"
+    )
+    op.execute("CREATE INDEX ix_parcel_search_document ON parcel_search USING gin (document gin_trgm_ops)")
+    op.execute("CREATE INDEX ix_parcel_search_tracking_number ON parcel_search (tracking_number text_pattern_ops)")
+    op.execute(
+        "CREATE OR REPLACE FUNCTION parcel_search_sync() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+        "DECLARE is_archived BOOLEAN := TG_TABLE_NAME = 'parcel_archive';\n"
+        "BEGIN\n"
+        "  IF TG_OP = 'DELETE' THEN\n"
+        "    DELETE FROM parcel_search WHERE parcel_id = OLD.id AND archived = is_archived;\n"
+        "    RETURN OLD;\n"
+        "  END IF;\n"
+        "  INSERT INTO parcel_search (parcel_id, archived, tracking_number, sender, recipient, description)\n"
+        f"  VALUES (NEW.id, is_archived, NEW.tracking_number, {_lookup(POSTGRES_CUSTOMER, 'NEW.sender_id')},\n"
+        f"          {_lookup(POSTGRES_CUSTOMER, 'NEW.recipient_id')}, coalesce(NEW.description, ''))\n"
+        "  ON CONFLICT (parcel_id, archived) DO UPDATE SET\n"
+        "    tracking_number = EXCLUDED.tracking_number, sender = EXCLUDED.sender,\n"
+        "    recipient = EXCLUDED.recipient, description = EXCLUDED.description;\n"
+        "  RETURN NEW;\n"
+        "END $$"
+    )
+    customer = POSTGRES_CUSTOMER.format('NEW')
+    op.execute(
+        "CREATE OR REPLACE FUNCTION customer_search_sync() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+        "BEGIN\n"
+        f"  UPDATE parcel_search SET sender = {customer} WHERE (parcel_id, archived) IN (\n"
+        "    SELECT id, false FROM parcel WHERE sender_id = NEW.id\n"
+        "    UNION ALL SELECT id, true FROM parcel_archive WHERE sender_id = NEW.id);\n"
+        f"  UPDATE parcel_search SET recipient = {customer} WHERE (parcel_id, archived) IN (\n"
+        "    SELECT id, false FROM parcel WHERE recipient_id = NEW.id\n"
+        "    UNION ALL SELECT id, true FROM parcel_archive WHERE recipient_id = NEW.id);\n"
+        "  RETURN NEW;\n"
+        "END $$"
+    )
+    for source, _ in SOURCES:
+        op.execute(
+            f"CREATE TRIGGER {source}_search_sync AFTER INSERT OR DELETE OR UPDATE OF tracking_number, "
+            f"sender_id, recipient_id, description ON {source} FOR EACH ROW EXECUTE FUNCTION parcel_search_sync()"
+        )
+    op.execute(
+        "CREATE TRIGGER customer_search_sync AFTER UPDATE OF name, email, phone ON customer "
+        "FOR EACH ROW EXECUTE FUNCTION customer_search_sync()"
+    )
+    for source, archived in SOURCES:
+        op.execute(
+            "INSERT INTO parcel_search (parcel_id, archived, tracking_number, sender, recipient, description) "
+            f"SELECT p.id, {bool(archived)}, p.tracking_number, coalesce({POSTGRES_CUSTOMER.format('s')}, ''), "
+            f"coalesce({POSTGRES_CUSTOMER.format('r')}, ''), coalesce(p.description, '') FROM {source} AS p "
+            "LEFT JOIN customer AS s ON s.id = p.sender_id LEFT JOIN customer AS r ON r.id = p.recipient_id"
+        )
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        _sqlite_upgrade()
+    elif dialect == 'postgresql':
+        _postgresql_upgrade()
+    # Other databases get no search index; /parcels/search reports it.
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for source, _ in SOURCES:
+            for event in ('insert', 'update', 'delete'):
+                op.execute(f'DROP TRIGGER IF EXISTS {source}_search_{event}')
+        op.execute('DROP TRIGGER IF EXISTS customer_search_update')
+        op.execute('DROP TABLE IF EXISTS parcel_search')
+    elif dialect == 'postgresql':
+        for source, _ in SOURCES:
+            op.execute(f'DROP TRIGGER IF EXISTS {source}_search_sync ON {source}')
+        op.execute('DROP TRIGGER IF EXISTS customer_search_sync ON customer')
+        op.execute('DROP FUNCTION IF EXISTS parcel_search_sync()')
+        op.execute('DROP FUNCTION IF EXISTS customer_search_sync()')
+        op.execute('DROP TABLE IF EXISTS parcel_search')
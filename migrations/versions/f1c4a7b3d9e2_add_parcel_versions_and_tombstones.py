@@ -0,0 +1,58 @@
+"""Add parcel versions, counters and parcel tombstones
+
+Revision ID: f1c4a7b3d9e2
+Revises: d3b8f1a6c2e9
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c4a7b3d9e2'
+down_revision = 'd3b8f1a6c2e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('counter',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('parcel_tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('parcel_id', sa.Integer(), nullable=False),
+    sa.Column('tracking_number', sa.String(length=12), nullable=False),
+    sa.Column('courier_id', sa.String(length=10), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('reason', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('parcel_tombstone', schema=None) as batch_op:
+        batch_op.create_index('ix_parcel_tombstone_courier_id_version', ['courier_id', 'version'], unique=False)
+
+    with op.batch_alter_table('parcel', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.create_index('ix_parcel_courier_id_version', ['courier_id', 'version'], unique=False)
+
+    with op.batch_alter_table('parcel_archive', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('parcel_archive', schema=None) as batch_op:
+        batch_op.drop_column('version')
+
+    with op.batch_alter_table('parcel', schema=None) as batch_op:
+        batch_op.drop_index('ix_parcel_courier_id_version')
+        batch_op.drop_column('version')
+
+    with op.batch_alter_table('parcel_tombstone', schema=None) as batch_op:
+        batch_op.drop_index('ix_parcel_tombstone_courier_id_version')
+
+    op.drop_table('parcel_tombstone')
+    op.drop_table('counter')
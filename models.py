@@ -8,6 +8,9 @@ class Customer(db.Model):
     email = db.Column(db.String(120))
     phone = db.Column(db.String(20))
     address = db.Column(db.String(200))
+    # Filled in from the address by geocoding.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
 
     def to_dict(self):
         return {
@@ -37,11 +40,17 @@ class Courier(db.Model):
         }
 
 class Parcel(db.Model):
+    __table_args__ = (
+        db.Index('ix_parcel_courier_id_version', 'courier_id', 'version'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     tracking_number = db.Column(db.String(12), unique=True, nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
     recipient_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
-    courier_id = db.Column(db.String(10), db.ForeignKey('courier.id'))
+    courier_id = db.Column(db.String(10), db.ForeignKey('courier.id'), index=True)
+    # The merchant whose API key created it, if any (see api_keys.py)
+    merchant_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
 
     weight = db.Column(db.Float, nullable=False)
     length = db.Column(db.Float)
@@ -50,15 +59,25 @@ class Parcel(db.Model):
     service_type = db.Column(db.String(20))
     estimated_delivery = db.Column(db.DateTime)
     description = db.Column(db.String(200))
-    status = db.Column(db.String(50), default="Created")
+    status = db.Column(db.String(50), default="Created", index=True)
+
+    # Summary of tracking_updates, maintained by every write path
+    last_update_at = db.Column(db.DateTime)
+    last_location = db.Column(db.String(100))
+    status_counts = db.Column(db.JSON)
+    # Change version from the 'parcel_version' counter, bumped by every
+    # write that alters the parcel's payload
+    version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
 
     sender = db.relationship('Customer', foreign_keys=[sender_id])
     recipient = db.relationship('Customer', foreign_keys=[recipient_id])
     courier = db.relationship('Courier', backref='parcels')
-    tracking_updates = db.relationship('TrackingUpdate', backref='parcel', lazy=True, cascade='all, delete-orphan')
+    tracking_updates = db.relationship('TrackingUpdate', backref='parcel', lazy=True, cascade='all, delete-orphan',
+                                       order_by='[TrackingUpdate.timestamp, TrackingUpdate.id]')
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None, history='full'):
+        fields = parcel_fields(fields, history)
+        data = {
             'id': self.id,
             'tracking_number': self.tracking_number,
              'status': self.status,
@@ -69,16 +88,54 @@ class Parcel(db.Model):
             'width': self.width,
             'height': self.height,
             'service_type': self.service_type,
-            'sender': self.sender.to_dict(),
-            'recipient': self.recipient.to_dict(),
-            'courier_id': self.courier.id if self.courier else None,
-            'courier_name': self.courier.name if self.courier else None,
-            'tracking_history': [update.to_dict() for update in self.tracking_updates]
+            'last_update_at': self.last_update_at.isoformat() if self.last_update_at else None,
+            'last_location': self.last_location,
+            'status_counts': self.status_counts or {},
         }
+        # Relationships are only loaded when their keys are requested.
+        if 'sender' in fields:
+            data['sender'] = self.sender.to_dict()
+        if 'recipient' in fields:
+            data['recipient'] = self.recipient.to_dict()
+        if 'courier_id' in fields or 'courier_name' in fields:
+            data['courier_id'] = self.courier.id if self.courier else None
+            data['courier_name'] = self.courier.name if self.courier else None
+        if 'tracking_history' in fields:
+            updates = self.tracking_updates
+            data['tracking_history'] = [update.to_dict() for update in (updates[-1:] if history == 'latest' else updates)]
+        return {key: value for key, value in data.items() if key in fields}
+
+PARCEL_FIELDS = (
+    'id', 'tracking_number', 'status', 'estimated_delivery', 'description', 'weight', 'length',
+    'width', 'height', 'service_type', 'last_update_at', 'last_location', 'status_counts',
+    'sender', 'recipient', 'courier_id', 'courier_name', 'tracking_history',
+)
+HISTORY_MODES = ('none', 'latest', 'full')
+
+def parcel_fields(fields=None, history='full'):
+    """The top-level Parcel.to_dict keys to include.
+
+    ``fields`` is an iterable of key names (all of them when None) and
+    ``history`` is 'full', 'latest' (only the most recent update) or 'none'
+    (no tracking_history key). Raises ValueError for unknown names.
+    """
+    if history not in HISTORY_MODES:
+        raise ValueError(f"history must be one of {', '.join(HISTORY_MODES)}")
+    selected = frozenset(PARCEL_FIELDS if fields is None else fields)
+    unknown = selected - set(PARCEL_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if history == 'none':
+        selected -= {'tracking_history'}
+    return selected
 
 class TrackingUpdate(db.Model):
+    __table_args__ = (
+        db.Index('ix_tracking_update_parcel_id_timestamp', 'parcel_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    parcel_id = db.Column(db.String(12), db.ForeignKey('parcel.id'), nullable=False)
+    parcel_id = db.Column(db.Integer, db.ForeignKey('parcel.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(50))
     location = db.Column(db.String(100))
@@ -90,4 +147,127 @@ class TrackingUpdate(db.Model):
             'status': self.status,
             'location': self.location,
             'description': self.description
-        }
\ No newline at end of file
+        }
+class WriteBehindCheckpoint(db.Model):
+    # Highest journal sequence a write-behind slot has committed; written in
+    # the same transaction as the tracking updates it covers.
+    slot = db.Column(db.String(50), primary_key=True)
+    sequence = db.Column(db.BigInteger, nullable=False, default=0)
+
+class Counter(db.Model):
+    # Named monotonic counters; see counters.next_value().
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ParcelTombstone(db.Model):
+    # A parcel that left a courier's list (reassigned or archived), so
+    # delta syncs can tell the courier's clients to drop it.
+    __table_args__ = (
+        db.Index('ix_parcel_tombstone_courier_id_version', 'courier_id', 'version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    parcel_id = db.Column(db.Integer, nullable=False)
+    tracking_number = db.Column(db.String(12), nullable=False)
+    courier_id = db.Column(db.String(10), nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ParcelArchive(db.Model):
+    # Delivered parcels moved out of the hot table by archive.py; same
+    # columns as Parcel, without foreign keys. Ids are the archive's own,
+    # and tracking_update_archive.parcel_id refers to them.
+    __tablename__ = 'parcel_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tracking_number = db.Column(db.String(12), unique=True, nullable=False)
+    sender_id = db.Column(db.Integer, nullable=False)
+    recipient_id = db.Column(db.Integer, nullable=False)
+    courier_id = db.Column(db.String(10))
+    merchant_id = db.Column(db.Integer)
+    weight = db.Column(db.Float, nullable=False)
+    length = db.Column(db.Float)
+    width = db.Column(db.Float)
+    height = db.Column(db.Float)
+    service_type = db.Column(db.String(20))
+    estimated_delivery = db.Column(db.DateTime)
+    description = db.Column(db.String(200))
+    status = db.Column(db.String(50))
+    last_update_at = db.Column(db.DateTime)
+    last_location = db.Column(db.String(100))
+    status_counts = db.Column(db.JSON)
+    version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+class TrackingUpdateArchive(db.Model):
+    __tablename__ = 'tracking_update_archive'
+    __table_args__ = (
+        db.Index('ix_tracking_update_archive_parcel_id_timestamp', 'parcel_id', 'timestamp'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    parcel_id = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime)
+    status = db.Column(db.String(50))
+    location = db.Column(db.String(100))
+    description = db.Column(db.String(200))
+
+class DeliveryRollup(db.Model):
+    # Parcels by the day of their latest tracking update, courier, service
+    # type and current status; maintained by rollups.py. Unassigned
+    # couriers and missing service types are stored as ''.
+    __tablename__ = 'delivery_rollup'
+
+    day = db.Column(db.Date, primary_key=True)
+    courier_id = db.Column(db.String(10), primary_key=True)
+    service_type = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    parcels = db.Column(db.Integer, nullable=False, default=0)
+    weight_sum = db.Column(db.Float, nullable=False, default=0.0)
+    on_time = db.Column(db.Integer, nullable=False, default=0)
+    late = db.Column(db.Integer, nullable=False, default=0)
+
+class OutboxEvent(db.Model):
+    # Tracking events waiting for webhook delivery, written in the same
+    # transaction as the change; ids come from the 'outbox_event' counter,
+    # so they become visible in id order. See outbox.py.
+    __tablename__ = 'outbox_event'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    tracking_number = db.Column(db.String(12), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class WebhookSubscriber(db.Model):
+    # An endpoint receiving outbox events in batches; ``cursor`` is the id
+    # of the last event it acknowledged.
+    __tablename__ = 'webhook_subscriber'
+
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), nullable=False)
+    secret = db.Column(db.String(64), nullable=False)
+    # Comma-separated event types, or all of them when empty
+    event_types = db.Column(db.String(200))
+    # The merchant whose parcels it receives; an admin subscription, with
+    # none, receives every parcel's events.
+    merchant_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
+    cursor = db.Column(db.BigInteger, nullable=False, default=0)
+    delivered = db.Column(db.BigInteger, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(200))
+    last_delivered_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ApiKey(db.Model):
+    # A merchant's key to the merchant API (/webhooks), issued by
+    # `flask issue-api-key`; only its SHA-256 is stored.
+    __tablename__ = 'api_key'
+
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False, index=True)
+    key_hash = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,481 @@
+# outbox.py
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import logging
+import random
+import secrets
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select, update
+
+from models import db, OutboxEvent, Parcel, ParcelArchive, WebhookSubscriber
+from counters import current_value, next_value
+
+# Merchants subscribe a URL to tracking events instead of polling
+# /parcels/track. Every write path that adds tracking updates stages one
+# outbox_event row per update in its own transaction (record_events()), so
+# an event exists exactly when its update was committed. Event ids come
+# from the 'outbox_event' counter, which hands them out in commit order: a
+# subscriber's cursor, the last id it acknowledged, never skips an event
+# that committed late.
+#
+# `flask deliver-webhooks` runs the delivery worker. Each round it POSTs
+# every due subscriber the events after its cursor, up to
+# OUTBOX_BATCH_SIZE at a time and signed with the subscriber's secret, and
+# moves the cursor on a 2xx answer. Failures are retried with exponential
+# backoff, so delivery is at least once and in order per subscriber;
+# receivers dedupe by event id. Run one worker per database.
+#
+# A merchant's subscriber only receives the events of the parcels created
+# with its API key.
+# Subscriber URLs must be http(s) on public addresses, checked when they
+# subscribe and again whenever the worker connects, to the address it
+# checked, so a webhook cannot reach the internal network
+# (WEBHOOK_ALLOW_PRIVATE_URLS lifts that for local receivers).
+
+OUTBOX_SEQUENCE = 'outbox_event'
+EVENT_TYPES = ('parcel.created', 'parcel.tracking_update')
+PRUNE_INTERVAL = 60.0
+PRUNE_BATCH = 10000
+MAX_ERROR_LENGTH = 200
+USER_AGENT = 'parcel-delivery-webhooks/1'
+
+logger = logging.getLogger(__name__)
+
+
+def record_events(events, event_type='parcel.tracking_update'):
+    """Stage an outbox event for each tracking event, in the caller's transaction.
+
+    Call it after the transaction's PARCEL_VERSION bump, so every writer
+    takes the counter rows in the same order.
+    """
+    if not events:
+        return
+    first = next_value(OUTBOX_SEQUENCE, len(events)) - len(events) + 1
+    now = datetime.utcnow()
+    db.session.execute(insert(OutboxEvent), [
+        {'id': first + index, 'event_type': event_type, 'tracking_number': event['tracking_number'],
+         'payload': dict(event), 'created_at': now}
+        for index, event in enumerate(events)
+    ])
+    # The outbox id is also the event's id on the SSE streams.
+    for index, event in enumerate(events):
+        event['sequence'] = first + index
+
+
+def event_envelope(row):
+    return {'id': row.id, 'type': row.event_type, 'created_at': row.created_at.isoformat(), 'data': row.payload}
+
+
+def check_url(url, allow_private=False):
+    """Addresses a webhook URL resolves to; raises ValueError unless it is http(s) on public addresses."""
+    parts = urlsplit(url) if isinstance(url, str) else None
+    if parts is None or parts.scheme not in ('http', 'https') or not parts.hostname or len(url) > 500:
+        raise ValueError('url must be an http or https URL')
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        raise ValueError('url has an invalid port')
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)]
+    except OSError:
+        raise ValueError(f'url host {parts.hostname} does not resolve')
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not allow_private and (not ip.is_global or ip.is_multicast):
+            raise ValueError(f'url must not point at a private, loopback or link-local address ({ip})')
+    return addresses
+
+
+def subscriber_options(data, allow_private=False):
+    """url, secret and event_types for a new subscriber from a request body; raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    url = data.get('url')
+    check_url(url, allow_private)
+    event_types = data.get('event_types') or []
+    if not isinstance(event_types, list) or set(event_types) - set(EVENT_TYPES):
+        raise ValueError(f"event_types must be a list of {', '.join(EVENT_TYPES)}")
+    secret = data.get('secret') or secrets.token_hex(32)
+    if not isinstance(secret, str) or not 16 <= len(secret) <= 64:
+        raise ValueError('secret must be 16 to 64 characters')
+    return {'url': url, 'secret': secret, 'event_types': ','.join(sorted(set(event_types))) or None}
+
+
+def create_subscriber(url, secret, event_types=None, merchant_id=None):
+    """Subscribe ``url`` to the events committed from now on, of ``merchant_id``'s parcels or of all."""
+    subscriber = WebhookSubscriber(url=url, secret=secret, event_types=event_types, merchant_id=merchant_id,
+                                   cursor=current_value(OUTBOX_SEQUENCE), delivered=0, failures=0)
+    db.session.add(subscriber)
+    db.session.commit()
+    return subscriber
+
+
+def pending_since(cursor):
+    """created_at of the first event after ``cursor``, or None when there is none."""
+    return db.session.scalar(
+        select(OutboxEvent.created_at).where(OutboxEvent.id > cursor).order_by(OutboxEvent.id).limit(1))
+
+
+def _lag_seconds(cursor, now):
+    oldest = pending_since(cursor)
+    return round((now - oldest).total_seconds(), 3) if oldest is not None else 0.0
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def subscriber_dict(subscriber, head, include_secret=False):
+    data = {
+        'id': subscriber.id,
+        'url': subscriber.url,
+        'event_types': subscriber.event_types.split(',') if subscriber.event_types else list(EVENT_TYPES),
+        'merchant_id': subscriber.merchant_id,
+        'cursor': subscriber.cursor,
+        'lag_events': max(0, head - subscriber.cursor),
+        'lag_seconds': _lag_seconds(subscriber.cursor, datetime.utcnow()),
+        'delivered': subscriber.delivered,
+        'failures': subscriber.failures,
+        'next_attempt_at': _isoformat(subscriber.next_attempt_at),
+        'last_error': subscriber.last_error,
+        'last_delivered_at': _isoformat(subscriber.last_delivered_at),
+        'created_at': _isoformat(subscriber.created_at),
+    }
+    if include_secret:
+        data['secret'] = subscriber.secret
+    return data
+
+
+def subscriber_dicts(merchant_id=None):
+    """Every subscriber, or only ``merchant_id``'s."""
+    head = current_value(OUTBOX_SEQUENCE)
+    statement = select(WebhookSubscriber).order_by(WebhookSubscriber.id)
+    if merchant_id is not None:
+        statement = statement.where(WebhookSubscriber.merchant_id == merchant_id)
+    subscribers = db.session.scalars(statement)
+    return [subscriber_dict(subscriber, head) for subscriber in subscribers]
+
+
+def _new_totals():
+    return {'events_delivered': 0, 'deliveries': 0, 'failed_deliveries': 0}
+
+
+class WebhookDelivery:
+    """The delivery worker behind `flask deliver-webhooks`.
+
+    Subscribers sharing a cursor, as healthy ones mostly do, share one
+    outbox read per round. POSTs go out from OUTBOX_DELIVERY_THREADS
+    threads over one kept-alive connection per subscriber; the database is
+    only touched from the calling thread.
+    """
+
+    def __init__(self, app=None):
+        self.batch_size = 100
+        self.poll_interval = 0.5
+        self.threads = 8
+        self.timeout = 10.0
+        self.backoff_base = 1.0
+        self.backoff_max = 300.0
+        self.retention = timedelta(hours=24)
+        self.allow_private = False
+        self.head = 0
+        self.rounds = 0
+        self.totals = {}
+        self.lag = {}
+        self._connections = {}
+        self._pool = None
+        self._last_prune = 0.0
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.batch_size = int(config.get('OUTBOX_BATCH_SIZE', self.batch_size))
+        self.poll_interval = float(config.get('OUTBOX_POLL_INTERVAL', self.poll_interval))
+        self.threads = int(config.get('OUTBOX_DELIVERY_THREADS', self.threads))
+        self.timeout = float(config.get('OUTBOX_TIMEOUT', self.timeout))
+        self.backoff_base = float(config.get('OUTBOX_BACKOFF_BASE', self.backoff_base))
+        self.backoff_max = float(config.get('OUTBOX_BACKOFF_MAX', self.backoff_max))
+        self.retention = timedelta(hours=float(config.get('OUTBOX_RETENTION_HOURS', 24)))
+        self.allow_private = bool(config.get('WEBHOOK_ALLOW_PRIVATE_URLS', self.allow_private))
+        app.extensions['webhook_delivery'] = self
+
+    def backoff(self, failures, retry_after=None):
+        """Seconds before retrying a subscriber that has failed ``failures`` times in a row."""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** min(failures - 1, 30))
+        # Jitter, so subscribers that failed together do not retry together.
+        delay *= random.uniform(0.5, 1.0)
+        return min(self.backoff_max, max(delay, retry_after or 0))
+
+    def _batches(self, subscribers):
+        batches = {}
+        for cursor in sorted({subscriber.cursor for subscriber in subscribers}):
+            batches[cursor] = db.session.execute(
+                select(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.tracking_number, OutboxEvent.payload,
+                       OutboxEvent.created_at)
+                .where(OutboxEvent.id > cursor)
+                .order_by(OutboxEvent.id)
+                .limit(self.batch_size)
+            ).all()
+        return batches
+
+    def _merchants(self, batches):
+        """Merchant id of each parcel with events in ``batches``."""
+        numbers = {row.tracking_number for rows in batches.values() for row in rows}
+        merchants = {}
+        for model in (Parcel, ParcelArchive):
+            merchants.update(db.session.execute(
+                select(model.tracking_number, model.merchant_id).where(model.tracking_number.in_(numbers))).all())
+        return merchants
+
+    def _jobs(self, subscribers, batches):
+        jobs = []
+        merchants = self._merchants(batches) if any(subscriber.merchant_id for subscriber in subscribers) else {}
+        for subscriber in subscribers:
+            rows = batches[subscriber.cursor]
+            if not rows:
+                continue
+            types = set(subscriber.event_types.split(',')) if subscriber.event_types else None
+            events = [event_envelope(row) for row in rows
+                      if (types is None or row.event_type in types)
+                      and (subscriber.merchant_id is None or merchants.get(row.tracking_number) == subscriber.merchant_id)]
+            job = {'subscriber_id': subscriber.id, 'failures': subscriber.failures,
+                   'last_id': rows[-1].id, 'count': len(events), 'body': None}
+            if events:
+                job.update(url=subscriber.url, secret=subscriber.secret,
+                           delivery_id=f"{subscriber.id}:{events[0]['id']}-{events[-1]['id']}",
+                           body=json.dumps({'subscriber_id': subscriber.id, 'events': events},
+                                           separators=(',', ':')).encode())
+            jobs.append(job)
+        return jobs
+
+    def _connect(self, parts, address):
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(parts.hostname, parts.port, timeout=self.timeout)
+        # Connect to the address that was checked rather than resolving the
+        # name again; Host and TLS still use the name.
+        connection._create_connection = lambda host_port, *args: socket.create_connection(
+            (address, host_port[1]), *args)
+        return connection
+
+    def _post(self, job):
+        """(ok, error, retry_after) of POSTing one batch."""
+        if job['body'] is None:
+            # Nothing the subscriber asked for; just move its cursor on.
+            return True, None, None
+        parts = urlsplit(job['url'])
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        signature = hmac.new(job['secret'].encode(), job['body'], hashlib.sha256).hexdigest()
+        headers = {'Content-Type': 'application/json', 'User-Agent': USER_AGENT,
+                   'X-Webhook-Delivery': job['delivery_id'], 'X-Webhook-Signature': f'sha256={signature}'}
+        key = (job['subscriber_id'], parts.scheme, parts.netloc)
+        while True:
+            connection = self._connections.pop(key, None)
+            reused = connection is not None
+            if connection is None:
+                try:
+                    address = check_url(job['url'], self.allow_private)[0]
+                except ValueError as e:
+                    return False, str(e)[:MAX_ERROR_LENGTH], None
+                connection = self._connect(parts, address)
+            try:
+                connection.request('POST', path, body=job['body'], headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if reused:
+                    # The receiver closed the kept-alive connection; retry on a new one.
+                    continue
+                return False, f'{type(e).__name__}: {e}'[:MAX_ERROR_LENGTH], None
+            if response.will_close:
+                connection.close()
+            else:
+                self._connections[key] = connection
+            if 200 <= response.status < 300:
+                return True, None, None
+            try:
+                retry_after = float(response.getheader('Retry-After') or 0)
+            except ValueError:
+                retry_after = None
+            return False, f'HTTP {response.status}', retry_after
+
+    def tick(self):
+        """One delivery round over the due subscribers; returns the events delivered and cursors moved."""
+        now = datetime.utcnow()
+        subscribers = db.session.scalars(select(WebhookSubscriber).order_by(WebhookSubscriber.id)).all()
+        due = [subscriber for subscriber in subscribers
+               if subscriber.next_attempt_at is None or subscriber.next_attempt_at <= now]
+        jobs = self._jobs(due, self._batches(due))
+        # No transaction stays open while the receivers answer.
+        db.session.commit()
+        results = list(self._pool.map(self._post, jobs)) if self._pool else [self._post(job) for job in jobs]
+
+        now = datetime.utcnow()
+        delivered = moved = 0
+        for job, (ok, error, retry_after) in zip(jobs, results):
+            totals = self.totals.setdefault(job['subscriber_id'], _new_totals())
+            values = {}
+            if ok:
+                values = {'cursor': job['last_id'], 'failures': 0, 'next_attempt_at': None, 'last_error': None,
+                          'delivered': WebhookSubscriber.delivered + job['count']}
+                if job['count']:
+                    values['last_delivered_at'] = now
+                    totals['deliveries'] += 1
+                totals['events_delivered'] += job['count']
+                delivered += job['count']
+                moved += 1
+            else:
+                failures = job['failures'] + 1
+                values = {'failures': failures, 'last_error': error,
+                          'next_attempt_at': now + timedelta(seconds=self.backoff(failures, retry_after))}
+                totals['failed_deliveries'] += 1
+            db.session.execute(update(WebhookSubscriber)
+                               .where(WebhookSubscriber.id == job['subscriber_id']).values(values))
+        db.session.commit()
+        self.rounds += 1
+        self._measure_lag(now)
+        return delivered, moved
+
+    def _measure_lag(self, now):
+        self.head = current_value(OUTBOX_SEQUENCE)
+        cursors = dict(db.session.execute(select(WebhookSubscriber.id, WebhookSubscriber.cursor)).all())
+        seconds = {cursor: _lag_seconds(cursor, now) for cursor in set(cursors.values())}
+        db.session.commit()
+        self.lag = {subscriber_id: {'events': max(0, self.head - cursor), 'seconds': seconds[cursor]}
+                    for subscriber_id, cursor in cursors.items()}
+
+    def prune(self):
+        """Delete events every subscriber has acknowledged and that are older than OUTBOX_RETENTION_HOURS."""
+        floor = db.session.scalar(select(func.min(WebhookSubscriber.cursor)))
+        if floor is None:
+            floor = current_value(OUTBOX_SEQUENCE)
+        cutoff = datetime.utcnow() - self.retention
+        deleted = 0
+        while True:
+            # In batches, so no single delete holds the write lock for long.
+            batch = select(OutboxEvent.id).where(OutboxEvent.id <= floor, OutboxEvent.created_at < cutoff) \
+                .order_by(OutboxEvent.id).limit(PRUNE_BATCH)
+            count = db.session.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(batch))).rowcount
+            db.session.commit()
+            deleted += count
+            if count < PRUNE_BATCH:
+                return deleted
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, once=False, stats_interval=None, log=None):
+        """Deliver until stop() is called, or with ``once`` until a round moves no cursor."""
+        from metrics import metrics
+
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='webhook')
+        last_stats, delivered_since = time.monotonic(), 0
+        last_flush = 0.0
+        try:
+            while not self._stop.is_set():
+                try:
+                    delivered, moved = self.tick()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Webhook delivery round failed')
+                    delivered, moved = 0, 0
+                delivered_since += delivered
+                if time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+                    self._last_prune = time.monotonic()
+                    try:
+                        self.prune()
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception('Outbox pruning failed')
+                # With METRICS_DIR set, /metrics of the web workers reports this process too.
+                if metrics.directory and time.monotonic() - last_flush >= metrics.flush_interval:
+                    last_flush = time.monotonic()
+                    metrics.flush()
+                elapsed = time.monotonic() - last_stats
+                if log and stats_interval and elapsed >= stats_interval:
+                    log(dict(self.stats(), events_per_second=round(delivered_since / elapsed, 1)))
+                    last_stats, delivered_since = time.monotonic(), 0
+                if once and not moved:
+                    break
+                if not moved:
+                    self._stop.wait(self.poll_interval)
+        finally:
+            self._pool.shutdown()
+            self._pool = None
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+
+    def stats(self):
+        return {
+            'head': self.head,
+            'rounds': self.rounds,
+            'subscribers': {
+                subscriber_id: dict(self.totals.get(subscriber_id, _new_totals()),
+                                    lag_events=lag['events'], lag_seconds=lag['seconds'])
+                for subscriber_id, lag in self.lag.items()
+            },
+        }
+
+
+def outbox_samples():
+    """Delivery counters and lag of the webhook worker running in this process."""
+    stats = webhook_delivery.stats()
+    samples = [
+        ('outbox_head_event_id', 'gauge', 'Id of the newest committed outbox event.', {}, stats['head']),
+        ('webhook_delivery_rounds_total', 'counter', 'Webhook delivery rounds.', {}, stats['rounds']),
+    ]
+    for subscriber_id, subscriber in stats['subscribers'].items():
+        labels = {'subscriber': str(subscriber_id)}
+        samples += [
+            ('webhook_events_delivered_total', 'counter', 'Outbox events acknowledged by the subscriber.', labels,
+             subscriber['events_delivered']),
+            ('webhook_deliveries_total', 'counter', 'Webhook POSTs by result.', dict(labels, result='ok'),
+             subscriber['deliveries']),
+            ('webhook_deliveries_total', 'counter', 'Webhook POSTs by result.', dict(labels, result='error'),
+             subscriber['failed_deliveries']),
+            ('webhook_lag_events', 'gauge', 'Outbox events after the subscriber cursor.', labels,
+             subscriber['lag_events']),
+            ('webhook_lag_seconds', 'gauge', 'Age of the oldest event the subscriber has not acknowledged.', labels,
+             subscriber['lag_seconds']),
+        ]
+    return samples
+
+
+@click.command('deliver-webhooks')
+@click.option('--once', is_flag=True, help='Exit when a round delivers nothing instead of polling.')
+@click.option('--stats-interval', default=10.0, show_default=True,
+              help='Seconds between JSON stats lines; 0 for none.')
+@with_appcontext
+def deliver_webhooks_command(once, stats_interval):
+    """Deliver outbox events to the webhook subscribers."""
+    from metrics import metrics
+
+    metrics.register_collector(outbox_samples)
+    signal.signal(signal.SIGTERM, lambda *_: webhook_delivery.stop())
+    log = lambda stats: click.echo(json.dumps(stats))  # noqa: E731
+    try:
+        webhook_delivery.run(once=once, stats_interval=stats_interval, log=log)
+    except KeyboardInterrupt:
+        pass
+    click.echo(json.dumps(webhook_delivery.stats()))
+
+
+webhook_delivery = WebhookDelivery()
@@ -0,0 +1,109 @@
+# parcel_summary.py
+import logging
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, update
+
+from models import db, Parcel, TrackingUpdate
+from rollups import parcel_rollup_entry, record_rollups, ROLLUP_FIELDS
+from counters import next_value, PARCEL_VERSION
+from cache import tracking_cache
+
+# Parcel.last_update_at, last_location and status_counts summarise the
+# parcel's tracking updates so readers need not touch tracking_update.
+# Every write path folds its new updates in within the same transaction,
+# with the parcel row locked (SELECT ... FOR UPDATE where supported).
+
+DEFAULT_BACKFILL_BATCH = 5000
+
+
+def fold_tracking_updates(last_update_at, last_location, status_counts, updates):
+    """The summary columns after adding ``updates`` (status/location/timestamp dicts).
+
+    The latest update wins on timestamp, and on a tie the one added last,
+    which matches the order of Parcel.tracking_updates.
+    """
+    counts = dict(status_counts or {})
+    for update in updates:
+        counts[update['status']] = counts.get(update['status'], 0) + 1
+        if last_update_at is None or update['timestamp'] >= last_update_at:
+            last_update_at = update['timestamp']
+            last_location = update['location']
+    return {'last_update_at': last_update_at, 'last_location': last_location, 'status_counts': counts}
+
+
+def summarise_parcels(parcel_ids):
+    """Summary columns for ``parcel_ids`` recomputed from tracking_update."""
+    summaries = {parcel_id: {'last_update_at': None, 'last_location': None, 'status_counts': {}}
+                 for parcel_id in parcel_ids}
+    counts = db.session.execute(
+        select(TrackingUpdate.parcel_id, TrackingUpdate.status, func.count())
+        .where(TrackingUpdate.parcel_id.in_(parcel_ids))
+        .group_by(TrackingUpdate.parcel_id, TrackingUpdate.status)
+    )
+    for parcel_id, status, count in counts:
+        summaries[parcel_id]['status_counts'][status] = count
+    ranked = (
+        select(TrackingUpdate.parcel_id, TrackingUpdate.timestamp, TrackingUpdate.location,
+               func.row_number().over(
+                   partition_by=TrackingUpdate.parcel_id,
+                   order_by=(TrackingUpdate.timestamp.desc(), TrackingUpdate.id.desc()),
+               ).label('position'))
+        .where(TrackingUpdate.parcel_id.in_(parcel_ids))
+        .subquery()
+    )
+    latest = db.session.execute(
+        select(ranked.c.parcel_id, ranked.c.timestamp, ranked.c.location).where(ranked.c.position == 1)
+    )
+    for parcel_id, timestamp, location in latest:
+        summaries[parcel_id].update(last_update_at=timestamp, last_location=location)
+    return summaries
+
+
+def backfill_summaries(batch_size=DEFAULT_BACKFILL_BATCH, parcel_ids=None):
+    """Recompute the summary of every parcel (or just ``parcel_ids``), committing per batch."""
+    started = time.perf_counter()
+    total = 0
+    after = 0
+    while True:
+        if parcel_ids is None:
+            batch = db.session.scalars(
+                select(Parcel.id).where(Parcel.id > after).order_by(Parcel.id).limit(batch_size)
+            ).all()
+        else:
+            batch = list(parcel_ids[total:total + batch_size])
+        if not batch:
+            break
+        # Lock the batch so updates committed meanwhile are not overwritten.
+        current = db.session.execute(
+            select(Parcel.id, Parcel.tracking_number, *(getattr(Parcel, field) for field in ROLLUP_FIELDS))
+            .where(Parcel.id.in_(batch)).order_by(Parcel.id).with_for_update()
+        ).all()
+        summaries = summarise_parcels(batch)
+        # New versions too, as the summary is part of the parcel's payload.
+        first_version = next_value(PARCEL_VERSION, len(current)) - len(current) + 1
+        db.session.execute(update(Parcel), [{'id': row.id, 'version': first_version + i, **summaries[row.id]}
+                                            for i, row in enumerate(current)])
+        # A new last_update_at can move the parcel to another day's rollup.
+        record_rollups([parcel_rollup_entry(row) for row in current],
+                       [parcel_rollup_entry(row, last_update_at=summaries[row.id]['last_update_at'])
+                        for row in current])
+        db.session.commit()
+        for i, row in enumerate(current):
+            tracking_cache.invalidate(row.tracking_number, first_version + i)
+        total += len(batch)
+        after = batch[-1]
+    elapsed = time.perf_counter() - started
+    logging.info("Backfilled summaries of %d parcels in %.1fs", total, elapsed)
+    return total
+
+
+@click.command('backfill-parcel-summaries')
+@click.option('--batch-size', default=DEFAULT_BACKFILL_BATCH, show_default=True, type=click.IntRange(1, 100000))
+@with_appcontext
+def backfill_summaries_command(batch_size):
+    """Recompute last_update_at, last_location and status_counts from tracking_update."""
+    total = backfill_summaries(batch_size)
+    click.echo(f'Backfilled {total} parcels')
@@ -1,107 +1,356 @@
-from flask import Blueprint, jsonify, request
-from models import db, Parcel, Customer, Courier, TrackingUpdate
+from flask import Blueprint, g, jsonify, request, current_app, stream_with_context
+from models import db, Parcel, Customer, Courier, ParcelTombstone, TrackingUpdate
+from cache import tracking_cache
+from scans import apply_scan_events, publish_status_changes, status_change, MAX_SCAN_BATCH
+from bulk_import import import_parcels, read_rows, CUSTOMER_FIELDS, DEFAULT_CHUNK_SIZE
+from assignment import courier_loads, parcel_volume
+from events import sse_response, tracking_event
+from write_behind import write_behind, QueueFull
+from parcel_summary import fold_tracking_updates
+from counters import next_value, PARCEL_VERSION
+from geocoding import geocoding
+from tracking_numbers import tracking_numbers
+from search import search_options, search_parcels, MAX_OFFSET as MAX_SEARCH_OFFSET
+from rollups import parcel_rollup_entry, record_rollups
+from outbox import record_events
+from api_keys import merchant_optional
+from conditional import make_etag, not_modified, variant, with_etag
+from read_models import (iter_parcel_dicts, parcel_dicts, parcels_statement, payload_options, project_parcel,
+                         read_parcel, read_parcel_version, run_reader, ALL_FIELDS)
 from datetime import datetime, timedelta
+from functools import partial
 import random
-import string
 
 parcels_bp = Blueprint('parcels', __name__)
 
-def generate_tracking_number():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 200
+MAX_IMPORT_CHUNK_SIZE = 10000
+
+def _json_body(payload):
+    return jsonify(payload).get_data(as_text=True)
+
+def _json_response(body, status=200):
+    return current_app.response_class(body, status=status, mimetype='application/json')
 
 @parcels_bp.route('/track/<string:tracking_number>', methods=['GET'])
 def track_parcel(tracking_number):
-    parcel = Parcel.query.filter_by(tracking_number=tracking_number).first()
-    if parcel is None:
+    return run_reader(track_parcel_reader(tracking_number))
+
+def track_parcel_reader(tracking_number):
+    # A reader (see read_models.py), so asgi.py serves the same view.
+    try:
+        fields, history = payload_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not (yield partial(tracking_numbers.might_exist, tracking_number)):
         return jsonify({'error': 'Parcel not found'}), 404
-    return jsonify(parcel.to_dict())
+    # The cache holds the full body and the version its ETag is built
+    # from; other variants are cut from it.
+    cached = yield partial(tracking_cache.get, tracking_number)
+    parcel = None
+    if cached is None:
+        # Read the version before the body, so the tag is never newer.
+        version = yield from read_parcel_version(tracking_number)
+        if version is None:
+            return jsonify({'error': 'Parcel not found'}), 404
+        etag = make_etag(tracking_number, version, variant(fields, history))
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+        parcel = yield from read_parcel(tracking_number)
+        if parcel is None:
+            return jsonify({'error': 'Parcel not found'}), 404
+        body = _json_body(parcel)
+        yield partial(tracking_cache.set, tracking_number, body, version)
+    else:
+        version, body = cached
+        etag = make_etag(tracking_number, version, variant(fields, history))
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+    if fields == ALL_FIELDS and history == 'full':
+        return with_etag(_json_response(body), etag)
+    if parcel is None:
+        parcel = current_app.json.loads(body)
+    return with_etag(jsonify(project_parcel(parcel, fields, history)), etag), 200
+
+def _filtered_parcels(args, fields=ALL_FIELDS):
+    return parcels_statement(
+        status=args.get('status'),
+        courier_id=args.get('courier_id'),
+        service_type=args.get('service_type'),
+        after=args.get('after', type=int),
+        fields=fields,
+    )
+
+def _stream_parcels(statement, fields, history):
+    # A server-side cursor feeds fixed-size chunks, so only one chunk of
+    # parcels is ever held in memory while the array is written out.
+    yield '['
+    first = True
+    for parcel in iter_parcel_dicts(statement, fields, history, STREAM_CHUNK_SIZE):
+        if not first:
+            yield ','
+        first = False
+        yield current_app.json.dumps(parcel)
+    yield ']\n'
+
+@parcels_bp.route('/track/<string:tracking_number>/events', methods=['GET'])
+def track_parcel_events(tracking_number):
+    return sse_response(tracking_number=tracking_number)
 
 @parcels_bp.route('/', methods=['GET'])
 def get_all_parcels():
-    parcels = Parcel.query.all()
-    return jsonify([parcel.to_dict() for parcel in parcels]), 200
+    if 'after' in request.args and request.args.get('after', type=int) is None:
+        return jsonify({'error': 'after must be an integer parcel id'}), 400
+    try:
+        fields, history = payload_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if request.args.get('stream') in ('1', 'true'):
+        statement = _filtered_parcels(request.args, fields)
+        return current_app.response_class(
+            stream_with_context(_stream_parcels(statement, fields, history)), mimetype='application/json'
+        )
+
+    if 'limit' not in request.args:
+        return jsonify(parcel_dicts(_filtered_parcels(request.args, fields), fields, history)), 200
+
+    limit = request.args.get('limit', type=int)
+    if limit is None or not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
+    # Fetch one extra row to learn whether another page exists; the id is
+    # needed for the cursor even when it was not requested.
+    page_fields = fields | {'id'}
+    parcels = parcel_dicts(_filtered_parcels(request.args, page_fields).limit(limit + 1), page_fields, history)
+    next_cursor = parcels[limit - 1]['id'] if len(parcels) > limit else None
+    if 'id' not in fields:
+        parcels = [project_parcel(parcel, fields) for parcel in parcels]
+    response = jsonify(parcels[:limit])
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response, 200
+
+@parcels_bp.route('/search', methods=['GET'])
+def search():
+    try:
+        fields, history = payload_options(request.args)
+        options = search_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit, offset = options['limit'], options['offset']
+    # Ranked results have no stable key to resume from, so pages are
+    # offsets; one extra hit tells whether another page exists.
+    parcels = search_parcels(options['words'], options['columns'], limit + 1, offset, fields, history)
+    response = jsonify(parcels[:limit])
+    if len(parcels) > limit and offset + limit <= MAX_SEARCH_OFFSET:
+        response.headers['X-Next-Offset'] = str(offset + limit)
+    return response, 200
 
 @parcels_bp.route('/', methods=['POST'])
+@merchant_optional
 def create_parcel():
+    reservation = None
     try:
         data = request.json
-        print("Received data:", data)
-        tracking_number = generate_tracking_number()
+        # Before any write: the sequence block may be reserved in its own transaction.
+        tracking_number = tracking_numbers.allocate()[0]
+        current_app.logger.debug("Creating parcel %s", tracking_number)
 
         # Create sender and recipient
-        sender = Customer(
-            name=data['sender']['name'],
-            email=data['sender']['email'],
-            phone=data['sender']['phone'],
-            address=data['sender']['address']
-        )
-        recipient = Customer(
-            name=data['recipient']['name'],
-            email=data['recipient']['email'],
-            phone=data['recipient']['phone'],
-            address=data['recipient']['address']
-        )
+        sender = Customer(**geocoding.locate({field: data['sender'][field] for field in CUSTOMER_FIELDS}))
+        recipient = Customer(**geocoding.locate({field: data['recipient'][field] for field in CUSTOMER_FIELDS}))
         db.session.add(sender)
         db.session.add(recipient)
         db.session.flush()
 
-       
-        courier = Courier.query.order_by(db.func.random()).first()
-        if not courier:
+        weight = float(data.get('weight', 1.0))
+        length = float(data.get('length', 10))
+        width = float(data.get('width', 5))
+        height = float(data.get('height', 2))
+        volume = parcel_volume(length, width, height)
+
+        courier_id = courier_loads.acquire(weight, volume)
+        if courier_id is None:
+            db.session.rollback()
             return jsonify({'error': 'No couriers available'}), 500
+        reservation = (courier_id, weight, volume)
+        courier = db.session.get(Courier, courier_id)
 
-       
+        row = {
+            'status': 'Created',
+            'location': 'System',
+            'timestamp': datetime.utcnow(),
+            'description': 'Parcel created and assigned to courier: ' + courier.name
+        }
         parcel = Parcel(
             tracking_number=tracking_number,
             sender_id=sender.id,
             recipient_id=recipient.id,
             courier_id=courier.id,
-            weight=data.get('weight', 1.0),
-            length=data.get('length', 10),
-            width=data.get('width', 5),
-            height=data.get('height', 2),
+            merchant_id=g.merchant_id,
+            weight=weight,
+            length=length,
+            width=width,
+            height=height,
             service_type=data.get('service_type', 'Standard'),
             estimated_delivery=datetime.utcnow() + timedelta(days=random.randint(2, 7)),
             description=data.get('description', 'Demo parcel'),
-            status='Created'
+            status='Created',
+            version=next_value(PARCEL_VERSION),
+            **fold_tracking_updates(None, None, None, [row])
         )
         db.session.add(parcel)
         db.session.flush()
+        record_rollups(added=[parcel_rollup_entry(parcel)])
 
-        update = TrackingUpdate(
-            parcel_id=parcel.id,
-            status='Created',
-            location='System',
-            timestamp=datetime.utcnow(),
-            description='Parcel created and assigned to courier: ' + courier.name
-        )
+        update = TrackingUpdate(parcel_id=parcel.id, **row)
         db.session.add(update)
+        db.session.flush()
+        created = status_change(parcel, 'Created', [tracking_event(update.id, tracking_number, courier.id, row)],
+                                version=parcel.version)
+        record_events(created['events'], 'parcel.created')
         db.session.commit()
+        tracking_numbers.add(tracking_number)
 
-        return jsonify(parcel.to_dict()), 201
+        publish_status_changes([created])
+        body = _json_body(parcel.to_dict())
+        tracking_cache.set(tracking_number, body, parcel.version)
+        return _json_response(body, 201)
 
     except Exception as e:
         db.session.rollback()
-        print("Parcel creation failed:", str(e))
+        if reservation:
+            courier_loads.release(*reservation)
+        current_app.logger.exception("Parcel creation failed")
         return jsonify({'error': 'Parcel creation failed', 'details': str(e)}), 500
 
+@parcels_bp.route('/bulk', methods=['POST'])
+@merchant_optional
+def bulk_create_parcels():
+    chunk_size = request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int)
+    if not 1 <= chunk_size <= MAX_IMPORT_CHUNK_SIZE:
+        return jsonify({'error': f'chunk_size must be between 1 and {MAX_IMPORT_CHUNK_SIZE}'}), 400
+
+    if request.mimetype == 'text/csv':
+        rows = read_rows(request.stream, 'csv')
+    elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        rows = read_rows(request.stream, 'jsonl')
+    elif request.is_json:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            return jsonify({'error': 'Expected a JSON array of parcels'}), 400
+    else:
+        return jsonify({'error': 'Send text/csv, application/x-ndjson or a JSON array'}), 415
+
+    try:
+        report = import_parcels(rows, chunk_size=chunk_size, merchant_id=g.merchant_id)
+    except RuntimeError as e:
+        return jsonify({'error': 'Parcel import failed', 'details': str(e)}), 500
+    return jsonify(report), 200
+
+def _enqueue_scan_events(events):
+    try:
+        sequence = write_behind.submit(events)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({
+        'message': 'Queued',
+        'queued': len(events),
+        'sequence': sequence,
+        'writer': write_behind.slot,
+    }), 202
+
 @parcels_bp.route('/<tracking_number>/status', methods=['PUT'])
 def update_parcel_status(tracking_number):
-    parcel = Parcel.query.filter_by(tracking_number=tracking_number).first()
+    if write_behind.enabled:
+        return _enqueue_scan_events([dict(request.json or {}, tracking_number=tracking_number)])
+
+    # Locked so concurrent updates cannot lose each other's summary counts.
+    parcel = Parcel.query.filter_by(tracking_number=tracking_number).with_for_update().first()
     if not parcel:
         return jsonify({'error': 'Parcel not found'}), 404
 
     data = request.json
+    change = status_change(parcel, data['status'])
+    before = parcel_rollup_entry(parcel)
     parcel.status = data['status']
 
-    update = TrackingUpdate(
-        parcel_id=parcel.id,
-        status=data['status'],
-        location=data.get('location', 'Unknown'),
-        timestamp=datetime.utcnow(),
-        description=data.get('description', '')
-    )
+    row = {
+        'status': data['status'],
+        'location': data.get('location', 'Unknown'),
+        'timestamp': datetime.utcnow(),
+        'description': data.get('description', '')
+    }
+    summary = fold_tracking_updates(parcel.last_update_at, parcel.last_location, parcel.status_counts, [row])
+    for key, value in summary.items():
+        setattr(parcel, key, value)
+    parcel.version = change['version'] = next_value(PARCEL_VERSION)
+    record_rollups([before], [parcel_rollup_entry(parcel)])
+    update = TrackingUpdate(parcel_id=parcel.id, **row)
     db.session.add(update)
+    db.session.flush()
+    change['events'].append(tracking_event(update.id, tracking_number, parcel.courier_id, row))
+    record_events(change['events'])
     db.session.commit()
+    publish_status_changes([change])
+
+    return jsonify({'message': 'Status updated'}), 200
+
+@parcels_bp.route('/<tracking_number>/courier', methods=['PUT'])
+def reassign_parcel(tracking_number):
+    courier_id = (request.get_json(silent=True) or {}).get('courier_id')
+    if not courier_id or db.session.get(Courier, courier_id) is None:
+        return jsonify({'error': 'Unknown courier'}), 400
+    parcel = Parcel.query.filter_by(tracking_number=tracking_number).with_for_update().first()
+    if not parcel:
+        return jsonify({'error': 'Parcel not found'}), 404
+
+    old_courier_id = parcel.courier_id
+    if old_courier_id != courier_id:
+        version = next_value(PARCEL_VERSION)
+        if old_courier_id:
+            db.session.add(ParcelTombstone(parcel_id=parcel.id, tracking_number=tracking_number,
+                                           courier_id=old_courier_id, version=version, reason='reassigned'))
+        before = parcel_rollup_entry(parcel)
+        parcel.courier_id = courier_id
+        parcel.version = version
+        record_rollups([before], [parcel_rollup_entry(parcel)])
+        db.session.commit()
+        tracking_cache.invalidate(tracking_number, version)
+        courier_loads.reassigned(old_courier_id, courier_id, parcel.status, parcel.weight,
+                                 parcel_volume(parcel.length, parcel.width, parcel.height))
+    return jsonify({'message': 'Courier assigned', 'courier_id': courier_id}), 200
+
+@parcels_bp.route('/scans', methods=['POST'])
+def ingest_scan_events():
+    events = request.get_json(silent=True)
+    if not isinstance(events, list):
+        return jsonify({'error': 'Expected a JSON array of scan events'}), 400
+    if len(events) > MAX_SCAN_BATCH:
+        return jsonify({'error': f'At most {MAX_SCAN_BATCH} events per request'}), 413
+    if write_behind.enabled:
+        return _enqueue_scan_events(events)
+
+    try:
+        results, changes = apply_scan_events(events)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Scan ingestion failed', 'details': str(e)}), 500
+
+    publish_status_changes(changes)
 
-    return jsonify({'message': 'Status updated'}), 200
\ No newline at end of file
+    applied = sum(1 for result in results if result['result'] == 'applied')
+    return jsonify({
+        'applied': applied,
+        'failed': len(results) - applied,
+        'results': results,
+    }), 200
@@ -0,0 +1,271 @@
+# read_models.py
+from itertools import groupby
+
+from sqlalchemy import func, select, Executable
+from sqlalchemy.orm import aliased
+
+from models import (db, parcel_fields, Customer, Courier, Parcel, ParcelArchive, ParcelTombstone,
+                    TrackingUpdate, TrackingUpdateArchive, PARCEL_FIELDS)
+
+# JSON for the read-only endpoints, assembled from plain column tuples
+# instead of ORM objects. Every function here returns exactly what the
+# matching to_dict() would, including its ``fields`` and ``history``
+# options; columns and joins for keys that were not requested are left
+# out of the SQL. Statements are built apart from their execution so other
+# executors can run the same SQL.
+#
+# Lookups that take more than one statement are readers: generators that
+# yield each statement and are sent its rows back, and return their
+# result. A reader may also yield a callable for blocking work outside the
+# database, such as the tracking cache, and is sent what it returns.
+# run_reader() runs one on db.session; asgi.py runs the same readers on
+# its async engine, with the callables on threads.
+
+HISTORY_CHUNK_SIZE = 500
+
+Sender = aliased(Customer, name='sender')
+Recipient = aliased(Customer, name='recipient')
+
+CUSTOMER_FIELDS = ('id', 'name', 'email', 'phone', 'address')
+COURIER_FIELDS = ('id', 'name', 'email', 'phone', 'vehicle')
+SCALAR_FIELDS = ('tracking_number', 'status', 'estimated_delivery', 'description', 'weight',
+                 'length', 'width', 'height', 'service_type', 'last_update_at', 'last_location',
+                 'status_counts')
+ALL_FIELDS = frozenset(PARCEL_FIELDS)
+
+
+def _customer_columns(entity, prefix):
+    return [getattr(entity, field).label(f'{prefix}_{field}') for field in CUSTOMER_FIELDS]
+
+
+def parcels_statement(status=None, courier_id=None, service_type=None, after=None, tracking_number=None,
+                      fields=ALL_FIELDS, parcel_model=Parcel, since=None):
+    columns = [parcel_model.id] + [getattr(parcel_model, field) for field in SCALAR_FIELDS if field in fields]
+    if 'courier_id' in fields or 'courier_name' in fields:
+        columns += [Courier.id.label('courier_id'), Courier.name.label('courier_name')]
+    if 'sender' in fields:
+        columns += _customer_columns(Sender, 'sender')
+    if 'recipient' in fields:
+        columns += _customer_columns(Recipient, 'recipient')
+
+    query = select(*columns)
+    if 'sender' in fields:
+        query = query.join(Sender, Sender.id == parcel_model.sender_id)
+    if 'recipient' in fields:
+        query = query.join(Recipient, Recipient.id == parcel_model.recipient_id)
+    if 'courier_id' in fields or 'courier_name' in fields:
+        query = query.outerjoin(Courier, Courier.id == parcel_model.courier_id)
+    query = query.order_by(parcel_model.id)
+    if status:
+        query = query.where(parcel_model.status == status)
+    if courier_id:
+        query = query.where(parcel_model.courier_id == courier_id)
+    if service_type:
+        query = query.where(parcel_model.service_type == service_type)
+    if after is not None:
+        query = query.where(parcel_model.id > after)
+    if tracking_number is not None:
+        query = query.where(parcel_model.tracking_number == tracking_number)
+    if since is not None:
+        query = query.where(parcel_model.version > since)
+    return query
+
+
+def removed_statement(courier_id, since):
+    # Tombstones of parcels that left the courier and have not come back.
+    current = (Parcel.id == ParcelTombstone.parcel_id) & (Parcel.courier_id == courier_id)
+    return (
+        select(ParcelTombstone.tracking_number)
+        .outerjoin(Parcel, current)
+        .where(ParcelTombstone.courier_id == courier_id, ParcelTombstone.version > since, Parcel.id.is_(None))
+        .group_by(ParcelTombstone.tracking_number)
+        .order_by(func.max(ParcelTombstone.version))
+    )
+
+
+def history_statement(parcel_ids, history='full', update_model=TrackingUpdate):
+    columns = (update_model.parcel_id, update_model.timestamp, update_model.status,
+               update_model.location, update_model.description)
+    if history == 'latest':
+        ranked = (
+            select(*columns, func.row_number().over(
+                partition_by=update_model.parcel_id,
+                order_by=(update_model.timestamp.desc(), update_model.id.desc()),
+            ).label('position'))
+            .where(update_model.parcel_id.in_(parcel_ids))
+            .subquery()
+        )
+        return (
+            select(ranked.c.parcel_id, ranked.c.timestamp, ranked.c.status,
+                   ranked.c.location, ranked.c.description)
+            .where(ranked.c.position == 1)
+            .order_by(ranked.c.parcel_id)
+        )
+    # Same order as Parcel.tracking_updates; on the (parcel_id, timestamp)
+    # index this needs no sort.
+    return (
+        select(*columns)
+        .where(update_model.parcel_id.in_(parcel_ids))
+        .order_by(update_model.parcel_id, update_model.timestamp, update_model.id)
+    )
+
+
+def couriers_statement():
+    return select(*(getattr(Courier, field) for field in COURIER_FIELDS))
+
+
+def history_by_parcel(rows):
+    return {
+        parcel_id: [{
+            'timestamp': update.timestamp.isoformat(),
+            'status': update.status,
+            'location': update.location,
+            'description': update.description,
+        } for update in updates]
+        for parcel_id, updates in groupby(rows, key=lambda row: row.parcel_id)
+    }
+
+
+def assemble_parcel(row, history, fields=ALL_FIELDS):
+    mapping = row._mapping
+    data = {field: mapping[field] for field in SCALAR_FIELDS if field in fields}
+    if 'id' in fields:
+        data['id'] = row.id
+    for field in ('estimated_delivery', 'last_update_at'):
+        if data.get(field) is not None:
+            data[field] = data[field].isoformat()
+    if 'status_counts' in fields:
+        data['status_counts'] = data['status_counts'] or {}
+    if 'sender' in fields:
+        data['sender'] = {field: mapping[f'sender_{field}'] for field in CUSTOMER_FIELDS}
+    if 'recipient' in fields:
+        data['recipient'] = {field: mapping[f'recipient_{field}'] for field in CUSTOMER_FIELDS}
+    # Read through the join like to_dict reads them through the
+    # relationship, so a dangling courier_id shows up as None.
+    if 'courier_id' in fields:
+        data['courier_id'] = row.courier_id
+    if 'courier_name' in fields:
+        data['courier_name'] = row.courier_name
+    if 'tracking_history' in fields:
+        data['tracking_history'] = history.get(row.id, [])
+    return data
+
+
+def run_reader(reader):
+    """Run a reader on db.session and return its result."""
+    try:
+        step = next(reader)
+        while True:
+            if isinstance(step, Executable):
+                step = reader.send(db.session.execute(step).all())
+            else:
+                step = reader.send(step())
+    except StopIteration as stop:
+        return stop.value
+
+
+def assemble_rows(rows, fields=ALL_FIELDS, history='full', update_model=TrackingUpdate):
+    """Reader: dicts for rows of parcels_statement(), fetching history once per chunk."""
+    updates = {}
+    if 'tracking_history' in fields:
+        for start in range(0, len(rows), HISTORY_CHUNK_SIZE):
+            ids = [row.id for row in rows[start:start + HISTORY_CHUNK_SIZE]]
+            updates.update(history_by_parcel((yield history_statement(ids, history, update_model))))
+    return [assemble_parcel(row, updates, fields) for row in rows]
+
+
+def read_parcel_dicts(statement, fields=ALL_FIELDS, history='full'):
+    """Reader: parcel_dicts(), with every row held at once."""
+    rows = yield statement
+    return (yield from assemble_rows(rows, fields, history))
+
+
+def _assemble_chunk(rows, fields, history, update_model=TrackingUpdate):
+    return run_reader(assemble_rows(rows, fields, history, update_model))
+
+
+def iter_parcel_dicts(statement, fields=ALL_FIELDS, history='full', chunk_size=HISTORY_CHUNK_SIZE,
+                      update_model=TrackingUpdate):
+    """Parcel dicts for ``statement``, fetching history once per chunk.
+
+    ``statement`` must come from parcels_statement() with the same fields.
+    Rows come from a server-side cursor, so only one chunk is held in memory.
+    """
+    result = db.session.execute(statement, execution_options={'yield_per': chunk_size})
+    for rows in result.partitions():
+        yield from _assemble_chunk(rows, fields, history, update_model)
+
+
+def parcel_dicts(statement, fields=ALL_FIELDS, history='full', update_model=TrackingUpdate):
+    return list(iter_parcel_dicts(statement, fields, history, update_model=update_model))
+
+
+def read_parcel(tracking_number):
+    """Reader: the full dict of a parcel, looked up in the archive when it is not in the hot table."""
+    for parcel_model, update_model in ((Parcel, TrackingUpdate), (ParcelArchive, TrackingUpdateArchive)):
+        rows = yield parcels_statement(tracking_number=tracking_number, parcel_model=parcel_model).limit(1)
+        if rows:
+            return (yield from assemble_rows(rows, ALL_FIELDS, 'full', update_model))[0]
+    return None
+
+
+def parcel_version_statement(tracking_number):
+    # A parcel is in one of the two tables, never both.
+    return select(Parcel.version).where(Parcel.tracking_number == tracking_number).union_all(
+        select(ParcelArchive.version).where(ParcelArchive.tracking_number == tracking_number))
+
+
+def read_parcel_version(tracking_number):
+    """Reader: version of a parcel, hot or archived, or None when there is no such parcel."""
+    rows = yield parcel_version_statement(tracking_number)
+    return rows[0][0] if rows else None
+
+
+def courier_version_statement(courier_id):
+    removed = select(func.max(ParcelTombstone.version)).where(ParcelTombstone.courier_id == courier_id)
+    return select(func.count(), func.max(Parcel.version), removed.scalar_subquery()) \
+        .where(Parcel.courier_id == courier_id)
+
+
+def read_courier_version(courier_id):
+    """Reader: (parcels, highest parcel version, highest tombstone version) of a courier.
+
+    Any change to the courier's parcel list raises one of the two maxima:
+    changed and newly assigned parcels get a new version, parcels that
+    leave get a tombstone with one. Both come from the (courier_id,
+    version) indexes.
+    """
+    (count, latest, removed), = yield courier_version_statement(courier_id)
+    return count, latest or 0, removed or 0
+
+
+def payload_options(args):
+    """(fields, history) from ``?fields=a,b`` and ``?history=none|latest|full``.
+
+    Raises ValueError for unknown field names or history modes.
+    """
+    history = args.get('history', 'full')
+    fields = args.get('fields')
+    return parcel_fields(fields.split(',') if fields else None, history), history
+
+
+def project_parcel(parcel, fields, history='full'):
+    """Cut a full parcel dict down to ``fields`` and ``history``."""
+    data = {key: value for key, value in parcel.items() if key in fields}
+    if history == 'latest' and 'tracking_history' in data:
+        data['tracking_history'] = data['tracking_history'][-1:]
+    return data
+
+
+def read_courier_changes(courier_id, since, fields=ALL_FIELDS, history='full'):
+    """Reader: parcels of a courier changed after version ``since`` and the tracking numbers it lost."""
+    statement = parcels_statement(courier_id=courier_id, fields=fields, since=since)
+    parcels = yield from read_parcel_dicts(statement, fields, history)
+    removed = yield removed_statement(courier_id, since)
+    return {'parcels': parcels, 'removed': [row[0] for row in removed]}
+
+
+def courier_dicts(rows=None):
+    if rows is None:
+        rows = db.session.execute(couriers_statement())
+    return [dict(row._mapping) for row in rows]
@@ -0,0 +1,221 @@
+# rollups.py
+import json
+import math
+from datetime import date
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, DeliveryRollup, Parcel, ParcelArchive
+from assignment import DELIVERED_STATUS
+
+# delivery_rollup holds parcel counts, weight sums and on-time/late
+# deliveries by (day, courier, service type, status), where the day is
+# that of the parcel's latest tracking update. Every write path that
+# changes one of ROLLUP_FIELDS moves the parcel from its old bucket to
+# its new one in the same transaction, so /stats reads a few rollup rows
+# instead of scanning parcels. Archived parcels stay counted.
+# `flask rebuild-rollups` recomputes the table and reports any drift.
+
+ROLLUP_FIELDS = ('last_update_at', 'courier_id', 'service_type', 'status', 'weight', 'estimated_delivery')
+DIMENSIONS = ('day', 'courier_id', 'service_type', 'status')
+MEASURES = ('parcels', 'weight_sum', 'on_time', 'late')
+GROUPS = ('day', 'courier_id', 'service_type')
+REBUILD_BATCH = 10000
+
+
+def rollup_entry(last_update_at, courier_id, service_type, status, weight, estimated_delivery):
+    """(bucket, measures) a parcel counts towards, or None before its first tracking update."""
+    if last_update_at is None:
+        return None
+    on_time = late = 0
+    if status == DELIVERED_STATUS and estimated_delivery is not None:
+        on_time = int(last_update_at <= estimated_delivery)
+        late = 1 - on_time
+    key = (last_update_at.date(), courier_id or '', service_type or '', status or '')
+    return key, (1, weight or 0.0, on_time, late)
+
+
+def parcel_rollup_entry(parcel, **changes):
+    """rollup_entry() of a parcel or row, with ``changes`` applied over its values."""
+    return rollup_entry(**{field: changes[field] if field in changes else getattr(parcel, field)
+                           for field in ROLLUP_FIELDS})
+
+
+def rollup_deltas(removed=(), added=()):
+    deltas = {}
+    for sign, entries in ((-1, removed), (1, added)):
+        for entry in entries:
+            if entry is None:
+                continue
+            key, measures = entry
+            current = deltas.get(key, (0, 0.0, 0, 0))
+            deltas[key] = tuple(total + sign * value for total, value in zip(current, measures))
+    return {key: measures for key, measures in deltas.items() if any(measures)}
+
+
+def _upsert(rows):
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite if dialect == 'sqlite' else postgresql).insert(DeliveryRollup)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(DIMENSIONS),
+            set_={name: getattr(DeliveryRollup, name) + statement.excluded[name] for name in MEASURES},
+        )
+        db.session.execute(statement, rows)
+        return
+    for row in rows:
+        matched = db.session.execute(
+            update(DeliveryRollup)
+            .where(*(getattr(DeliveryRollup, name) == row[name] for name in DIMENSIONS))
+            .values({name: getattr(DeliveryRollup, name) + row[name] for name in MEASURES})
+        ).rowcount
+        if not matched:
+            db.session.execute(insert(DeliveryRollup), row)
+
+
+def record_rollups(removed=(), added=()):
+    """Move parcels out of the ``removed`` entries' buckets and into the ``added`` ones.
+
+    Runs in the caller's transaction. Buckets are updated in key order so
+    concurrent writers take their row locks in the same order.
+    """
+    deltas = rollup_deltas(removed, added)
+    if deltas:
+        _upsert([dict(zip(DIMENSIONS + MEASURES, key + measures)) for key, measures in sorted(deltas.items())])
+
+
+def compute_rollups(batch_size=REBUILD_BATCH):
+    """The rollup table recomputed from parcel and parcel_archive."""
+    totals = {}
+    for model in (Parcel, ParcelArchive):
+        result = db.session.execute(select(*(getattr(model, field) for field in ROLLUP_FIELDS)),
+                                    execution_options={'yield_per': batch_size})
+        for row in result:
+            entry = parcel_rollup_entry(row)
+            if entry is None:
+                continue
+            key, measures = entry
+            current = totals.get(key)
+            totals[key] = measures if current is None else tuple(a + b for a, b in zip(current, measures))
+    return totals
+
+
+def stored_rollups():
+    rows = db.session.execute(select(*(getattr(DeliveryRollup, name) for name in DIMENSIONS + MEASURES)))
+    return {tuple(row[:4]): tuple(row[4:]) for row in rows if any(row[4:])}
+
+
+def rollup_drift(expected, actual):
+    """Bucket keys whose stored measures differ from the recomputed ones."""
+    def same(a, b):
+        return all(math.isclose(x, y, rel_tol=1e-9, abs_tol=1e-6) for x, y in zip(a, b))
+    return sorted(key for key in expected.keys() | actual.keys()
+                  if not same(expected.get(key, (0, 0.0, 0, 0)), actual.get(key, (0, 0.0, 0, 0))))
+
+
+def _drift_report(expected, actual):
+    drift = rollup_drift(expected, actual)
+    return {
+        'buckets': len(expected),
+        'drifted': len(drift),
+        'examples': [{'bucket': [str(part) for part in key],
+                      'stored': actual.get(key), 'expected': expected.get(key)} for key in drift[:10]],
+    }
+
+
+def verify_rollups():
+    """Compare the stored rollups with a recomputation, without writing.
+
+    Run it while writes are quiet: a write between the two reads shows up
+    as drift.
+    """
+    return _drift_report(compute_rollups(), stored_rollups())
+
+
+def rebuild_rollups():
+    """Recompute the rollup table from scratch; returns the drift it replaced.
+
+    The table is locked first, so writers wait and then apply their deltas
+    on top of the rebuilt rows.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('LOCK TABLE delivery_rollup IN EXCLUSIVE MODE'))
+    # On SQLite the DELETE takes the write lock before the parcels are read.
+    actual = stored_rollups()
+    db.session.execute(delete(DeliveryRollup))
+    expected = compute_rollups()
+    rows = [dict(zip(DIMENSIONS + MEASURES, key + measures)) for key, measures in sorted(expected.items())]
+    for start in range(0, len(rows), REBUILD_BATCH):
+        db.session.execute(insert(DeliveryRollup), rows[start:start + REBUILD_BATCH])
+    db.session.commit()
+    return _drift_report(expected, actual)
+
+
+def stats_options(args):
+    """Filters and grouping for /stats from its query string; raises ValueError."""
+    group_by = [name for name in (args.get('group_by') or '').split(',') if name]
+    unknown = set(group_by) - set(GROUPS)
+    if unknown:
+        raise ValueError(f"group_by must be made of {', '.join(GROUPS)}")
+    try:
+        start = date.fromisoformat(args['from']) if args.get('from') else None
+        end = date.fromisoformat(args['to']) if args.get('to') else None
+    except ValueError:
+        raise ValueError('from and to must be YYYY-MM-DD dates')
+    return {'group_by': group_by, 'start': start, 'end': end,
+            'courier_id': args.get('courier_id'), 'service_type': args.get('service_type')}
+
+
+def delivery_stats(group_by=(), start=None, end=None, courier_id=None, service_type=None):
+    """Parcel counts by status, average weight and on-time rate per group.
+
+    Reads one rollup row per (group, status) and day in range, however
+    many parcels and tracking updates are behind them.
+    """
+    dimensions = [getattr(DeliveryRollup, name) for name in group_by]
+    query = select(*dimensions, DeliveryRollup.status,
+                   *(func.sum(getattr(DeliveryRollup, name)).label(name) for name in MEASURES))
+    if start is not None:
+        query = query.where(DeliveryRollup.day >= start)
+    if end is not None:
+        query = query.where(DeliveryRollup.day <= end)
+    if courier_id is not None:
+        query = query.where(DeliveryRollup.courier_id == courier_id)
+    if service_type is not None:
+        query = query.where(DeliveryRollup.service_type == service_type)
+    query = query.group_by(*dimensions, DeliveryRollup.status).order_by(*dimensions, DeliveryRollup.status)
+
+    groups = {}
+    for row in db.session.execute(query):
+        key = tuple(row[:len(group_by)])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                **{name: value.isoformat() if isinstance(value, date) else value
+                   for name, value in zip(group_by, key)},
+                'parcels': 0, 'weight_sum': 0.0, 'on_time': 0, 'late': 0, 'by_status': {},
+            }
+        if row.parcels:
+            group['by_status'][row.status] = row.parcels
+        for name in MEASURES:
+            group[name] += getattr(row, name) or 0
+    for group in groups.values():
+        weight_sum = group.pop('weight_sum')
+        group['average_weight'] = round(weight_sum / group['parcels'], 3) if group['parcels'] else None
+        rated = group['on_time'] + group['late']
+        group['on_time_rate'] = round(group['on_time'] / rated, 4) if rated else None
+    return list(groups.values())
+
+
+@click.command('rebuild-rollups')
+@click.option('--check', is_flag=True, help='Only compare the stored rollups with a recomputation.')
+@with_appcontext
+def rebuild_rollups_command(check):
+    """Recompute delivery_rollup from the parcel tables and report drift."""
+    report = verify_rollups() if check else rebuild_rollups()
+    click.echo(json.dumps(report, indent=2, default=str))
+    if check and report['drifted']:
+        raise SystemExit(1)
@@ -0,0 +1,185 @@
+# routing.py
+import hashlib
+import time
+
+import numpy as np
+from sqlalchemy import or_, select
+
+from models import db, Customer, Parcel
+from cache import LRUCache
+from assignment import DELIVERED_STATUS
+
+# Delivery order for a courier's undelivered parcels, by recipient
+# coordinates: a nearest-neighbour tour improved with 2-opt until it stops
+# improving or ROUTE_TIME_BUDGET runs out. Routes are open paths that
+# start at the given point, or wherever is shortest when there is none.
+# Plans are cached per courier and start point and reused while the
+# fingerprint of the stops (parcel ids and coordinates) is unchanged.
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def distance_matrix(latitudes, longitudes):
+    """Great-circle (haversine) distances in km between every pair of points."""
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def nearest_neighbour(matrix, start):
+    """Visit order starting at ``start``, always moving to the closest unvisited point."""
+    size = len(matrix)
+    visited = np.zeros(size, dtype=bool)
+    order = np.empty(size, dtype=np.intp)
+    current = start
+    for position in range(size):
+        order[position] = current
+        visited[current] = True
+        if position < size - 1:
+            current = int(np.argmin(np.where(visited, np.inf, matrix[current])))
+    return order
+
+
+def two_opt(route, matrix, deadline):
+    """Improve ``route`` in place by segment reversals; the ends stay fixed.
+
+    Every iteration scores all reversals at once and applies the best
+    non-overlapping improving ones. Returns True when no improving move is
+    left, False when ``deadline`` (a perf_counter value) stopped it first.
+    """
+    size = len(route)
+    upper = np.triu(np.ones((size - 1, size - 1), dtype=bool), k=2)
+    while time.perf_counter() < deadline:
+        # Reversing route[p+1:q+1] swaps edges (p, p+1) and (q, q+1) for
+        # (p, q) and (p+1, q+1).
+        heads, tails = route[:-1], route[1:]
+        edges = matrix[heads, tails]
+        gain = (edges[:, None] + edges[None, :]
+                - matrix[np.ix_(heads, heads)] - matrix[np.ix_(tails, tails)])
+        gain[~upper] = 0.0
+        best = gain.argmax(axis=1)
+        best_gain = gain[np.arange(size - 1), best]
+        candidates = np.flatnonzero(best_gain > 1e-9)
+        if not len(candidates):
+            return True
+        taken = np.zeros(size, dtype=bool)
+        for p in candidates[np.argsort(-best_gain[candidates])]:
+            q = best[p]
+            if taken[p:q + 2].any():
+                continue
+            route[p + 1:q + 1] = route[p + 1:q + 1][::-1].copy()
+            taken[p:q + 2] = True
+    return False
+
+
+def plan_route(latitudes, longitudes, start=None, time_budget=0.5):
+    """Order points into a short open path; returns (order, km, converged).
+
+    ``start`` is an optional (latitude, longitude) the path begins at.
+    ``order`` indexes into the given points.
+    """
+    deadline = time.perf_counter() + time_budget
+    count = len(latitudes)
+    if count == 0:
+        return [], 0.0, True
+    if start is not None:
+        latitudes = [start[0], *latitudes]
+        longitudes = [start[1], *longitudes]
+    points = len(latitudes)
+    # A free end is a dummy point at distance zero from everything, so the
+    # path may end (and, with no start, begin) wherever is shortest.
+    matrix = np.zeros((points + 1, points + 1))
+    matrix[:points, :points] = distance_matrix(latitudes, longitudes)
+    dummy = points
+    if start is not None:
+        route = np.append(nearest_neighbour(matrix[:points, :points], 0), dummy)
+    else:
+        route = np.concatenate(([dummy], nearest_neighbour(matrix, dummy)[1:], [dummy]))
+    converged = two_opt(route, matrix, deadline) if points > 2 else True
+    km = float(matrix[route[:-1], route[1:]].sum())
+    if start is not None:
+        order = [int(point) - 1 for point in route[1:-1]]
+    else:
+        order = [int(point) for point in route[1:-1]]
+    return order, km, converged
+
+
+def leg_distances(latitudes, longitudes):
+    """km from each point to the next one."""
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    a = (np.sin(np.diff(lat) / 2) ** 2
+         + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class RoutePlanner:
+    def __init__(self, app=None):
+        self.time_budget = 0.5
+        self.plans = LRUCache(max_entries=1000, ttl=3600)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.time_budget = float(app.config.get('ROUTE_TIME_BUDGET', self.time_budget))
+        self.plans = LRUCache(max_entries=int(app.config.get('ROUTE_CACHE_MAX_ENTRIES', 1000)),
+                              ttl=float(app.config.get('ROUTE_CACHE_TTL', 3600)))
+        app.extensions['route_planner'] = self
+
+    def stops(self, courier_id):
+        active = or_(Parcel.status.is_(None), Parcel.status != DELIVERED_STATUS)
+        return db.session.execute(
+            select(Parcel.id, Parcel.tracking_number, Parcel.status, Customer.name, Customer.address,
+                   Customer.latitude, Customer.longitude)
+            .join(Customer, Customer.id == Parcel.recipient_id)
+            .where(Parcel.courier_id == courier_id, active)
+            .order_by(Parcel.id)
+        ).all()
+
+    def plan(self, courier_id, start=None):
+        """The courier's undelivered parcels in delivery order.
+
+        Parcels whose recipient has no coordinates are listed apart under
+        'unlocated'.
+        """
+        rows = self.stops(courier_id)
+        located = [row for row in rows if row.latitude is not None and row.longitude is not None]
+        fingerprint = hashlib.sha1(repr(
+            [(row.id, row.latitude, row.longitude) for row in located]
+        ).encode()).hexdigest()
+        key = (courier_id, start)
+        cached = self.plans.get(key)
+        if cached is None or cached['fingerprint'] != fingerprint:
+            started = time.perf_counter()
+            order, km, converged = plan_route([row.latitude for row in located],
+                                              [row.longitude for row in located], start, self.time_budget)
+            points = ([start] if start else []) + [(located[i].latitude, located[i].longitude) for i in order]
+            legs = [0.0] * (start is None) + leg_distances(*zip(*points)).tolist() if order else []
+            cached = {'fingerprint': fingerprint, 'order': order, 'legs': legs, 'distance_km': km,
+                      'converged': converged, 'planning_ms': round((time.perf_counter() - started) * 1000, 1)}
+            self.plans.set(key, cached)
+
+        stops = [{
+            'tracking_number': located[index].tracking_number,
+            'status': located[index].status,
+            'recipient': located[index].name,
+            'address': located[index].address,
+            'latitude': located[index].latitude,
+            'longitude': located[index].longitude,
+            'leg_km': round(leg, 3),
+        } for index, leg in zip(cached['order'], cached['legs'])]
+        return {
+            'courier_id': courier_id,
+            'start': list(start) if start else None,
+            'stops': stops,
+            'distance_km': round(cached['distance_km'], 3),
+            'fully_optimized': cached['converged'],
+            'planning_ms': cached['planning_ms'],
+            'unlocated': [row.tracking_number for row in rows if row.latitude is None or row.longitude is None],
+        }
+
+
+route_planner = RoutePlanner()
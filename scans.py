@@ -0,0 +1,166 @@
+# scans.py
+from datetime import datetime, timezone
+from sqlalchemy import insert, select, update
+from models import db, Parcel, TrackingUpdate
+from cache import tracking_cache
+from assignment import courier_loads, parcel_volume
+from events import publish_tracking_events, tracking_event
+from parcel_summary import fold_tracking_updates
+from counters import next_value, PARCEL_VERSION
+from rollups import parcel_rollup_entry, record_rollups
+from outbox import record_events
+
+MAX_SCAN_BATCH = 1000
+# Checked up front, so an event the database would refuse is never queued.
+FIELD_LENGTHS = {
+    'tracking_number': Parcel.__table__.c.tracking_number.type.length,
+    'status': TrackingUpdate.__table__.c.status.type.length,
+    'location': TrackingUpdate.__table__.c.location.type.length,
+    'description': TrackingUpdate.__table__.c.description.type.length,
+}
+
+
+def _parse_timestamp(value):
+    if value is None:
+        return datetime.utcnow()
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def validate_scan_event(event):
+    if not isinstance(event, dict):
+        raise ValueError('event must be an object')
+    if not isinstance(event.get('tracking_number'), str) or not event['tracking_number']:
+        raise ValueError('tracking_number is required')
+    if not isinstance(event.get('status'), str) or not event['status']:
+        raise ValueError('status is required')
+    parsed = {
+        'tracking_number': event['tracking_number'],
+        'status': event['status'],
+        'location': event.get('location', 'Unknown'),
+        'description': event.get('description', ''),
+    }
+    for field, length in FIELD_LENGTHS.items():
+        if parsed[field] is not None and not isinstance(parsed[field], str):
+            raise ValueError(f'{field} must be a string')
+        if parsed[field] is not None and len(parsed[field]) > length:
+            raise ValueError(f'{field} must be at most {length} characters')
+    try:
+        parsed['timestamp'] = _parse_timestamp(event.get('timestamp'))
+    except (TypeError, ValueError):
+        raise ValueError('timestamp must be an ISO 8601 string')
+    return parsed
+
+
+def apply_scan_events(events):
+    """Stage a batch of scan events in the current session without committing.
+
+    All tracking numbers are resolved with one query that also locks the
+    parcels, the tracking updates go out as a single executemany INSERT and
+    each parcel's status, tracking summary and version are set by one bulk
+    UPDATE, the status being that of its most recent event unless the
+    parcel already has a later update (a scan that arrived late is kept in
+    the history but leaves the status alone). Returns a
+    result per event, in input order, and the status changes to pass to
+    publish_status_changes() once the transaction has committed.
+    """
+    results = [None] * len(events)
+    staged = []
+    for index, event in enumerate(events):
+        try:
+            staged.append((index, validate_scan_event(event)))
+        except ValueError as e:
+            tracking_number = event.get('tracking_number') if isinstance(event, dict) else None
+            results[index] = {'index': index, 'tracking_number': tracking_number,
+                              'result': 'invalid', 'error': str(e)}
+
+    numbers = {event['tracking_number'] for _, event in staged}
+    parcels = {}
+    if numbers:
+        parcels = {row.tracking_number: row for row in db.session.execute(
+            select(Parcel.id, Parcel.tracking_number, Parcel.courier_id, Parcel.status,
+                   Parcel.weight, Parcel.length, Parcel.width, Parcel.height, Parcel.service_type,
+                   Parcel.estimated_delivery, Parcel.last_update_at, Parcel.last_location, Parcel.status_counts)
+            .where(Parcel.tracking_number.in_(numbers))
+            .order_by(Parcel.id)
+            .with_for_update()
+        )}
+
+    rows = []
+    latest = {}
+    by_parcel = {}
+    for index, event in staged:
+        parcel = parcels.get(event['tracking_number'])
+        if parcel is None:
+            results[index] = {'index': index, 'tracking_number': event['tracking_number'],
+                              'result': 'not_found', 'error': 'Parcel not found'}
+            continue
+        row = {
+            'parcel_id': parcel.id,
+            'status': event['status'],
+            'location': event['location'],
+            'description': event['description'],
+            'timestamp': event['timestamp'],
+        }
+        rows.append(row)
+        by_parcel.setdefault(parcel.id, []).append(row)
+        # Ties on timestamp go to the event that came later in the batch.
+        current = latest.get(parcel.id)
+        if current is None or event['timestamp'] >= current['timestamp']:
+            latest[parcel.id] = event
+        results[index] = {'index': index, 'tracking_number': event['tracking_number'], 'result': 'applied'}
+
+    changes = {}
+    if rows:
+        update_ids = db.session.scalars(
+            insert(TrackingUpdate).returning(TrackingUpdate.id, sort_by_parameter_order=True), rows
+        ).all()
+        summaries = []
+        removed, added = [], []
+        version = next_value(PARCEL_VERSION, len(latest)) - len(latest)
+        for parcel_id, event in latest.items():
+            parcel = parcels[event['tracking_number']]
+            summary = fold_tracking_updates(parcel.last_update_at, parcel.last_location,
+                                            parcel.status_counts, by_parcel[parcel_id])
+            # Same rule as the summary: an event older than the parcel's
+            # last update does not set its status.
+            late = parcel.last_update_at is not None and event['timestamp'] < parcel.last_update_at
+            status = parcel.status if late else event['status']
+            version += 1
+            summaries.append({'id': parcel_id, 'status': status, 'version': version, **summary})
+            changes[parcel_id] = status_change(parcel, status, version=version)
+            removed.append(parcel_rollup_entry(parcel))
+            added.append(parcel_rollup_entry(parcel, status=status, last_update_at=summary['last_update_at']))
+        db.session.execute(update(Parcel), summaries)
+        record_rollups(removed, added)
+        for update_id, row in zip(update_ids, rows):
+            change = changes[row['parcel_id']]
+            change['events'].append(
+                tracking_event(update_id, change['tracking_number'], change['courier_id'], row))
+        record_events([event for change in changes.values() for event in change['events']])
+    return results, list(changes.values())
+
+
+def status_change(parcel, new_status, events=None, version=None):
+    return {
+        'tracking_number': parcel.tracking_number,
+        'version': version,
+        'courier_id': parcel.courier_id,
+        'old_status': parcel.status,
+        'new_status': new_status,
+        'weight': parcel.weight,
+        'volume': parcel_volume(parcel.length, parcel.width, parcel.height),
+        'events': events or [],
+    }
+
+
+def publish_status_changes(changes):
+    """Bring in-process state in line with committed status changes."""
+    for change in changes:
+        tracking_cache.invalidate(change['tracking_number'], change['version'])
+        if change['courier_id']:
+            courier_loads.status_changed(change['courier_id'], change['old_status'], change['new_status'],
+                                         change['weight'], change['volume'])
+        publish_tracking_events(change['events'])
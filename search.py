@@ -0,0 +1,318 @@
+# search.py
+import json
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect, text
+
+from models import db, Parcel, ParcelArchive, TrackingUpdate, TrackingUpdateArchive
+from read_models import parcel_dicts, parcels_statement, ALL_FIELDS
+
+# parcel_search indexes every parcel, hot or archived, by tracking number,
+# sender and recipient (name, email and phone) and description. A hot and
+# an archived parcel can share an id, so entries are keyed by both. On
+# SQLite it is an FTS5 table whose rowid is id * 2 + archived, ranked with
+# bm25; on PostgreSQL a plain table with a pg_trgm GIN index, ranked by
+# trigram similarity. Triggers on parcel, parcel_archive and customer keep it in
+# step with every write in the writer's own transaction.
+# `flask rebuild-search-index` reinstalls the triggers (an SQLite batch
+# migration that recreates one of those tables drops them) and refills it.
+
+SEARCH_COLUMNS = ('tracking_number', 'sender', 'recipient', 'description')
+# bm25 weights, in SEARCH_COLUMNS order.
+COLUMN_WEIGHTS = (10.0, 4.0, 4.0, 1.0)
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_OFFSET = 1000
+
+
+def _customer_text(dialect, alias):
+    if dialect == 'postgresql':
+        return f"concat_ws(' ', {alias}.name, {alias}.email, {alias}.phone)"
+    return f"trim(coalesce({alias}.name, '') || ' ' || coalesce({alias}.email, '') || ' ' || coalesce({alias}.phone, ''))"
+
+
+def _customer_lookup(dialect, column):
+    return f"coalesce((SELECT {_customer_text(dialect, 'c')} FROM customer AS c WHERE c.id = {column}), '')"
+
+
+SQLITE_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS parcel_search USING fts5("
+    "tracking_number, sender, recipient, description, "
+    "tokenize = 'unicode61', prefix = '2 3')"
+)
+
+
+def _sqlite_triggers():
+    def upsert(archived):
+        return (
+            f"DELETE FROM parcel_search WHERE rowid = new.id * 2 + {archived}; "
+            f"INSERT INTO parcel_search (rowid, tracking_number, sender, recipient, description) "
+            f"VALUES (new.id * 2 + {archived}, new.tracking_number, {_customer_lookup('sqlite', 'new.sender_id')}, "
+            f"{_customer_lookup('sqlite', 'new.recipient_id')}, coalesce(new.description, ''));"
+        )
+
+    triggers = {}
+    for source, archived in (('parcel', 0), ('parcel_archive', 1)):
+        triggers[f'{source}_search_insert'] = (
+            f"AFTER INSERT ON {source} BEGIN {upsert(archived)} END")
+        triggers[f'{source}_search_update'] = (
+            f"AFTER UPDATE OF tracking_number, sender_id, recipient_id, description ON {source} "
+            f"BEGIN {upsert(archived)} END")
+        triggers[f'{source}_search_delete'] = (
+            f"AFTER DELETE ON {source} BEGIN DELETE FROM parcel_search WHERE rowid = old.id * 2 + {archived}; END")
+    customer = _customer_text('sqlite', 'new')
+    triggers['customer_search_update'] = (
+        "AFTER UPDATE OF name, email, phone ON customer BEGIN "
+        f"UPDATE parcel_search SET sender = {customer} WHERE rowid IN ("
+        "SELECT id * 2 FROM parcel WHERE sender_id = new.id "
+        "UNION ALL SELECT id * 2 + 1 FROM parcel_archive WHERE sender_id = new.id); "
+        f"UPDATE parcel_search SET recipient = {customer} WHERE rowid IN ("
+        "SELECT id * 2 FROM parcel WHERE recipient_id = new.id "
+        "UNION ALL SELECT id * 2 + 1 FROM parcel_archive WHERE recipient_id = new.id); END"
+    )
+    return triggers
+
+
+POSTGRES_TABLE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE TABLE IF NOT EXISTS parcel_search ("
+    "parcel_id INTEGER NOT NULL, archived BOOLEAN NOT NULL, tracking_number VARCHAR(12) NOT NULL, "
+    "sender TEXT NOT NULL, recipient TEXT NOT NULL, description TEXT NOT NULL, "
+    "document TEXT GENERATED ALWAYS AS "
+    "(tracking_number || ' ' || sender || ' ' || recipient || ' ' || description) STORED, "
+    "PRIMARY KEY (parcel_id, archived))",
+    "CREATE INDEX IF NOT EXISTS ix_parcel_search_document ON parcel_search USING gin (document gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_parcel_search_tracking_number ON parcel_search (tracking_number text_pattern_ops)",
+]
+
+
+def _postgres_functions():
+    sender, recipient = _customer_lookup('postgresql', 'NEW.sender_id'), _customer_lookup('postgresql', 'NEW.recipient_id')
+    customer = _customer_text('postgresql', 'NEW')
+    return [
+        "CREATE OR REPLACE FUNCTION parcel_search_sync() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+        "DECLARE is_archived BOOLEAN := TG_TABLE_NAME = 'parcel_archive';\n"
+        "BEGIN\n"
+        "  IF TG_OP = 'DELETE' THEN\n"
+        "    DELETE FROM parcel_search WHERE parcel_id = OLD.id AND archived = is_archived;\n"
+        "    RETURN OLD;\n"
+        "  END IF;\n"
+        "  INSERT INTO parcel_search (parcel_id, archived, tracking_number, sender, recipient, description)\n"
+        f"  VALUES (NEW.id, is_archived, NEW.tracking_number, {sender}, {recipient}, coalesce(NEW.description, ''))\n"
+        "  ON CONFLICT (parcel_id, archived) DO UPDATE SET\n"
+        "    tracking_number = EXCLUDED.tracking_number, sender = EXCLUDED.sender,\n"
+        "    recipient = EXCLUDED.recipient, description = EXCLUDED.description;\n"
+        "  RETURN NEW;\n"
+        "END $$",
+        "CREATE OR REPLACE FUNCTION customer_search_sync() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+        "BEGIN\n"
+        f"  UPDATE parcel_search SET sender = {customer} WHERE (parcel_id, archived) IN (\n"
+        "    SELECT id, false FROM parcel WHERE sender_id = NEW.id\n"
+        "    UNION ALL SELECT id, true FROM parcel_archive WHERE sender_id = NEW.id);\n"
+        f"  UPDATE parcel_search SET recipient = {customer} WHERE (parcel_id, archived) IN (\n"
+        "    SELECT id, false FROM parcel WHERE recipient_id = NEW.id\n"
+        "    UNION ALL SELECT id, true FROM parcel_archive WHERE recipient_id = NEW.id);\n"
+        "  RETURN NEW;\n"
+        "END $$",
+    ]
+
+
+POSTGRES_TRIGGERS = {
+    'parcel_search_sync': ('parcel', 'AFTER INSERT OR DELETE OR UPDATE OF tracking_number, sender_id, recipient_id, '
+                                     'description ON parcel FOR EACH ROW EXECUTE FUNCTION parcel_search_sync()'),
+    'parcel_archive_search_sync': ('parcel_archive', 'AFTER INSERT OR DELETE OR UPDATE OF tracking_number, sender_id, '
+                                                     'recipient_id, description ON parcel_archive '
+                                                     'FOR EACH ROW EXECUTE FUNCTION parcel_search_sync()'),
+    'customer_search_sync': ('customer', 'AFTER UPDATE OF name, email, phone ON customer '
+                                         'FOR EACH ROW EXECUTE FUNCTION customer_search_sync()'),
+}
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def _unsupported(dialect):
+    return RuntimeError(f'Parcel search needs SQLite FTS5 or PostgreSQL, not {dialect}')
+
+
+# The SQL is built per dialect and run by the caller, so the create_all()
+# listener below shares it with the CLI. Migration e5d1b9c3a7f2 keeps its
+# own copy, as it was when the index was added.
+
+def install_statements(dialect):
+    """Create parcel_search if needed and (re)create its triggers."""
+    if dialect == 'sqlite':
+        statements = [SQLITE_TABLE]
+        for name, body in _sqlite_triggers().items():
+            statements += [f'DROP TRIGGER IF EXISTS {name}', f'CREATE TRIGGER {name} {body}']
+    elif dialect == 'postgresql':
+        statements = POSTGRES_TABLE + _postgres_functions()
+        for name, (table, body) in POSTGRES_TRIGGERS.items():
+            statements += [f'DROP TRIGGER IF EXISTS {name} ON {table}', f'CREATE TRIGGER {name} {body}']
+    else:
+        raise _unsupported(dialect)
+    return statements
+
+
+def fill_statements(dialect):
+    """Index every parcel of both tables into an empty parcel_search."""
+    sender, recipient = _customer_text(dialect, 's'), _customer_text(dialect, 'r')
+    statements = []
+    for source, archived in (('parcel', 0), ('parcel_archive', 1)):
+        if dialect == 'postgresql':
+            key, value = 'parcel_id, archived', f'p.id, {bool(archived)}'
+        else:
+            key, value = 'rowid', f'p.id * 2 + {archived}'
+        statements.append(
+            f"INSERT INTO parcel_search ({key}, tracking_number, sender, recipient, description) "
+            f"SELECT {value}, p.tracking_number, coalesce({sender}, ''), coalesce({recipient}, ''), "
+            f"coalesce(p.description, '') FROM {source} AS p "
+            "LEFT JOIN customer AS s ON s.id = p.sender_id LEFT JOIN customer AS r ON r.id = p.recipient_id"
+        )
+    return statements
+
+
+def drop_statements(dialect):
+    """Drop parcel_search with its triggers and functions."""
+    if dialect == 'sqlite':
+        statements = [f'DROP TRIGGER IF EXISTS {name}' for name in _sqlite_triggers()]
+    elif dialect == 'postgresql':
+        statements = [f'DROP TRIGGER IF EXISTS {name} ON {table}' for name, (table, _) in POSTGRES_TRIGGERS.items()]
+        statements += ['DROP FUNCTION IF EXISTS parcel_search_sync()', 'DROP FUNCTION IF EXISTS customer_search_sync()']
+    else:
+        raise _unsupported(dialect)
+    return statements + ['DROP TABLE IF EXISTS parcel_search']
+
+
+def install_search_index():
+    """Create parcel_search if needed and (re)create its triggers."""
+    for statement in install_statements(_dialect()):
+        db.session.execute(text(statement))
+
+
+def rebuild_search_index():
+    """Reinstall the triggers and refill parcel_search from both parcel tables; returns the row count."""
+    install_search_index()
+    dialect = _dialect()
+    # The table is emptied first, so on SQLite its write lock is held
+    # before the parcels are read and no write slips in between.
+    db.session.execute(text('DELETE FROM parcel_search'))
+    for statement in fill_statements(dialect):
+        db.session.execute(text(statement))
+    if dialect == 'sqlite':
+        db.session.execute(text("INSERT INTO parcel_search (parcel_search) VALUES ('optimize')"))
+    count = db.session.scalar(text('SELECT count(*) FROM parcel_search'))
+    db.session.commit()
+    return count
+
+
+# Databases built with db.create_all() (/init-demo, tests) rather than
+# the migrations get the index too.
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_index(metadata, connection, **kw):
+    dialect = connection.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        return
+    fill = not inspect(connection).has_table('parcel_search')
+    for statement in install_statements(dialect) + (fill_statements(dialect) if fill else []):
+        connection.execute(text(statement))
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_search_index(metadata, connection, **kw):
+    if connection.dialect.name in ('sqlite', 'postgresql'):
+        for statement in drop_statements(connection.dialect.name):
+            connection.execute(text(statement))
+
+
+def search_options(args):
+    """Query, columns and page for /parcels/search from its query string; raises ValueError."""
+    words = [re.findall(r'\w+', word) for word in (args.get('q') or '').split()]
+    words = [tokens for tokens in words if tokens]
+    if not any(len(token) >= 2 for tokens in words for token in tokens):
+        raise ValueError('q must contain at least one word of two or more characters')
+    columns = [name for name in (args.get('in') or '').split(',') if name] or list(SEARCH_COLUMNS)
+    unknown = set(columns) - set(SEARCH_COLUMNS)
+    if unknown:
+        raise ValueError(f"in must be made of {', '.join(SEARCH_COLUMNS)}")
+    limit = args.get('limit', DEFAULT_LIMIT, type=int)
+    offset = args.get('offset', 0, type=int)
+    if limit is None or not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+    if offset is None or not 0 <= offset <= MAX_OFFSET:
+        raise ValueError(f'offset must be between 0 and {MAX_OFFSET}')
+    return {'words': words, 'columns': columns, 'limit': limit, 'offset': offset}
+
+
+def _match_expression(words, columns):
+    # Each word is a phrase of its tokens ("alice@example.com" becomes
+    # "alice example com") whose last token may be a prefix.
+    phrases = ' AND '.join('"{}"*'.format(' '.join(tokens)) for tokens in words)
+    if list(columns) == list(SEARCH_COLUMNS):
+        return phrases
+    return f"{{{' '.join(columns)}}} : ({phrases})"
+
+
+def _like_pattern(value, prefix_only=False):
+    value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{value}%' if prefix_only else f'%{value}%'
+
+
+def search_hits(words, columns=SEARCH_COLUMNS, limit=DEFAULT_LIMIT, offset=0):
+    """(parcel id, archived) of the best matches, best first."""
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        rows = db.session.execute(text(
+            "SELECT rowid FROM parcel_search WHERE parcel_search MATCH :match "
+            f"ORDER BY bm25(parcel_search, {weights}) LIMIT :limit OFFSET :offset"
+        ), {'match': _match_expression(words, columns), 'limit': limit, 'offset': offset})
+        return [(row[0] >> 1, bool(row[0] & 1)) for row in rows]
+    if dialect != 'postgresql':
+        raise _unsupported(dialect)
+
+    # Every word must occur in the indexed document and in one of the
+    # chosen columns; tracking numbers only match from the start.
+    conditions, params = [], {}
+    for index, tokens in enumerate(words):
+        word = ' '.join(tokens)
+        params[f'w{index}'] = _like_pattern(word)
+        params[f'p{index}'] = _like_pattern(word.upper(), prefix_only=True)
+        scoped = [f"tracking_number LIKE :p{index}" if column == 'tracking_number' else f"{column} ILIKE :w{index}"
+                  for column in columns]
+        conditions.append(f"document ILIKE :w{index} AND ({' OR '.join(scoped)})")
+    params.update(query=' '.join(' '.join(tokens) for tokens in words), limit=limit, offset=offset)
+    rows = db.session.execute(text(
+        f"SELECT parcel_id, archived FROM parcel_search WHERE {' AND '.join(conditions)} "
+        "ORDER BY (tracking_number LIKE :p0)::int DESC, word_similarity(:query, document) DESC, parcel_id DESC "
+        "LIMIT :limit OFFSET :offset"
+    ), params)
+    return [(row[0], row[1]) for row in rows]
+
+
+def search_parcels(words, columns=SEARCH_COLUMNS, limit=DEFAULT_LIMIT, offset=0, fields=ALL_FIELDS, history='full'):
+    """Parcel dicts of the best matches, best first."""
+    hits = search_hits(words, columns, limit, offset)
+    found = {}
+    for archived, parcel_model, update_model in ((False, Parcel, TrackingUpdate),
+                                                 (True, ParcelArchive, TrackingUpdateArchive)):
+        ids = [parcel_id for parcel_id, is_archived in hits if is_archived == archived]
+        if not ids:
+            continue
+        page_fields = fields | {'id'}
+        statement = parcels_statement(fields=page_fields, parcel_model=parcel_model).where(parcel_model.id.in_(ids))
+        for parcel in parcel_dicts(statement, page_fields, history, update_model):
+            parcel_id = parcel['id'] if 'id' in fields else parcel.pop('id')
+            found[parcel_id, archived] = parcel
+    return [found[hit] for hit in hits if hit in found]
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Reinstall the parcel_search triggers and refill it from the parcel tables."""
+    click.echo(json.dumps({'indexed': rebuild_search_index()}))
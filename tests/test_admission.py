@@ -0,0 +1,59 @@
+import pytest
+from flask import Blueprint, Flask
+
+from admission import Admission, SQLiteBuckets
+
+
+@pytest.fixture
+def limited():
+    # A bare app with the same endpoint names as the real one, so the
+    # limiter is tested without the database.
+    app = Flask(__name__)
+    app.config.update(ADMISSION_CLIENT_RATE=0.001, ADMISSION_CLIENT_BURST=2,
+                      ADMISSION_GLOBAL_RATE=0.001, ADMISSION_GLOBAL_BURST=3,
+                      ADMISSION_MAX_CONCURRENT=3, ADMISSION_WRITE_RESERVED=1)
+    parcels = Blueprint('parcels', __name__)
+    parcels.add_url_rule('/track', 'track_parcel', lambda: 'ok')
+    parcels.add_url_rule('/parcels', 'list_parcels', lambda: 'ok', methods=['GET', 'POST'])
+    app.register_blueprint(parcels)
+    admission = Admission(app)
+    return app.test_client(), admission
+
+
+def track(client, address):
+    return client.get('/track', environ_base={'REMOTE_ADDR': address})
+
+
+def test_tracking_is_limited_per_client_and_overall(limited):
+    client, admission = limited
+
+    assert [track(client, '10.0.0.1').status_code for _ in range(3)] == [200, 200, 429]
+    assert track(client, '10.0.0.2').status_code == 200
+    response = track(client, '10.0.0.3')
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert admission.decisions[('track', 'client_rate_limited')] == 1
+    assert admission.decisions[('track', 'global_rate_limited')] == 1
+
+
+def test_reads_leave_the_reserved_slots_to_writes(limited):
+    client, admission = limited
+    admission._in_flight['read'] = 2
+
+    assert client.get('/parcels').status_code == 503
+    assert client.post('/parcels').status_code == 200
+    assert admission.in_flight() == {'read': 2, 'write': 0}
+
+    admission._in_flight['write'] = 1
+    assert client.post('/parcels').status_code == 503
+
+
+def test_sqlite_buckets_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / 'buckets.db')
+    first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+    bucket = [('client:10.0.0.1', 0.001, 2)]
+
+    assert first.take(bucket) == (None, 0)
+    assert second.take(bucket) == (None, 0)
+    failed, retry_after = first.take(bucket)
+    assert failed == 0 and retry_after > 0
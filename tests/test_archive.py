@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+
+from app import setup_demo_data
+from archive import archive_delivered
+from assignment import DELIVERED_STATUS
+from models import db, Parcel, ParcelArchive, ParcelTombstone, TrackingUpdate
+
+
+def deliver_long_ago(parcel_id):
+    db.session.execute(update(Parcel).where(Parcel.id == parcel_id)
+                       .values(status=DELIVERED_STATUS, last_update_at=datetime(2000, 1, 1)))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def history(client, tracking_number):
+    response = client.get(f'/parcels/track/{tracking_number}')
+    assert response.status_code == 200
+    return [update['status'] for update in response.get_json()['tracking_history']]
+
+
+def create_parcel(client):
+    person = {'name': 'Dana Cole', 'email': 'dana@example.com', 'phone': '555-3333', 'address': '9 Cherry Rd'}
+    response = client.post('/parcels/', json={'sender': person, 'recipient': person})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_archiving_moves_parcel_and_history(client):
+    setup_demo_data()
+    parcel = db.session.scalars(select(Parcel).order_by(Parcel.id)).first()
+    tracking_number, courier_id = parcel.tracking_number, parcel.courier_id
+    before = history(client, tracking_number)
+    deliver_long_ago(parcel.id)
+
+    report = archive_delivered(days=30)
+
+    assert (report['parcels'], report['tracking_updates']) == (1, len(before))
+    assert db.session.scalar(select(func.count()).select_from(Parcel).where(
+        Parcel.tracking_number == tracking_number)) == 0
+    assert history(client, tracking_number) == before
+    assert db.session.scalar(select(ParcelTombstone.courier_id).where(
+        ParcelTombstone.tracking_number == tracking_number)) == courier_id
+
+
+def test_a_reused_parcel_id_does_not_clash_with_the_archive(client):
+    setup_demo_data()
+    last = db.session.scalars(select(Parcel).order_by(Parcel.id.desc())).first()
+    archived_number, archived_id = last.tracking_number, last.id
+    archived_history = history(client, archived_number)
+    deliver_long_ago(archived_id)
+    archive_delivered(days=30)
+
+    # SQLite hands the highest id out again once its row is gone.
+    created = create_parcel(client)
+    assert created['id'] == archived_id
+    assert history(client, archived_number) == archived_history
+
+    deliver_long_ago(created['id'])
+    assert archive_delivered(days=30)['parcels'] == 1
+    assert history(client, archived_number) == archived_history
+    assert history(client, created['tracking_number']) == ['Created']
+    assert db.session.scalar(select(func.count()).select_from(ParcelArchive)) == 2
+    assert db.session.scalar(select(func.count()).select_from(TrackingUpdate).where(
+        TrackingUpdate.parcel_id == archived_id)) == 0
@@ -0,0 +1,78 @@
+import io
+
+from sqlalchemy import select
+
+from api_keys import issue_key
+from app import setup_demo_data
+from bulk_import import import_parcels, read_rows
+from models import db, Customer, OutboxEvent, Parcel, TrackingUpdate
+
+CSV = """sender_name,sender_email,sender_phone,sender_address,recipient_name,recipient_email,recipient_phone,recipient_address,weight,description
+Dana Cole,dana@example.com,555-3333,9 Cherry Rd,Eli Park,eli@example.com,555-4444,4 Birch Ln,2.5,Books
+Dana Cole,dana@example.com,555-3333,9 Cherry Rd,,eli@example.com,555-4444,4 Birch Ln,1,Shoes
+Dana Cole,dana@example.com,555-3333,9 Cherry Rd,Eli Park,eli@example.com,555-4444,4 Birch Ln,heavy,Lamp
+Dana Cole,dana@example.com,555-3333,9 Cherry Rd,Eli Park,eli@example.com,555-4444,4 Birch Ln,,Mugs
+"""
+
+
+def new_parcels(before):
+    return db.session.scalars(select(Parcel).where(Parcel.id > before).order_by(Parcel.id)).all()
+
+
+def last_parcel_id():
+    return db.session.scalar(select(Parcel.id).order_by(Parcel.id.desc()).limit(1)) or 0
+
+
+def test_csv_import_reports_bad_rows_and_creates_the_rest(client):
+    setup_demo_data()
+    before = last_parcel_id()
+
+    response = client.post('/parcels/bulk?chunk_size=2', data=CSV, content_type='text/csv')
+
+    assert response.status_code == 200
+    report = response.get_json()
+    assert (report['created'], report['failed']) == (2, 2)
+    assert [error['row'] for error in report['errors']] == [2, 3]
+    assert report['errors'][0]['error'] == 'recipient is missing name'
+
+    parcels = new_parcels(before)
+    assert [(p.description, p.weight, p.status, p.merchant_id) for p in parcels] == [
+        ('Books', 2.5, 'Created', None), ('Mugs', 1.0, 'Created', None)]
+    for parcel in parcels:
+        assert [u.status for u in db.session.scalars(
+            select(TrackingUpdate).where(TrackingUpdate.parcel_id == parcel.id))] == ['Created']
+        assert db.session.scalars(select(OutboxEvent.event_type).where(
+            OutboxEvent.tracking_number == parcel.tracking_number)).all() == ['parcel.created']
+
+
+def test_json_import_with_a_merchant_key_belongs_to_the_merchant(client):
+    setup_demo_data()
+    merchant = db.session.scalars(select(Customer).order_by(Customer.id)).first()
+    key = issue_key(merchant.id)
+    rows = list(read_rows(io.StringIO(CSV), 'csv'))
+    before = last_parcel_id()
+
+    response = client.post('/parcels/bulk', json=[rows[0], 'not a parcel'],
+                           headers={'Authorization': f'Bearer {key}'})
+
+    assert response.status_code == 200
+    assert response.get_json()['errors'] == [{'row': 2, 'error': 'row must be an object'}]
+    assert [p.merchant_id for p in new_parcels(before)] == [merchant.id]
+
+
+def test_bulk_import_rejects_what_it_cannot_read(client):
+    setup_demo_data()
+    assert client.post('/parcels/bulk', json={'sender': {}}).status_code == 400
+    assert client.post('/parcels/bulk', data='x', content_type='text/plain').status_code == 415
+    assert client.post('/parcels/bulk?chunk_size=0', json=[]).status_code == 400
+
+
+def test_import_parcels_reads_jsonl_lines_on_their_own(app):
+    setup_demo_data()
+    lines = b'{"sender": {}}\nnot json\n'
+
+    report = import_parcels(read_rows(lines, 'jsonl'))
+
+    assert (report['created'], report['failed']) == (0, 2)
+    assert report['errors'][0] == {'row': 1, 'error': 'sender is missing name, email, phone, address'}
+    assert report['errors'][1]['error'].startswith('invalid JSON')
@@ -0,0 +1,45 @@
+import json
+
+from sqlalchemy import func, select
+
+from app import setup_demo_data
+from events import event_hub
+from models import db, OutboxEvent, Parcel
+
+
+def scan(client, number, status):
+    response = client.post('/parcels/scans', json=[{'tracking_number': number, 'status': status, 'location': 'Hub',
+                                                    'timestamp': '2030-01-01T10:00:00'}])
+    assert response.status_code == 200
+
+
+def read_event(chunks):
+    lines = dict(line.split(': ', 1) for line in next(chunks).decode().splitlines() if line)
+    return int(lines['id']), json.loads(lines['data'])
+
+
+def test_reconnect_replays_missed_events_then_goes_live(client):
+    setup_demo_data()
+    first, second = db.session.scalars(select(Parcel.tracking_number).order_by(Parcel.id).limit(2)).all()
+    last_id = db.session.scalar(select(func.max(OutboxEvent.id))) or 0
+    scan(client, first, 'In Transit')
+    scan(client, second, 'In Transit')
+    scan(client, first, 'Out for Delivery')
+
+    response = client.get(f'/parcels/track/{first}/events', headers={'Last-Event-ID': str(last_id)})
+    chunks = iter(response.response)
+    try:
+        assert next(chunks).decode().startswith('retry: ')
+        replayed = [read_event(chunks) for _ in range(2)]
+        assert [event['status'] for _, event in replayed] == ['In Transit', 'Out for Delivery']
+        assert {event['tracking_number'] for _, event in replayed} == {first}
+        assert replayed[0][0] > last_id and replayed[1][0] > replayed[0][0]
+
+        # A live event the replay already covered is not sent twice.
+        newest = replayed[1][0]
+        event_hub.publish([f'parcel:{first}'], dict(replayed[1][1], sequence=newest))
+        event_hub.publish([f'parcel:{first}'], dict(replayed[1][1], sequence=newest + 1, status='Delivered'))
+        assert read_event(chunks) == (newest + 1, dict(replayed[1][1], sequence=newest + 1, status='Delivered'))
+    finally:
+        response.close()
+    assert event_hub.stream_count() == 0
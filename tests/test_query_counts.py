@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db, tracking_numbers
+from models import Courier, Customer, Parcel, TrackingUpdate
+from parcel_summary import backfill_summaries
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def add_parcels(count, courier_id='CR001'):
+    # Allocation commits in its own transaction, so it runs before any writes.
+    allocated = tracking_numbers.allocate(count)
+    if db.session.get(Courier, courier_id) is None:
+        db.session.add(Courier(id=courier_id, name='Test Courier', email='courier@example.com'))
+        db.session.add_all([Customer(name='Alice Sender', email='alice@example.com'),
+                            Customer(name='Bob Recipient', email='bob@example.com')])
+        db.session.flush()
+    sender, recipient = db.session.query(Customer.id).order_by(Customer.id).limit(2).all()
+    for tracking_number in allocated:
+        parcel = Parcel(tracking_number=tracking_number, sender_id=sender.id, recipient_id=recipient.id,
+                        courier_id=courier_id, weight=1.5, service_type='Express', status='In Transit',
+                        estimated_delivery=datetime.utcnow() + timedelta(days=3))
+        db.session.add(parcel)
+        db.session.flush()
+        db.session.add_all([
+            TrackingUpdate(parcel_id=parcel.id, status='Dispatched', location='Warehouse A'),
+            TrackingUpdate(parcel_id=parcel.id, status='In Transit', location='Distribution Center'),
+        ])
+    db.session.commit()
+    backfill_summaries()
+
+
+def statement_count(client, url):
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements), len(response.get_json())
+
+
+@pytest.mark.parametrize('url', ['/parcels/', '/couriers/CR001/parcels'])
+def test_parcel_lists_use_constant_queries(client, url):
+    add_parcels(3)
+    few, listed = statement_count(client, url)
+    assert listed == 3
+
+    add_parcels(30)
+    many, listed = statement_count(client, url)
+    assert listed == 33
+    assert many == few
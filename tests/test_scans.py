@@ -0,0 +1,50 @@
+from sqlalchemy import select
+
+from app import setup_demo_data
+from models import db, OutboxEvent, Parcel, TrackingUpdate
+
+
+def first_parcel():
+    setup_demo_data()
+    return db.session.scalars(select(Parcel).order_by(Parcel.id)).first()
+
+
+def scan(client, *events):
+    response = client.post('/parcels/scans', json=list(events))
+    assert response.status_code == 200
+    db.session.expire_all()
+    return response.get_json()
+
+
+def test_a_late_scan_keeps_the_newer_status(client):
+    parcel = first_parcel()
+    number = parcel.tracking_number
+    scan(client, {'tracking_number': number, 'status': 'Delivered', 'location': 'Doorstep',
+                  'timestamp': '2030-01-02T10:00:00'})
+    scan(client, {'tracking_number': number, 'status': 'In Transit', 'location': 'Depot',
+                  'timestamp': '2030-01-01T10:00:00'})
+
+    parcel = db.session.get(Parcel, parcel.id)
+    assert (parcel.status, parcel.last_location) == ('Delivered', 'Doorstep')
+    assert parcel.status_counts['In Transit'] == 2
+    assert db.session.scalar(select(TrackingUpdate.location).where(
+        TrackingUpdate.parcel_id == parcel.id).order_by(TrackingUpdate.id.desc()).limit(1)) == 'Depot'
+    # The late scan's event still goes out, without a status change.
+    payload = db.session.scalars(select(OutboxEvent.payload).order_by(OutboxEvent.id.desc())).first()
+    assert payload['status'] == 'In Transit'
+
+
+def test_a_batch_applies_its_newest_event_and_reports_each_one(client):
+    parcel = first_parcel()
+    number = parcel.tracking_number
+    report = scan(client,
+                  {'tracking_number': number, 'status': 'Out for Delivery', 'location': 'Van',
+                   'timestamp': '2030-01-02T08:00:00'},
+                  {'tracking_number': number, 'status': 'In Transit', 'location': 'Depot',
+                   'timestamp': '2030-01-01T08:00:00'},
+                  {'tracking_number': 'NOSUCHPARCEL', 'status': 'In Transit'},
+                  {'tracking_number': number})
+
+    assert [result['result'] for result in report['results']] == ['applied', 'applied', 'not_found', 'invalid']
+    parcel = db.session.get(Parcel, parcel.id)
+    assert (parcel.status, parcel.last_location) == ('Out for Delivery', 'Van')
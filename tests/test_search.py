@@ -0,0 +1,13 @@
+from app import setup_demo_data
+
+
+def test_search_after_create_all(client):
+    # The fixture builds the schema with db.create_all(), as /init-demo does.
+    setup_demo_data()
+
+    response = client.get('/parcels/search?q=alice&fields=tracking_number,description')
+
+    assert response.status_code == 200
+    assert len(response.get_json()) == 20
+    response = client.get('/parcels/search?q=parcel+7&in=description&fields=description')
+    assert response.get_json() == [{'description': 'Demo parcel 7'}]
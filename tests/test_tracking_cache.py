@@ -0,0 +1,30 @@
+import pytest
+
+from cache import LRUCache, SQLiteCacheBackend, TrackingCache
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmp_path):
+    cache = TrackingCache()
+    if request.param == 'memory':
+        cache.backend = LRUCache()
+    else:
+        cache.backend = SQLiteCacheBackend(str(tmp_path / 'cache.db'))
+    return cache
+
+
+def test_stale_reader_does_not_overwrite_invalidation(cache):
+    cache.set('TN1', '{"status": "Created"}', 1)
+    # A writer commits version 2 while a reader still holds version 1.
+    cache.invalidate('TN1', 2)
+    cache.set('TN1', '{"status": "Created"}', 1)
+    assert cache.get('TN1') is None
+
+    cache.set('TN1', '{"status": "In Transit"}', 2)
+    assert cache.get('TN1') == (2, '{"status": "In Transit"}')
+
+
+def test_older_body_does_not_replace_newer(cache):
+    cache.set('TN1', '{"status": "In Transit"}', 3)
+    cache.set('TN1', '{"status": "Created"}', 2)
+    assert cache.get('TN1') == (3, '{"status": "In Transit"}')
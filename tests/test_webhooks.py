@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+from api_keys import issue_key
+from app import setup_demo_data
+from models import db, Customer, Parcel, WebhookSubscriber
+from outbox import check_url, webhook_delivery
+
+ADMIN_KEY = 'test-admin-key'
+
+
+@pytest.fixture
+def keys(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'ADMIN_API_KEY', ADMIN_KEY)
+    setup_demo_data()
+    alice, bob = db.session.query(Customer).order_by(Customer.id).limit(2)
+    return {'admin': ADMIN_KEY, alice.id: issue_key(alice.id), bob.id: issue_key(bob.id)}
+
+
+def auth(key):
+    return {'Authorization': f'Bearer {key}'}
+
+
+def subscribe(client, key):
+    # A literal public address, so the test does not depend on DNS.
+    response = client.post('/webhooks', json={'url': 'https://93.184.215.14/hook'}, headers=auth(key))
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_webhooks_require_a_key(client, keys):
+    assert client.get('/webhooks').status_code == 401
+    assert client.post('/webhooks', json={'url': 'https://93.184.215.14/hook'}).status_code == 401
+    assert client.get('/webhooks', headers=auth('not-a-key')).status_code == 401
+
+
+def test_merchants_only_see_their_own_subscribers(client, keys):
+    alice, bob = [merchant_id for merchant_id in keys if merchant_id != 'admin']
+    mine = subscribe(client, keys[alice])
+    theirs = subscribe(client, keys[bob])
+
+    assert mine['merchant_id'] == alice
+    assert [s['id'] for s in client.get('/webhooks', headers=auth(keys[alice])).get_json()] == [mine['id']]
+    assert client.get(f"/webhooks/{theirs['id']}", headers=auth(keys[alice])).status_code == 404
+    assert client.delete(f"/webhooks/{theirs['id']}", headers=auth(keys[alice])).status_code == 404
+    assert len(client.get('/webhooks', headers=auth(ADMIN_KEY)).get_json()) == 2
+
+
+def create_parcel(client, key=None):
+    person = {'name': 'Dana Cole', 'email': 'dana@example.com', 'phone': '555-3333', 'address': '9 Cherry Rd'}
+    response = client.post('/parcels/', json={'sender': person, 'recipient': person},
+                           headers=auth(key) if key else {})
+    assert response.status_code == 201
+    return response.get_json()['tracking_number']
+
+
+def test_delivery_only_sends_the_merchants_parcels(client, keys):
+    alice = next(merchant_id for merchant_id in keys if merchant_id != 'admin')
+    subscribe(client, keys[alice])
+    subscribe(client, ADMIN_KEY)
+    # Every parcel gets sender and recipient rows of its own; the key is
+    # what ties these two to the merchant.
+    own = {create_parcel(client, keys[alice]), create_parcel(client, keys[alice])}
+    create_parcel(client)
+    response = client.post('/parcels/scans', json=[
+        {'tracking_number': number, 'status': 'In Transit', 'location': 'Hub'}
+        for number in db.session.scalars(select(Parcel.tracking_number))])
+    assert response.status_code == 200
+
+    subscribers = db.session.query(WebhookSubscriber).order_by(WebhookSubscriber.id).all()
+    merchant_job, admin_job = webhook_delivery._jobs(subscribers, webhook_delivery._batches(subscribers))
+    delivered = [event['data']['tracking_number'] for event in json.loads(merchant_job['body'])['events']]
+    assert sorted(delivered) == sorted([*own, *own])
+    assert admin_job['count'] == 3 + 23
+    # Both move past every event, delivered or not.
+    assert merchant_job['last_id'] == admin_job['last_id']
+
+
+def test_a_bad_key_is_refused_when_creating_parcels(client, keys):
+    person = {'name': 'Dana Cole', 'email': 'dana@example.com', 'phone': '555-3333', 'address': '9 Cherry Rd'}
+    response = client.post('/parcels/', json={'sender': person, 'recipient': person}, headers=auth('not-a-key'))
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize('url', [
+    'ftp://93.184.215.14/hook',
+    'http://127.0.0.1:8080/hook',
+    'http://10.0.0.5/hook',
+    'http://169.254.169.254/latest/meta-data',
+    'http://[::1]/hook',
+    'http://[::ffff:192.168.0.1]/hook',
+    'http://localhost/hook',
+])
+def test_internal_urls_are_rejected(client, keys, url):
+    with pytest.raises(ValueError):
+        check_url(url)
+    assert client.post('/webhooks', json={'url': url}, headers=auth(ADMIN_KEY)).status_code == 400
+
+
+def test_delivery_refuses_internal_addresses():
+    job = {'subscriber_id': 1, 'url': 'http://127.0.0.1:9/hook', 'secret': 'x' * 16, 'body': b'{}',
+           'delivery_id': '1:1-1'}
+    ok, error, _ = webhook_delivery._post(job)
+    assert not ok and 'loopback' in error
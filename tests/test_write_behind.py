@@ -0,0 +1,127 @@
+import json
+
+import pytest
+from sqlalchemy import func, select
+
+import write_behind as write_behind_module
+from app import setup_demo_data
+from models import db, OutboxEvent, Parcel, TrackingUpdate, WriteBehindCheckpoint
+from write_behind import WriteBehindQueue
+
+
+@pytest.fixture
+def queue(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'WRITE_BEHIND_DIR', str(tmp_path))
+    monkeypatch.setitem(app.extensions, 'write_behind', app.extensions['write_behind'])
+    monkeypatch.setattr(write_behind_module.time, 'sleep', lambda seconds: None)
+    setup_demo_data()
+    queue = WriteBehindQueue(app)
+    queue._claim_slot()
+    queue._recover()
+    yield queue
+    queue._journal.close()
+    queue._slot_lock.close()
+
+
+def scan_entries(count, status='In Transit'):
+    numbers = db.session.scalars(select(Parcel.tracking_number).order_by(Parcel.id).limit(count)).all()
+    db.session.remove()
+    return [(index + 1, {'tracking_number': number, 'status': status, 'location': 'Hub', 'description': '',
+                         'timestamp': '2030-01-01T00:00:00'})
+            for index, number in enumerate(numbers)]
+
+
+def counts():
+    return db.session.scalar(select(func.count(TrackingUpdate.id))), db.session.scalar(select(func.count(OutboxEvent.id)))
+
+
+def test_publish_failure_does_not_apply_the_batch_again(queue, monkeypatch):
+    def fail(changes):
+        raise OSError('broker is down')
+
+    monkeypatch.setattr(write_behind_module, 'publish_status_changes', fail)
+    entries = scan_entries(3)
+    updates, events = counts()
+
+    queue._process(entries)
+
+    assert counts() == (updates + 3, events + 3)
+    assert db.session.get(WriteBehindCheckpoint, queue.slot).sequence == 3
+    assert queue.committed_sequence == 3 and not queue._pending
+
+
+def test_dead_letter_failure_requeues_instead_of_stopping(queue, monkeypatch):
+    def refuse(events):
+        raise ValueError('refused')
+
+    monkeypatch.setattr(write_behind_module, 'apply_scan_events', refuse)
+    entries = scan_entries(2)
+    # The dead-letter file cannot be created.
+    queue.directory = str(queue.directory) + '/missing'
+
+    queue._process(entries)
+
+    assert list(queue._pending) == entries
+    assert queue.committed_sequence == 0
+
+
+def restart(app, queue):
+    # A crash: the worker lets go of its slot without draining the queue.
+    queue._journal.close()
+    queue._slot_lock.close()
+    replacement = WriteBehindQueue(app)
+    replacement._claim_slot()
+    replacement._recover()
+    return replacement
+
+
+def test_restart_replays_the_journal_after_the_checkpoint(app, queue):
+    entries = scan_entries(3)
+    queue._started = True
+    assert queue.submit([event for _, event in entries]) == 3
+    queue._process([queue._pending.popleft()])
+    with open(queue._journal.name, 'a') as journal:
+        journal.write('{"seq": 4, "event": {"tracking')
+    updates, events = counts()
+
+    replacement = restart(app, queue)
+    try:
+        assert replacement.slot == queue.slot
+        assert list(replacement._pending) == entries[1:]
+        assert replacement.sequence == 3 and replacement.committed_sequence == 1
+
+        replacement._process(list(replacement._pending))
+        replacement._pending.clear()
+        assert counts() == (updates + 2, events + 2)
+        assert db.session.get(WriteBehindCheckpoint, replacement.slot).sequence == 3
+    finally:
+        replacement._journal.close()
+        replacement._slot_lock.close()
+
+    replacement = restart(app, replacement)
+    try:
+        assert not replacement._pending
+    finally:
+        replacement._journal.close()
+        replacement._slot_lock.close()
+
+
+def test_refused_event_is_dead_lettered_and_the_rest_committed(queue, monkeypatch, tmp_path):
+    apply_scan_events = write_behind_module.apply_scan_events
+    entries = scan_entries(4)
+    bad = entries[2][1]['tracking_number']
+
+    def refuse_one(events):
+        if any(event['tracking_number'] == bad for event in events):
+            raise ValueError('refused')
+        return apply_scan_events(events)
+
+    monkeypatch.setattr(write_behind_module, 'apply_scan_events', refuse_one)
+    updates, events = counts()
+
+    queue._process(entries)
+
+    assert counts() == (updates + 3, events + 3)
+    assert queue.committed_sequence == 4 and queue.metrics['dead_lettered'] == 1
+    with open(tmp_path / f'{queue.slot}.dead-letter') as dead_letter:
+        assert [json.loads(line)['seq'] for line in dead_letter] == [3]
@@ -0,0 +1,290 @@
+# tracking_numbers.py
+import hashlib
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from models import db, Parcel, ParcelArchive
+from counters import current_value, reserve, TRACKING_NUMBER_SEQUENCE
+
+# Tracking numbers are 12 characters: 11 base-36 digits of a sequence
+# number run through a keyed permutation, so consecutive parcels do not get
+# guessable codes, followed by an ISO 7064 MOD 37,36 check character. The
+# permutation is one-to-one, so two sequence numbers never share a code.
+# Each worker reserves TRACKING_NUMBER_BLOCK sequence numbers at a time
+# from the counter table, so creating a parcel needs no uniqueness check
+# and no retry. TRACKING_NUMBER_KEY must not change once codes are issued.
+#
+# Every worker also keeps a Bloom filter of the codes in parcel and
+# parcel_archive, built at startup and updated as it creates parcels. A
+# code that is not in it can still have been created by another worker,
+# so a lookup is only answered as missing without the database when the
+# code could not have been issued since: it is malformed, fails its check
+# character, or decodes to a sequence number beyond the counter. Older
+# random codes without a valid check character are all in the filter.
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+DIGITS = {char: value for value, char in enumerate(ALPHABET)}
+CODE_LENGTH = 11
+CODE_SPACE = 36 ** CODE_LENGTH
+HALF_BITS = 29  # 2 ** 58 just covers CODE_SPACE
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+DEFAULT_KEY = 'parcel-delivery-tracking'
+# How far other workers may have moved the counter since it was last read.
+SEQUENCE_HEADROOM = 10_000_000
+WATERMARK_REFRESH = 60.0
+REBUILD_BATCH = 10000
+HASH_MASK = (1 << 64) - 1
+
+
+def check_character(digits):
+    """ISO 7064 MOD 37,36 check character for a string over ALPHABET."""
+    product = 36
+    for char in digits:
+        total = (product + DIGITS[char]) % 36 or 36
+        product = total * 2 % 37
+    return ALPHABET[(37 - product) % 36]
+
+
+class Permutation:
+    """Keyed one-to-one mapping of range(CODE_SPACE) onto itself.
+
+    A four-round Feistel network on 58 bits, walked again while the result
+    falls outside CODE_SPACE.
+    """
+
+    def __init__(self, key=DEFAULT_KEY):
+        self.key = key.encode() if isinstance(key, str) else key
+
+    def _round(self, number, half):
+        digest = hashlib.blake2b(half.to_bytes(4, 'big') + bytes([number]), key=self.key, digest_size=4).digest()
+        return int.from_bytes(digest, 'big') & HALF_MASK
+
+    def _forward(self, value):
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for number in range(ROUNDS):
+            left, right = right, left ^ self._round(number, right)
+        return left << HALF_BITS | right
+
+    def _backward(self, value):
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for number in reversed(range(ROUNDS)):
+            left, right = right ^ self._round(number, left), left
+        return left << HALF_BITS | right
+
+    def apply(self, value):
+        value = self._forward(value)
+        while value >= CODE_SPACE:
+            value = self._forward(value)
+        return value
+
+    def invert(self, value):
+        value = self._backward(value)
+        while value >= CODE_SPACE:
+            value = self._backward(value)
+        return value
+
+
+def encode(sequence, permutation):
+    value = permutation.apply(sequence)
+    digits = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, 36)
+        digits.append(ALPHABET[digit])
+    body = ''.join(reversed(digits))
+    return body + check_character(body)
+
+
+def decode(code, permutation):
+    """Sequence number behind ``code``, or None when it is not a well-formed code."""
+    if len(code) != CODE_LENGTH + 1 or any(char not in DIGITS for char in code):
+        return None
+    body = code[:-1]
+    if check_character(body) != code[-1]:
+        return None
+    value = 0
+    for char in body:
+        value = value * 36 + DIGITS[char]
+    return permutation.invert(value)
+
+
+class BloomFilter:
+    """Set membership with no false negatives and about ``error_rate`` false positives.
+
+    Probes come from Python's string hash, so a filter is only meaningful
+    inside the process that built it.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.probes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, key):
+        first, second = hash(key) & HASH_MASK, hash((key, 1)) & HASH_MASK
+        return [(first + probe * second) & HASH_MASK for probe in range(self.probes)]
+
+    def update(self, keys):
+        """Add many keys at once."""
+        if not keys:
+            return
+        first = np.array([hash(key) & HASH_MASK for key in keys], dtype=np.uint64)
+        second = np.array([hash((key, 1)) & HASH_MASK for key in keys], dtype=np.uint64)
+        probes = np.arange(self.probes, dtype=np.uint64)
+        # Wraps modulo 2 ** 64 like _positions().
+        positions = (first[:, None] + probes[None, :] * second[:, None]) % np.uint64(self.size)
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.count += len(keys)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            position %= self.size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class TrackingNumberRegistry:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.error_rate = 0.001
+        self.block_size = 1000
+        self.permutation = Permutation()
+        self.bloom = None
+        self.watermark = 0
+        self.watermark_read = 0.0
+        self.lookups = 0
+        self.definite_misses = 0
+        self._block = (None, 0, -1)  # (pid, next, last)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config.get('TRACKING_BLOOM_ENABLED', True)
+        self.error_rate = float(config.get('TRACKING_BLOOM_ERROR_RATE', self.error_rate))
+        self.block_size = int(config.get('TRACKING_NUMBER_BLOCK', self.block_size))
+        self.permutation = Permutation(config.get('TRACKING_NUMBER_KEY') or DEFAULT_KEY)
+        app.extensions['tracking_numbers'] = self
+        if self.enabled:
+            with app.app_context():
+                try:
+                    self.rebuild()
+                except (OperationalError, ProgrammingError):
+                    # Tables not created yet; lookups go to the database.
+                    db.session.rollback()
+
+    def rebuild(self):
+        """Refill the Bloom filter from parcel and parcel_archive."""
+        count = sum(db.session.scalar(select(func.count()).select_from(model)) for model in (Parcel, ParcelArchive))
+        bloom = BloomFilter(max(2 * count, 100000), self.error_rate)
+        for model in (Parcel, ParcelArchive):
+            result = db.session.execute(select(model.tracking_number),
+                                        execution_options={'yield_per': REBUILD_BATCH})
+            for rows in result.partitions():
+                bloom.update([row[0] for row in rows])
+        watermark = current_value(TRACKING_NUMBER_SEQUENCE)
+        with self._lock:
+            self.bloom = bloom
+            self.watermark = max(self.watermark, watermark)
+            self.watermark_read = time.monotonic()
+
+    def add(self, tracking_number):
+        self.add_many([tracking_number])
+
+    def add_many(self, tracking_numbers):
+        """Record codes this worker has just committed."""
+        with self._lock:
+            if self.bloom is None:
+                return
+            self.bloom.update(list(tracking_numbers))
+            full = self.bloom.count > self.bloom.capacity
+        if full:
+            self.rebuild()
+
+    def _current_watermark(self):
+        if time.monotonic() - self.watermark_read > WATERMARK_REFRESH:
+            watermark = current_value(TRACKING_NUMBER_SEQUENCE)
+            with self._lock:
+                self.watermark = max(self.watermark, watermark)
+                self.watermark_read = time.monotonic()
+        return self.watermark
+
+    def might_exist(self, tracking_number):
+        """False only when no parcel can have ``tracking_number``; True means ask the database."""
+        bloom = self.bloom
+        if not self.enabled or bloom is None:
+            return True
+        self.lookups += 1
+        if tracking_number in bloom:
+            return True
+        sequence = decode(tracking_number, self.permutation)
+        if sequence is not None and sequence <= self._current_watermark() + SEQUENCE_HEADROOM:
+            return True
+        self.definite_misses += 1
+        return False
+
+    def allocate(self, count=1):
+        """``count`` new, unused tracking numbers.
+
+        May reserve a block from the counter in a transaction of its own;
+        call it before the caller's transaction writes anything.
+        """
+        codes = []
+        with self._lock:
+            pid, next_sequence, last = self._block
+            if pid != os.getpid():
+                # A block inherited through fork() belongs to the parent.
+                next_sequence, last = 0, -1
+            while len(codes) < count:
+                if next_sequence > last:
+                    size = max(self.block_size, count - len(codes))
+                    last = reserve(TRACKING_NUMBER_SEQUENCE, size)
+                    next_sequence = last - size + 1
+                    self.watermark = max(self.watermark, last)
+                code = encode(next_sequence, self.permutation)
+                next_sequence += 1
+                # Skips the rare clash with an older random code.
+                if self.bloom is None or code not in self.bloom:
+                    codes.append(code)
+            self._block = (os.getpid(), next_sequence, last)
+        return codes
+
+    def stats(self):
+        bloom = self.bloom
+        return {
+            'enabled': self.enabled,
+            'entries': bloom.count if bloom is not None else 0,
+            'capacity': bloom.capacity if bloom is not None else 0,
+            'bytes': bloom.bits.nbytes if bloom is not None else 0,
+            'lookups': self.lookups,
+            'definite_misses': self.definite_misses,
+            'watermark': self.watermark,
+        }
+
+
+def tracking_number_samples():
+    """Bloom filter size and the tracking lookups it answered."""
+    stats = tracking_numbers.stats()
+    return [
+        ('tracking_bloom_entries', 'gauge', 'Tracking numbers in the Bloom filter.', {}, stats['entries']),
+        ('tracking_bloom_bytes', 'gauge', 'Size of the tracking number Bloom filter.', {}, stats['bytes']),
+        ('tracking_bloom_lookups_total', 'counter', 'Tracking lookups checked against the filter.', {},
+         stats['lookups']),
+        ('tracking_bloom_definite_misses_total', 'counter', 'Tracking lookups answered as missing without the DB.',
+         {}, stats['definite_misses']),
+    ]
+
+
+tracking_numbers = TrackingNumberRegistry()
@@ -0,0 +1,311 @@
+# write_behind.py
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from models import db, WriteBehindCheckpoint
+from scans import apply_scan_events, publish_status_changes, validate_scan_event
+
+BATCH_SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000)
+# Failures of the database rather than of the events: the batch is retried.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WriteBehindQueue:
+    """Optional write-behind ingestion of tracking updates with group commit.
+
+    Accepted events are appended to a journal file and fsynced before the
+    caller is answered, then a background writer drains them in group
+    commits of up to WRITE_BEHIND_MAX_BATCH events or WRITE_BEHIND_MAX_LATENCY
+    seconds, whichever comes first. The last committed sequence is stored in
+    write_behind_checkpoint in the same transaction as the updates, so after
+    a crash the journal is replayed from exactly that point.
+
+    A batch the database refuses for any other reason than being
+    unavailable is split until the events at fault are found. Each of them
+    is appended to ``<slot>.dead-letter`` in WRITE_BEHIND_DIR and the
+    checkpoint moves past it, so one bad event cannot stall the queue.
+
+    Every worker process claims its own journal slot in WRITE_BEHIND_DIR by
+    taking a lock on it; a restarted worker picks up an abandoned slot and
+    replays it. The writer starts on the first request a worker serves, so
+    it also works with ``gunicorn --preload``.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.app = None
+        self.slot = None
+        self.sequence = 0
+        self.committed_sequence = 0
+        self.metrics = {
+            'enqueued': 0,
+            'committed': 0,
+            'rejected': 0,
+            'commits': 0,
+            'commit_failures': 0,
+            'dead_lettered': 0,
+            'batch_sizes': {bucket: 0 for bucket in BATCH_SIZE_BUCKETS + ('+Inf',)},
+            'last_commit_seconds': None,
+        }
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._journal = None
+        self._slot_lock = None
+        self._started = False
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = bool(app.config.get('WRITE_BEHIND_ENABLED', False))
+        self.directory = app.config.get('WRITE_BEHIND_DIR') or os.path.join(app.instance_path, 'write-behind')
+        self.max_batch = int(app.config.get('WRITE_BEHIND_MAX_BATCH', 500))
+        self.max_latency = float(app.config.get('WRITE_BEHIND_MAX_LATENCY', 0.05))
+        self.max_depth = int(app.config.get('WRITE_BEHIND_MAX_DEPTH', 10000))
+        self.enqueue_timeout = float(app.config.get('WRITE_BEHIND_ENQUEUE_TIMEOUT', 0.5))
+        self.compact_bytes = int(app.config.get('WRITE_BEHIND_COMPACT_BYTES', 1024 * 1024))
+        if self.enabled:
+            app.before_request(self._ensure_started)
+        app.extensions['write_behind'] = self
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._claim_slot()
+            self._recover()
+            threading.Thread(target=self._run, name='write-behind', daemon=True).start()
+            self._started = True
+
+    def _claim_slot(self):
+        os.makedirs(self.directory, exist_ok=True)
+        slot = 0
+        while True:
+            lock = open(os.path.join(self.directory, f'slot-{slot}.lock'), 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                slot += 1
+                continue
+            self._slot_lock = lock
+            self.slot = f'slot-{slot}'
+            return
+
+    def _recover(self):
+        path = os.path.join(self.directory, f'{self.slot}.journal')
+        checkpoint = db.session.get(WriteBehindCheckpoint, self.slot)
+        self.committed_sequence = checkpoint.sequence if checkpoint else 0
+        self.sequence = self.committed_sequence
+        replay = []
+        if os.path.exists(path):
+            with open(path) as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line was never acknowledged to a client.
+                        break
+                    self.sequence = max(self.sequence, entry['seq'])
+                    if entry['seq'] > self.committed_sequence:
+                        replay.append((entry['seq'], entry['event']))
+        db.session.remove()
+        self._pending.extend(replay)
+        self._journal = open(path, 'a')
+        if replay:
+            logging.info("Write-behind %s replaying %d journaled events", self.slot, len(replay))
+
+    def submit(self, events):
+        """Journal and enqueue scan events; returns the sequence of the last one.
+
+        Raises ValueError for a malformed event and QueueFull when the
+        queue stays at its depth limit for longer than the enqueue timeout.
+        """
+        entries = []
+        for event in events:
+            parsed = validate_scan_event(event)
+            parsed['timestamp'] = parsed['timestamp'].isoformat()
+            entries.append(parsed)
+
+        self._ensure_started()
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self._condition:
+            while len(self._pending) + len(entries) > self.max_depth:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QueueFull(f'write-behind queue is at its limit of {self.max_depth} events')
+                self._condition.wait(remaining)
+
+            journaled = []
+            for event in entries:
+                self.sequence += 1
+                journaled.append((self.sequence, event))
+            self._journal.write(''.join(json.dumps({'seq': seq, 'event': event}) + '\n'
+                                        for seq, event in journaled))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._pending.extend(journaled)
+            self.metrics['enqueued'] += len(journaled)
+            self._condition.notify_all()
+            return self.sequence
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            # Give the batch up to max_latency to fill before committing it.
+            deadline = time.monotonic() + self.max_latency
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+
+    def _run(self):
+        while True:
+            self._process(self._next_batch())
+
+    def _process(self, batch):
+        try:
+            with self.app.app_context():
+                self._drain(batch)
+        except Exception:
+            # Say the dead-letter file cannot be written. The writer must
+            # not die over it: what was not committed goes back on the queue.
+            logging.exception("Write-behind drain of %d events failed; retrying", len(batch))
+            with self._condition:
+                self._pending.extendleft(reversed([entry for entry in batch if entry[0] > self.committed_sequence]))
+                self.metrics['commit_failures'] += 1
+            time.sleep(1)
+
+    def _drain(self, batch):
+        """Commit ``batch`` in order, halving the parts that fail until the bad events are found."""
+        parts = deque([batch])
+        while parts:
+            part = parts.popleft()
+            try:
+                try:
+                    results, changes, elapsed = self._commit(part)
+                except TRANSIENT_ERRORS:
+                    raise
+                except Exception as e:
+                    with self._condition:
+                        self.metrics['commit_failures'] += 1
+                    if len(part) > 1:
+                        middle = len(part) // 2
+                        parts.extendleft([part[middle:], part[:middle]])
+                    else:
+                        self._dead_letter(part[0], e)
+                    continue
+            except TRANSIENT_ERRORS:
+                logging.exception("Write-behind commit of %d events failed; retrying", len(part))
+                with self._condition:
+                    self._pending.extendleft(reversed([entry for rest in (part, *parts) for entry in rest]))
+                    self.metrics['commit_failures'] += 1
+                time.sleep(1)
+                return
+            # Outside the retries: the part is committed and must not be
+            # applied again whatever happens from here on.
+            self._committed(part, results, changes, elapsed)
+
+    def _commit(self, batch):
+        """Commit ``batch``; returns its results, status changes and the seconds it took."""
+        started = time.perf_counter()
+        try:
+            results, changes = apply_scan_events([event for _, event in batch])
+            db.session.merge(WriteBehindCheckpoint(slot=self.slot, sequence=batch[-1][0]))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return results, changes, time.perf_counter() - started
+
+    def _committed(self, batch, results, changes, elapsed):
+        with self._condition:
+            self.committed_sequence = batch[-1][0]
+        try:
+            publish_status_changes(changes)
+        except Exception:
+            # The cache, broker or load index missed these; the database has them.
+            logging.exception("Write-behind could not publish %d status changes", len(changes))
+        try:
+            self._record_commit(batch, results, elapsed)
+        except Exception:
+            logging.exception("Write-behind could not record a commit of %d events", len(batch))
+
+    def _dead_letter(self, entry, error):
+        """Set aside an event the database refused, and move the checkpoint past it.
+
+        Should the checkpoint fail, the retry writes the line again; lines
+        carry the event's sequence.
+        """
+        sequence, event = entry
+        # The driver's message, without the statement and its parameters.
+        error = str(getattr(error, 'orig', None) or error)
+        logging.error("Write-behind moved event %d for %s to the dead-letter file: %s",
+                      sequence, event.get('tracking_number'), error)
+        with open(os.path.join(self.directory, f'{self.slot}.dead-letter'), 'a') as dead_letter:
+            dead_letter.write(json.dumps({'seq': sequence, 'event': event, 'error': error[:500],
+                                          'failed_at': datetime.utcnow().isoformat()}, default=str) + '\n')
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+        try:
+            db.session.merge(WriteBehindCheckpoint(slot=self.slot, sequence=sequence))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        with self._condition:
+            self.committed_sequence = sequence
+            self.metrics['dead_lettered'] += 1
+            self._condition.notify_all()
+
+    def _record_commit(self, batch, results, elapsed):
+        rejected = [result for result in results if result['result'] != 'applied']
+        for result in rejected:
+            logging.warning("Write-behind dropped event for %s: %s",
+                            result['tracking_number'], result.get('error'))
+        with self._condition:
+            self.metrics['commits'] += 1
+            self.metrics['committed'] += len(batch) - len(rejected)
+            self.metrics['rejected'] += len(rejected)
+            self.metrics['last_commit_seconds'] = round(elapsed, 6)
+            bucket = next((b for b in BATCH_SIZE_BUCKETS if len(batch) <= b), '+Inf')
+            self.metrics['batch_sizes'][bucket] += 1
+            # Everything journaled is committed: start the journal afresh.
+            if (not self._pending and self.committed_sequence == self.sequence
+                    and self._journal.tell() > self.compact_bytes):
+                self._journal.truncate(0)
+                self._journal.seek(0)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'enabled': self.enabled,
+                'slot': self.slot,
+                'queue_depth': len(self._pending),
+                'sequence': self.sequence,
+                'committed_sequence': self.committed_sequence,
+                **self.metrics,
+                'batch_sizes': {str(bucket): count for bucket, count in self.metrics['batch_sizes'].items()},
+            }
+
+
+write_behind = WriteBehindQueue()